@@ -4,17 +4,20 @@
 """The MR Fat Controller CLI application."""
 
 import asyncio
+import json
+import signal
 
 from typer import Typer
 
 from mr_fat_controller.cli import execute_setup
+from mr_fat_controller.traffic import record_traffic, replay_traffic
 from mr_fat_controller.withrottle import withrottle_mqtt_bridge
 
 app = Typer()
 
 
 @app.command()
-def setup(drop_existing: bool = False, revert_last: int = 0) -> None:  # noqa:FBT001, FBT002
+def setup(drop_existing: bool = False, revert_last: int = 0) -> None:  # noqa: FBT001, FBT002
     """Set up the database."""
     asyncio.run(execute_setup(drop_existing=drop_existing, revert_last=revert_last))
 
@@ -25,4 +28,30 @@ def withrottle_bridge() -> None:
     asyncio.run(withrottle_mqtt_bridge())
 
 
+async def record_until_interrupted(path: str, duration: float | None) -> int:
+    """Record all MQTT traffic to the file at `path` until the `duration` has passed or the user interrupts it."""
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGINT, stop.set)
+    return await record_traffic(path, duration, stop)
+
+
+@app.command()
+def record(path: str, duration: float = 0) -> None:
+    """Record all MQTT traffic to a file, for `duration` seconds or until interrupted."""
+    count = asyncio.run(record_until_interrupted(path, duration if duration > 0 else None))
+    print(json.dumps({"path": path, "recorded": count}, indent=2))  # noqa: T201
+
+
+@app.command()
+def replay(path: str, speed: float = 1, direct: bool = False, discovery: bool = True) -> None:  # noqa: FBT001, FBT002
+    """Replay recorded MQTT traffic at `speed` times the original rate, or as fast as possible for a speed of 0.
+
+    With `direct` the traffic is passed straight into the server's state processing instead of the broker. With
+    `no-discovery` the discovery messages are skipped, so that the database is not changed.
+    """
+    print(  # noqa: T201
+        json.dumps(asyncio.run(replay_traffic(path, speed, direct=direct, discovery=discovery)), indent=2)
+    )
+
+
 app()
@@ -0,0 +1,77 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Device activity tracking."""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import bindparam, update
+
+from mr_fat_controller.models import Device, db_session
+from mr_fat_controller.registry import entity_registry
+from mr_fat_controller.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceActivity:
+    """Tracks when each device was last seen.
+
+    Activity is only recorded in memory and written to the devices' `last_seen` in a single bulk update every
+    `flush_interval` seconds, so that recording it never waits for the database.
+    """
+
+    def __init__(self, flush_interval: float = 10) -> None:
+        """Initialise the tracker without any known devices."""
+        self.flush_interval = flush_interval
+        self.last_seen: dict[int, datetime] = {}
+        self._task: asyncio.Task | None = None
+
+    def seen(self, entity_topic: str) -> None:
+        """Note that the device of the entity with the given state topic was active."""
+        entry = entity_registry.find_by_state_topic(entity_topic)
+        if entry is not None and entry.device_id is not None:
+            self.last_seen[entry.device_id] = datetime.now(tz=timezone.utc).replace(tzinfo=None)  # noqa: UP017
+
+    async def flush(self) -> None:
+        """Write all activity since the last flush to the database."""
+        if self.last_seen:
+            last_seen = self.last_seen
+            self.last_seen = {}
+            try:
+                async with (
+                    db_session() as dbsession  # pyright: ignore[reportGeneralTypeIssues]
+                ):
+                    await dbsession.execute(
+                        update(Device.__table__)
+                        .where(Device.__table__.c.id == bindparam("device_id"))
+                        .values(last_seen=bindparam("seen_at")),
+                        [{"device_id": device_id, "seen_at": timestamp} for device_id, timestamp in last_seen.items()],
+                    )
+                    await dbsession.commit()
+            except Exception as e:
+                for device_id, timestamp in last_seen.items():
+                    self.last_seen.setdefault(device_id, timestamp)
+                logger.error(e)
+
+    def start(self) -> None:
+        """Start flushing the activity periodically."""
+        self._task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        """Stop flushing periodically and flush any remaining activity."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _flush_periodically(self) -> None:
+        """Flush the activity every `flush_interval` seconds."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+device_activity = DeviceActivity(settings.state.activity_flush_interval)
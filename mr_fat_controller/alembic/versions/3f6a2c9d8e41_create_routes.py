@@ -0,0 +1,48 @@
+"""Create routes.
+
+Revision ID: 3f6a2c9d8e41
+Revises: 95651fc3abf7
+Create Date: 2026-10-18 10:12:45.102938
+"""
+
+from alembic import op
+from sqlalchemy import Column, ForeignKey, Integer, Unicode
+
+# revision identifiers, used by Alembic.
+revision = "3f6a2c9d8e41"
+down_revision = "95651fc3abf7"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Create the routes tables."""
+    op.create_table(
+        "routes",
+        Column("id", Integer, primary_key=True),
+        Column("name", Unicode(255)),
+    )
+    op.create_table(
+        "route_points",
+        Column("route_id", Integer, ForeignKey("routes.id", ondelete="CASCADE"), primary_key=True),
+        Column("points_id", Integer, ForeignKey("points.id", ondelete="CASCADE"), primary_key=True),
+        Column("state", Unicode(255)),
+    )
+    op.create_table(
+        "route_signals",
+        Column("route_id", Integer, ForeignKey("routes.id", ondelete="CASCADE"), primary_key=True),
+        Column("signal_id", Integer, ForeignKey("signals.id", ondelete="CASCADE"), primary_key=True),
+    )
+    op.create_table(
+        "route_block_detectors",
+        Column("route_id", Integer, ForeignKey("routes.id", ondelete="CASCADE"), primary_key=True),
+        Column("block_detector_id", Integer, ForeignKey("block_detectors.id", ondelete="CASCADE"), primary_key=True),
+    )
+
+
+def downgrade() -> None:
+    """Drop the routes tables."""
+    op.drop_table("route_block_detectors")
+    op.drop_table("route_signals")
+    op.drop_table("route_points")
+    op.drop_table("routes")
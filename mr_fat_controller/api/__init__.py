@@ -6,6 +6,7 @@
 import logging
 
 from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -15,12 +16,16 @@ from mr_fat_controller.api.devices import router as device_router
 from mr_fat_controller.api.entities import router as entities_router
 from mr_fat_controller.api.points import router as points_router
 from mr_fat_controller.api.power_switches import router as power_switches_router
+from mr_fat_controller.api.routes import router as routes_router
 from mr_fat_controller.api.signal_automations import router as signal_automations_router
 from mr_fat_controller.api.signals import router as signals_router
 from mr_fat_controller.api.state import router as state_router
 from mr_fat_controller.api.train_controllers import router as train_controllers_router
 from mr_fat_controller.api.trains import router as trains_router
+from mr_fat_controller.automation.executor import automation_executor
+from mr_fat_controller.metrics import registry as metrics_registry
 from mr_fat_controller.models import inject_db_session
+from mr_fat_controller.mqtt import cluster_node, discovery_batcher, mqtt_ingestion, mqtt_publisher
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api")
@@ -29,6 +34,7 @@ router.include_router(device_router)
 router.include_router(entities_router)
 router.include_router(power_switches_router)
 router.include_router(points_router)
+router.include_router(routes_router)
 router.include_router(signal_automations_router)
 router.include_router(signals_router)
 router.include_router(state_router)
@@ -52,3 +58,39 @@ async def status(dbsession: AsyncSession = Depends(inject_db_session)) -> dict:
     except Exception as e:
         logger.error(e)
         return {"ready": False}
+
+
+@router.get("/mqtt/publisher")
+async def mqtt_publisher_stats() -> dict:
+    """Return the MQTT publishing statistics."""
+    return mqtt_publisher.stats()
+
+
+@router.get("/mqtt/ingestion")
+async def mqtt_ingestion_stats() -> dict:
+    """Return the MQTT ingestion statistics."""
+    return mqtt_ingestion.stats()
+
+
+@router.get("/mqtt/discovery")
+async def mqtt_discovery_stats() -> dict:
+    """Return the MQTT discovery statistics."""
+    return discovery_batcher.stats()
+
+
+@router.get("/cluster")
+async def cluster_stats() -> dict:
+    """Return the cluster statistics."""
+    return cluster_node.stats()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> str:
+    """Return all runtime metrics in the Prometheus text format."""
+    return metrics_registry.render()
+
+
+@router.get("/automations")
+async def automation_stats() -> dict:
+    """Return the automation execution statistics."""
+    return automation_executor.stats()
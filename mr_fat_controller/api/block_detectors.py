@@ -9,8 +9,15 @@ from pydantic import BaseModel
 from sqlalchemy import select
 from sqlalchemy.orm import joinedload, selectinload
 
+from mr_fat_controller.automation import load_automations
 from mr_fat_controller.models import BlockDetector, BlockDetectorModel, inject_db_session
-from mr_fat_controller.mqtt import full_state_refresh, recalculate_state
+from mr_fat_controller.mqtt import (
+    full_state_refresh,
+    refresh_state,
+    refresh_states,
+    remove_model_state,
+    signal_automation_models,
+)
 
 router = APIRouter(prefix="/block-detectors")
 
@@ -29,7 +36,7 @@ async def create_block_detector(data: CreateBlockDetectorModel, dbsession=Depend
     )
     dbsession.add(block_detector)
     await dbsession.commit()
-    await recalculate_state()
+    await refresh_state("block_detector", block_detector.id)  # type: ignore
     await full_state_refresh()
     return await get_block_detector(block_detector.id, dbsession=dbsession)  # pyright: ignore [reportArgumentType]
 
@@ -71,9 +78,12 @@ async def delete_block_detector(bid: int, dbsession=Depends(inject_db_session))
     )
     block_detector = (await dbsession.execute(query)).scalar()
     if block_detector is not None:
+        models = signal_automation_models(block_detector.signal_automations)
         await dbsession.delete(block_detector)
         await dbsession.commit()
-        await recalculate_state()
+        await remove_model_state("block_detector", bid)
+        await load_automations()
+        await refresh_states(model for model in models if model != ("block_detector", bid))
         await full_state_refresh()
     else:
         raise HTTPException(404, "No such block detector found")
@@ -9,6 +9,7 @@ from sqlalchemy import select
 from sqlalchemy.orm import selectinload
 
 from mr_fat_controller.models import Device, DeviceModel, inject_db_session
+from mr_fat_controller.mqtt import remove_device_state
 
 router = APIRouter(prefix="/devices")
 
@@ -30,5 +31,6 @@ async def delete_device(did: int, dbsession=Depends(inject_db_session)) -> None:
     if entity:
         await dbsession.delete(entity)
         await dbsession.commit()
+        await remove_device_state(did)
     else:
         raise HTTPException(404)
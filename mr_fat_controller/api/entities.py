@@ -9,6 +9,7 @@ from sqlalchemy import select
 from sqlalchemy.orm import selectinload
 
 from mr_fat_controller.models import Entity, EntityModel, inject_db_session
+from mr_fat_controller.mqtt import remove_entity_state
 
 router = APIRouter(prefix="/entities")
 
@@ -41,5 +42,6 @@ async def delete_entity(eid: int, dbsession=Depends(inject_db_session)) -> None:
     if entity:
         await dbsession.delete(entity)
         await dbsession.commit()
+        await remove_entity_state(eid)
     else:
         raise HTTPException(404)
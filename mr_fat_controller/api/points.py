@@ -9,8 +9,15 @@ from pydantic import BaseModel
 from sqlalchemy import select
 from sqlalchemy.orm import joinedload, selectinload
 
+from mr_fat_controller.automation import load_automations
 from mr_fat_controller.models import Points, PointsModel, inject_db_session
-from mr_fat_controller.mqtt import full_state_refresh, recalculate_state
+from mr_fat_controller.mqtt import (
+    full_state_refresh,
+    refresh_state,
+    refresh_states,
+    remove_model_state,
+    signal_automation_models,
+)
 
 router = APIRouter(prefix="/points")
 
@@ -33,7 +40,7 @@ async def create_points(data: CreatePointsModel, dbsession=Depends(inject_db_ses
     )
     dbsession.add(points)
     await dbsession.commit()
-    await recalculate_state()
+    await refresh_state("points", points.id)  # type: ignore
     await full_state_refresh()
     return await get_points(points.id, dbsession=dbsession)  # pyright: ignore [reportArgumentType]
 
@@ -86,7 +93,7 @@ async def put_points(pid: int, data: PatchPointsModel, dbsession=Depends(inject_
         points.through_state = data.through_state
         await dbsession.commit()
         await dbsession.refresh(points)
-        await recalculate_state()
+        await refresh_state("points", pid)
         return points
     else:
         raise HTTPException(404)
@@ -103,7 +110,11 @@ async def delete_points(pid: int, dbsession=Depends(inject_db_session)) -> None:
     result = await dbsession.execute(query)
     points = result.scalar()
     if points is not None:
+        models = signal_automation_models(points.signal_automations)
         await dbsession.delete(points)
         await dbsession.commit()
+        await remove_model_state("points", pid)
+        await load_automations()
+        await refresh_states(model for model in models if model != ("points", pid))
     else:
         raise HTTPException(404)
@@ -10,7 +10,7 @@ from sqlalchemy import select
 from sqlalchemy.orm import joinedload
 
 from mr_fat_controller.models import PowerSwitch, PowerSwitchModel, inject_db_session
-from mr_fat_controller.mqtt import full_state_refresh, recalculate_state
+from mr_fat_controller.mqtt import full_state_refresh, refresh_state, remove_model_state
 
 router = APIRouter(prefix="/power-switches")
 
@@ -29,7 +29,7 @@ async def create_power_switch(data: CreatePowerSwitchModel, dbsession=Depends(in
     )
     dbsession.add(power_switch)
     await dbsession.commit()
-    await recalculate_state()
+    await refresh_state("power_switch", power_switch.id)  # type: ignore
     await full_state_refresh()
     return await get_power_switch(power_switch.id, dbsession=dbsession)  # pyright: ignore [reportArgumentType]
 
@@ -61,7 +61,7 @@ async def delete_power_switches(psid: int, dbsession=Depends(inject_db_session))
     if power_switch is not None:
         await dbsession.delete(power_switch)
         await dbsession.commit()
-        await recalculate_state()
+        await remove_model_state("power_switch", psid)
         await full_state_refresh()
     else:
         raise HTTPException(404, "No such power switch found")
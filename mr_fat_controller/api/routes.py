@@ -0,0 +1,178 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""API endpoints for routes."""
+
+from typing import Literal
+
+from fastapi import APIRouter, Depends
+from fastapi.exceptions import HTTPException
+from pydantic import BaseModel
+from sqlalchemy import Select, select
+from sqlalchemy.orm import selectinload
+
+from mr_fat_controller.automation import load_automations
+from mr_fat_controller.automation.routes import request_route, route_engine
+from mr_fat_controller.models import (
+    BlockDetector,
+    Points,
+    Route,
+    RouteBlockDetector,
+    RouteModel,
+    RoutePoints,
+    RouteSignal,
+    Signal,
+    inject_db_session,
+)
+from mr_fat_controller.mqtt import cluster_node
+
+router = APIRouter(prefix="/routes")
+
+
+class RoutePointsDataModel(BaseModel):
+    """Model for validating the position of one set of points in a route."""
+
+    points: int
+    state: Literal["through", "diverge"]
+
+
+class CreateRouteModel(BaseModel):
+    """Model for validating a new Route."""
+
+    name: str
+    points: list[RoutePointsDataModel]
+    signals: list[int]
+    block_detectors: list[int]
+
+
+def route_query(rid: int | None = None) -> Select:
+    """Return the query for all routes or, if `rid` is given, for a single route."""
+    query = select(Route).options(
+        selectinload(Route.points), selectinload(Route.signals), selectinload(Route.block_detectors)
+    )
+    if rid is not None:
+        query = query.filter(Route.id == rid)
+    return query
+
+
+async def check_exists(dbsession, model: type[BlockDetector | Points | Signal], ids: set[int], label: str) -> None:
+    """Raise a 422 `HTTPException` unless all `ids` exist for the `model`."""
+    if ids:
+        result = await dbsession.execute(select(model.id).filter(model.id.in_(ids)))
+        missing = ids - set(result.scalars())
+        if missing:
+            raise HTTPException(422, f"No such {label} found: {', '.join(str(mid) for mid in sorted(missing))}")
+
+
+async def apply_route_data(route: Route, data: CreateRouteModel, dbsession) -> None:
+    """Validate the `data` against the database and apply it to the `route`.
+
+    Points listed more than once are only allowed if they are listed with the same state.
+    """
+    points: dict[int, str] = {}
+    for entry in data.points:
+        if points.setdefault(entry.points, entry.state) != entry.state:
+            raise HTTPException(422, f"Points {entry.points} are listed with conflicting states")
+    await check_exists(dbsession, Points, set(points), "points")
+    await check_exists(dbsession, Signal, set(data.signals), "signal")
+    await check_exists(dbsession, BlockDetector, set(data.block_detectors), "block detector")
+    route.name = data.name
+    route.points = [RoutePoints(points_id=points_id, state=state) for points_id, state in points.items()]
+    route.signals = [RouteSignal(signal_id=signal_id) for signal_id in set(data.signals)]
+    route.block_detectors = [
+        RouteBlockDetector(block_detector_id=block_detector_id) for block_detector_id in set(data.block_detectors)
+    ]
+
+
+@router.post("", response_model=RouteModel)
+async def create_route(data: CreateRouteModel, dbsession=Depends(inject_db_session)) -> Route:
+    """Create a new Route."""
+    route = Route()
+    await apply_route_data(route, data, dbsession)
+    dbsession.add(route)
+    await dbsession.commit()
+    await load_automations()
+    cluster_node.models_changed()
+    return route
+
+
+@router.get("", response_model=list[RouteModel])
+async def get_routes(dbsession=Depends(inject_db_session)) -> list[Route]:
+    """Get all Routes."""
+    result = await dbsession.execute(route_query().order_by(Route.id))
+    return list(result.scalars())
+
+
+@router.get("/status")
+async def get_routes_status() -> list[dict]:
+    """Get the status of all Routes."""
+    return route_engine.status()
+
+
+@router.get("/{rid}", response_model=RouteModel)
+async def get_route(rid: int, dbsession=Depends(inject_db_session)) -> Route:
+    """Get a Route."""
+    route = (await dbsession.execute(route_query(rid))).scalar()
+    if route is not None:
+        return route
+    else:
+        raise HTTPException(404, "No such Route found")
+
+
+class UpdateRouteModel(CreateRouteModel):
+    """Model for validating an update to a Route."""
+
+    id: int
+
+
+@router.put("/{rid}", response_model=RouteModel)
+async def update_route(rid: int, data: UpdateRouteModel, dbsession=Depends(inject_db_session)) -> Route:
+    """Update a Route."""
+    route = (await dbsession.execute(route_query(rid))).scalar()
+    if route is not None:
+        await apply_route_data(route, data, dbsession)
+        await dbsession.commit()
+        await load_automations()
+        cluster_node.models_changed()
+        return route
+    else:
+        raise HTTPException(404, "No such Route found")
+
+
+@router.delete("/{rid}", status_code=204)
+async def delete_route(rid: int, dbsession=Depends(inject_db_session)) -> None:
+    """Delete a Route."""
+    route = (await dbsession.execute(route_query(rid))).scalar()
+    if route is not None:
+        if rid in route_engine.index:
+            await leader_request("release", rid)
+        await dbsession.delete(route)
+        await dbsession.commit()
+        await load_automations()
+        cluster_node.models_changed()
+    else:
+        raise HTTPException(404, "No such Route found")
+
+
+async def leader_request(action: str, rid: int) -> None:
+    """Set or release the Route on the leader, raising the matching `HTTPException` if that fails."""
+    try:
+        result = await request_route(action, rid)
+    except TimeoutError as e:
+        raise HTTPException(503, "The cluster leader did not respond") from e
+    if result == "not_found":
+        raise HTTPException(404, "No such Route found")
+    elif result == "conflict":
+        raise HTTPException(409, "Route conflicts with a set route or is occupied")
+
+
+@router.post("/{rid}/set", status_code=204)
+async def set_route(rid: int) -> None:
+    """Set a Route, if it does not conflict with a set Route and its block detectors are free."""
+    await leader_request("set", rid)
+
+
+@router.post("/{rid}/release", status_code=204)
+async def release_route(rid: int) -> None:
+    """Release a Route."""
+    await leader_request("release", rid)
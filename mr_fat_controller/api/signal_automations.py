@@ -9,8 +9,9 @@ from pydantic import BaseModel
 from sqlalchemy import select
 from sqlalchemy.orm import joinedload
 
+from mr_fat_controller.automation import load_automations
 from mr_fat_controller.models import SignalAutomation, SignalAutomationModel, inject_db_session
-from mr_fat_controller.mqtt import full_state_refresh, recalculate_state
+from mr_fat_controller.mqtt import full_state_refresh, refresh_states, signal_automation_models
 
 router = APIRouter(prefix="/signal-automations")
 
@@ -39,7 +40,8 @@ async def create_signal_automation(
     )
     dbsession.add(signal_automation)
     await dbsession.commit()
-    await recalculate_state()
+    await refresh_states(signal_automation_models([signal_automation]))
+    await load_automations()
     await full_state_refresh()
     query = (
         select(SignalAutomation)
@@ -116,6 +118,7 @@ async def update_signal_automation(
     )
     signal_automation = (await dbsession.execute(query)).scalar()
     if signal_automation is not None:
+        models = signal_automation_models([signal_automation])
         signal_automation.name = data.name
         signal_automation.signal_id = data.signal
         signal_automation.block_detector_id = data.block_detector
@@ -123,7 +126,8 @@ async def update_signal_automation(
         signal_automation.points_state = data.points_state
         await dbsession.commit()
         await dbsession.refresh(signal_automation)
-        await recalculate_state()
+        await refresh_states(models + signal_automation_models([signal_automation]))
+        await load_automations()
         await full_state_refresh()
         return signal_automation
     else:
@@ -144,9 +148,11 @@ async def delete_signal_automation(sid: int, dbsession=Depends(inject_db_session
     )
     signal_automation = (await dbsession.execute(query)).scalar()
     if signal_automation is not None:
+        models = signal_automation_models([signal_automation])
         await dbsession.delete(signal_automation)
         await dbsession.commit()
-        await recalculate_state()
+        await refresh_states(models)
+        await load_automations()
         await full_state_refresh()
     else:
         raise HTTPException(404, "No such SignalAutomation found")
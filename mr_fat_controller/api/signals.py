@@ -9,8 +9,15 @@ from pydantic import BaseModel
 from sqlalchemy import select
 from sqlalchemy.orm import joinedload, selectinload
 
+from mr_fat_controller.automation import load_automations
 from mr_fat_controller.models import Signal, SignalModel, inject_db_session
-from mr_fat_controller.mqtt import full_state_refresh, recalculate_state
+from mr_fat_controller.mqtt import (
+    full_state_refresh,
+    refresh_state,
+    refresh_states,
+    remove_model_state,
+    signal_automation_models,
+)
 
 router = APIRouter(prefix="/signals")
 
@@ -29,7 +36,7 @@ async def create_signal(data: CreateSignalModel, dbsession=Depends(inject_db_ses
     )
     dbsession.add(signal)
     await dbsession.commit()
-    await recalculate_state()
+    await refresh_state("signal", signal.id)  # type: ignore
     await full_state_refresh()
     return await get_signal(signal.id, dbsession=dbsession)  # pyright: ignore [reportArgumentType]
 
@@ -69,9 +76,12 @@ async def delete_signal(sid: int, dbsession=Depends(inject_db_session)) -> None:
     )
     signal = (await dbsession.execute(query)).scalar()
     if signal is not None:
+        models = signal_automation_models(signal.signal_automations)
         await dbsession.delete(signal)
         await dbsession.commit()
-        await recalculate_state()
+        await remove_model_state("signal", sid)
+        await load_automations()
+        await refresh_states(model for model in models if model != ("signal", sid))
         await full_state_refresh()
     else:
         raise HTTPException(404, "No such signal found")
@@ -3,106 +3,218 @@
 # SPDX-License-Identifier: MIT
 """State API."""
 
-import json
 import logging
+import math
+from time import perf_counter, time
 
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
 
-from mr_fat_controller.models import Entity, Points, PowerSwitch, Train, db_session
-from mr_fat_controller.mqtt import mqtt_client
-from mr_fat_controller.state import state_manager
+from mr_fat_controller import codec
+from mr_fat_controller.metrics import websocket_clients, websocket_send_seconds
+from mr_fat_controller.mqtt import mqtt_publisher, rebuild_stats, recalculate_state
+from mr_fat_controller.registry import entity_registry
+from mr_fat_controller.state import StateChange, Subscription, TrainRecord, state_manager
+from mr_fat_controller.state.history import STATE_VALUES, Aggregate, wall_clock_offset
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/state")
 
 
+@router.get("/listeners")
+async def state_listeners() -> list[dict]:
+    """Return the delivery statistics for all state listeners."""
+    return state_manager.listener_stats()
+
+
+@router.get("/reducers")
+async def state_reducers() -> list[dict]:
+    """Return the timing statistics for all state reducers."""
+    return state_manager.reducer_stats()
+
+
+@router.post("/resync", status_code=204)
+async def state_resync() -> None:
+    """Rebuild the full state from the database."""
+    await recalculate_state()
+
+
+@router.get("/rebuild")
+async def state_rebuild() -> dict:
+    """Return the timings of the last full state rebuild."""
+    return rebuild_stats
+
+
+@router.get("/history/{type_}/{mid}")
+async def state_history(
+    type_: str,
+    mid: int,
+    since: float | None = None,
+    until: float | None = None,
+    buckets: int | None = None,
+    aggregate: Aggregate = "last",
+) -> dict:
+    """Return the recorded history for a single model.
+
+    By default the last five minutes are returned. If `buckets` is set, then the history between `since` and
+    `until` is downsampled into that many equally long buckets, using the `aggregate` function. Unknown states are
+    returned as `null`.
+    """
+    record = state_manager.find(type_, mid)
+    if state_manager.history is None or record is None:
+        raise HTTPException(404, "No such history found")
+    until = until if until is not None else time()
+    since = since if since is not None else until - 300
+    if since >= until:
+        raise HTTPException(422, "The history must start before it ends")
+    buffer = state_manager.history.buffers.get(record.topic)
+    offset = wall_clock_offset()
+    if buffer is None:
+        times, values = [], []
+    elif buckets is not None:
+        if buckets < 1 or buckets > buffer.size:
+            raise HTTPException(422, f"The number of buckets must be between 1 and {buffer.size}")
+        times, values = buffer.downsample(since - offset, until - offset, buckets, aggregate)
+    else:
+        times, values = buffer.window(since - offset, until - offset)
+    return {
+        "topic": record.topic,
+        "type": record.type,
+        "states": STATE_VALUES.get(record.type, {}),
+        "times": [timestamp + offset for timestamp in times],
+        "values": [None if math.isnan(value) else value for value in values],
+    }
+
+
+def parse_subscription(types: str | None, models: str | None) -> Subscription:
+    """Parse the comma-separated `types` and `type:id` `models` into a `Subscription`.
+
+    Raises a `ValueError` if any of the `models` is not a valid `type:id`.
+    """
+    model_ids = None
+    if models:
+        model_ids = set()
+        for model in models.split(","):
+            model_type, model_id = model.rsplit(":", 1)
+            model_ids.add((model_type, int(model_id)))
+    return Subscription(
+        types=frozenset(types.split(",")) if types else None,
+        models=frozenset(model_ids) if model_ids is not None else None,
+    )
+
+
 @router.websocket("")
-async def state_socket(websocket: WebSocket) -> None:
-    """Handle connections to the state Websocket."""
+async def state_socket(
+    websocket: WebSocket,
+    epoch: str | None = None,
+    sequence: int | None = None,
+    types: str | None = None,
+    models: str | None = None,
+) -> None:
+    """Handle connections to the state Websocket.
+
+    A reconnecting client can pass the `epoch` and `sequence` of the last state message it received, in which
+    case it is only sent the changes since then. All other clients start with a full state snapshot. Each message
+    contains the changed records in its `payload`, the changed fields of records in its `diffs`, and the topics
+    that are no longer part of the state in `removed`.
+
+    A client that only shows parts of the state can restrict the state it is sent to a comma-separated list of
+    state `types` and / or a comma-separated list of `models` given as `type:id`. If these are invalid, then the
+    connection is closed with a policy violation.
+    """
     await websocket.accept()
+    try:
+        subscription = parse_subscription(types, models)
+    except ValueError as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e))
+        return
 
-    async def state_updates(state: dict, change_topic: str | None) -> None:
-        if change_topic is not None and change_topic in state:
-            await websocket.send_json({"type": "state", "payload": {change_topic: state[change_topic]}})
+    async def state_updates(state: dict, change: StateChange) -> None:
+        diffs = {}
+        removed = []
+        if change.topics is not None:
+            for topic in change.topics:
+                if topic not in state:
+                    removed.append(topic)
+                elif topic in change.diffs:
+                    diffs[topic] = change.diffs[topic]
+            payload = state_manager.encoded_topics(
+                topic for topic in change.topics if topic in state and topic not in diffs
+            )
+            full = False
+        elif subscription.everything:
+            payload = state_manager.encoded()
+            full = True
         else:
-            await websocket.send_json({"type": "state", "payload": state})
+            payload = state_manager.encoded_topics(
+                topic for topic, record in state.items() if subscription.matches(topic, record)
+            )
+            full = True
+        start = perf_counter()
+        await websocket.send_bytes(
+            b'{"type":"state","epoch":'
+            + codec.dumps(state_manager.epoch)
+            + b',"sequence":'
+            + str(change.sequence).encode()
+            + b',"full":'
+            + (b"true" if full else b"false")
+            + b',"payload":'
+            + payload
+            + b',"diffs":'
+            + codec.dumps(diffs)
+            + b',"removed":'
+            + codec.dumps(removed)
+            + b"}"
+        )
+        websocket_send_seconds.observe(perf_counter() - start)
 
-    await state_manager.add_listener(state_updates)
+    websocket_clients.inc()
+    await state_manager.add_listener(
+        state_updates, resume_from=sequence if epoch == state_manager.epoch else None, subscription=subscription
+    )
 
     try:
-        async with mqtt_client() as client:
-            while True:
-                data = await websocket.receive_json()
-                if data["type"] == "set-points":
-                    async with db_session() as dbsession:
-                        query = (
-                            select(Entity)
-                            .join(Entity.points)
-                            .filter(Points.id == data["payload"]["id"])
-                            .options(selectinload(Entity.points))
+        while True:
+            data = codec.loads(await websocket.receive_text())
+            if data["type"] == "set-points":
+                entry = entity_registry.find("points", data["payload"]["id"])
+                if entry is not None and entry.command_topic is not None:
+                    if data["payload"]["state"] == "through":
+                        mqtt_publisher.publish(entry.command_topic, codec.dumps({"state": entry.through_state}))
+                    elif data["payload"]["state"] == "diverge":
+                        mqtt_publisher.publish(entry.command_topic, codec.dumps({"state": entry.diverge_state}))
+            elif data["type"] == "set-power_switch":
+                entry = entity_registry.find("power_switch", data["payload"]["id"])
+                if entry is not None and entry.command_topic is not None:
+                    mqtt_publisher.publish(
+                        entry.command_topic, codec.dumps({"state": data["payload"]["state"].upper()})
+                    )
+            elif data["type"] == "set-reverser":
+                entry = entity_registry.find("train", data["payload"]["id"])
+                if entry is not None and entry.command_topic is not None:
+                    mqtt_publisher.publish(entry.command_topic, codec.dumps({"direction": data["payload"]["state"]}))
+            elif data["type"] == "set-speed":
+                entry = entity_registry.find("train", data["payload"]["id"])
+                if entry is not None and entry.command_topic is not None:
+                    mqtt_publisher.publish(entry.command_topic, codec.dumps({"speed": data["payload"]["state"]}))
+            elif data["type"] == "toggle-decoder-function":
+                train = state_manager.find("train", data["payload"]["id"])
+                entry = entity_registry.find("train", data["payload"]["id"])
+                if (
+                    isinstance(train, TrainRecord)
+                    and data["payload"]["state"] in train.functions
+                    and entry is not None
+                    and entry.command_topic is not None
+                ):
+                    if train.functions[data["payload"]["state"]]["state"] == "off":
+                        mqtt_publisher.publish(
+                            entry.command_topic, codec.dumps({"functions": {data["payload"]["state"]: "on"}})
+                        )
+                    else:
+                        mqtt_publisher.publish(
+                            entry.command_topic, codec.dumps({"functions": {data["payload"]["state"]: "off"}})
                         )
-                        result = await dbsession.execute(query)
-                        entity = result.scalar()
-                        if entity is not None:
-                            if data["payload"]["state"] == "through":
-                                await client.publish(
-                                    entity.command_topic,  # type: ignore
-                                    json.dumps({"state": entity.points.through_state}),
-                                )
-                            elif data["payload"]["state"] == "diverge":
-                                await client.publish(
-                                    entity.command_topic,  # type: ignore
-                                    json.dumps({"state": entity.points.diverge_state}),
-                                )
-                elif data["type"] == "set-power_switch":
-                    async with db_session() as dbsession:
-                        query = select(Entity).join(Entity.power_switch).filter(PowerSwitch.id == data["payload"]["id"])
-                        result = await dbsession.execute(query)
-                        entity = result.scalar()
-                        if entity is not None:
-                            await client.publish(
-                                entity.command_topic,  # type: ignore
-                                json.dumps({"state": data["payload"]["state"].upper()}),
-                            )
-                elif data["type"] == "set-reverser":
-                    async with db_session() as dbsession:
-                        query = select(Entity).join(Entity.train).filter(Train.id == data["payload"]["id"])
-                        entity = (await dbsession.execute(query)).scalar()
-                        if entity is not None:
-                            await client.publish(
-                                entity.command_topic,  # type: ignore
-                                json.dumps({"direction": data["payload"]["state"]}),
-                            )
-                elif data["type"] == "set-speed":
-                    async with db_session() as dbsession:
-                        query = select(Entity).join(Entity.train).filter(Train.id == data["payload"]["id"])
-                        entity = (await dbsession.execute(query)).scalar()
-                        if entity is not None:
-                            await client.publish(
-                                entity.command_topic,  # type: ignore
-                                json.dumps({"speed": data["payload"]["state"]}),
-                            )
-                elif data["type"] == "toggle-decoder-function":
-                    async with db_session() as dbsession:
-                        query = select(Entity).join(Entity.train).filter(Train.id == data["payload"]["id"])
-                        entity = (await dbsession.execute(query)).scalar()
-                        if entity is not None:
-                            functions = state_manager.state[entity.state_topic]["functions"]
-                            if data["payload"]["state"] in functions:
-                                if functions[data["payload"]["state"]]["state"] == "off":
-                                    await client.publish(
-                                        entity.command_topic,  # type: ignore
-                                        json.dumps({"functions": {data["payload"]["state"]: "on"}}),
-                                    )
-                                else:
-                                    await client.publish(
-                                        entity.command_topic,  # type: ignore
-                                        json.dumps({"functions": {data["payload"]["state"]: "off"}}),
-                                    )
-                else:
-                    logger.debug(data)
+            else:
+                logger.debug(data)
     except WebSocketDisconnect:
         logger.debug("Websocket disconnected")
     except Exception as e:
@@ -112,4 +224,5 @@ async def state_socket(websocket: WebSocket) -> None:
         except Exception as e2:
             logger.error(e2)
     finally:
+        websocket_clients.dec()
         await state_manager.remove_listener(state_updates)
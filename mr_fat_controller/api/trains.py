@@ -10,7 +10,7 @@ from sqlalchemy import select
 from sqlalchemy.orm import selectinload
 
 from mr_fat_controller.models import Train, TrainModel, inject_db_session
-from mr_fat_controller.mqtt import full_state_refresh, recalculate_state
+from mr_fat_controller.mqtt import full_state_refresh, refresh_state, remove_model_state
 
 router = APIRouter(prefix="/trains")
 
@@ -27,7 +27,7 @@ async def create_train(data: CreateTrainModel, dbsession=Depends(inject_db_sessi
     train = Train(entity_id=data.entity_id, max_speed=0, aerodynamic_resistance=0)
     dbsession.add(train)
     await dbsession.commit()
-    await recalculate_state()
+    await refresh_state("train", train.id)  # type: ignore
     await full_state_refresh()
     return await get_train(train.id, dbsession=dbsession)  # pyright: ignore [reportArgumentType]
 
@@ -85,6 +85,7 @@ async def update_train(tid: int, data: UpdateTrainModel, dbsession=Depends(injec
         train.max_deceleration = data.max_deceleration
         train.aerodynamic_resistance = data.aerodynamic_resistance
         await dbsession.commit()
+        await refresh_state("train", tid)
         return train
     else:
         raise HTTPException(404, "No such train found")
@@ -98,5 +99,6 @@ async def delete_train(tid: int, dbsession=Depends(inject_db_session)) -> None:
     if train is not None:
         await dbsession.delete(train)
         await dbsession.commit()
+        await remove_model_state("train", tid)
     else:
         raise HTTPException(404, "No such train found")
@@ -3,75 +3,100 @@
 # SPDX-License-Identifier: MIT
 """Package containing all automations."""
 
-import asyncio
-import json
-
-from sqlalchemy import select
-from sqlalchemy.orm import joinedload
-
-from mr_fat_controller.models import BlockDetector, Points, Signal, SignalAutomation, db_session
-from mr_fat_controller.mqtt import mqtt_client
-from mr_fat_controller.state import state_manager
-
-
-async def signal_automations(state: dict, change_topic: str | None) -> None:
-    """Automate signal changes based on points and block detectors."""
-    if change_topic is not None and change_topic in state:
-        if state[change_topic]["type"] not in ["points", "block_detector"]:
-            return
-    signals = {}
-    async with db_session() as dbsession:
-        query = select(SignalAutomation).options(
-            joinedload(SignalAutomation.signal).joinedload(Signal.entity),
-            joinedload(SignalAutomation.block_detector).joinedload(BlockDetector.entity),
-            joinedload(SignalAutomation.points).joinedload(Points.entity),
-        )
-        if change_topic is not None:
-            if state[change_topic]["type"] == "block_detector":
-                sub_query = select(SignalAutomation.signal_id).filter(
-                    SignalAutomation.block_detector_id == state[change_topic]["model"]["id"]
-                )
-                query = query.filter(SignalAutomation.signal_id.in_(sub_query))
-            elif state[change_topic]["type"] == "points":
-                query = query.filter(SignalAutomation.points_id == state[change_topic]["model"]["id"])
-        result = await dbsession.execute(query)
-        for signal_automation in result.scalars():
-            new_state = "danger"
-            signal_topic = signal_automation.signal.entity.state_topic
-            block_detector_topic = signal_automation.block_detector.entity.state_topic
-            if signal_topic in state_manager and block_detector_topic in state_manager:
-                if (
-                    signal_automation.points is not None
-                    and signal_automation.points.entity.state_topic in state_manager
-                ):
-                    points_topic = signal_automation.points.entity.state_topic
-                    if state_manager.state[points_topic]["state"] == signal_automation.points_state:
-                        if state_manager.state[block_detector_topic]["state"] == "off":
-                            new_state = "clear"
-                elif state_manager.state[block_detector_topic]["state"] == "off":
-                    new_state = "clear"
-                if signal_topic not in signals:
-                    signals[signal_topic] = [new_state]
-                else:
-                    signals[signal_topic].append(new_state)
-    if len(signals) > 0:
-        await asyncio.sleep(0.1)
-        for signal_topic, signal_state in list(signals.items()):
-            if len(signal_state) == 1:
-                signals[signal_topic] = signal_state[0]
-            elif "clear" in signal_state:
-                signals[signal_topic] = "clear"
-            else:
-                signals[signal_topic] = "danger"
-        async with mqtt_client() as client:
-            for signal_topic, signal_state in signals.items():
-                if signal_state == "danger":
-                    await client.publish(signal_topic, json.dumps({"state": "ON", "color": {"r": 255, "g": 0, "b": 0}}))
-            for signal_topic, signal_state in signals.items():
-                if signal_state == "clear":
-                    await client.publish(signal_topic, json.dumps({"state": "ON", "color": {"r": 0, "g": 255, "b": 0}}))
+import logging
+
+from mr_fat_controller.automation.controller import signal_controller
+from mr_fat_controller.automation.executor import automation_executor
+from mr_fat_controller.automation.graph import automation_graph, load_automation_graph
+from mr_fat_controller.automation.routes import handle_route_request, load_route_engine, route_engine
+from mr_fat_controller.mqtt import cluster_node, load_registry
+from mr_fat_controller.state import StateChange, Subscription, state_manager
+
+logger = logging.getLogger(__name__)
+
+
+async def signal_automations(state: dict, change: StateChange) -> None:
+    """Automate signal changes based on points and block detectors.
+
+    Only the signals affected by the changed points and block detectors are re-evaluated, using the
+    `automation_graph`, and their new aspects passed to the `signal_controller`. Changes to the signals themselves,
+    such as a signal coming back online, only check whether the signal still shows its desired aspect. When running
+    as part of a cluster, only the leader runs the automations.
+    """
+    if not cluster_node.is_leader:
+        return
+    if change.topics is None:
+        signal_ids = automation_graph.signals()
+    else:
+        block_detector_ids = []
+        points_ids = []
+        for topic in change.topics:
+            if topic in state:
+                if state[topic].type == "block_detector":
+                    block_detector_ids.append(state[topic].model_id)
+                elif state[topic].type == "points":
+                    points_ids.append(state[topic].model_id)
+                elif state[topic].type == "signal":
+                    signal_controller.check(state[topic].model_id)
+        signal_ids = automation_graph.affected_signals(block_detector_ids, points_ids)
+    for signal_id in signal_ids:
+        aspect = automation_graph.evaluate(signal_id, state_manager)
+        if aspect is not None:
+            signal_controller.set_desired(signal_id, aspect)
+
+
+async def route_automations(state: dict, change: StateChange) -> None:
+    """Update the signals of the set routes based on points and block detectors.
+
+    When running as part of a cluster, only the leader runs the automations.
+    """
+    if not cluster_node.is_leader:
+        return
+    route_engine.handle(state, change)
+
+
+async def load_automations() -> None:
+    """Load the `route_engine` and the `automation_graph` from the database.
+
+    The signals of the routes are excluded from the `automation_graph`, so that only the `route_engine` sets them.
+    The desired aspects of the `signal_controller` are then rebuilt from both, which sets signals that are no longer
+    automated to danger.
+    """
+    await load_route_engine()
+    await load_automation_graph(route_engine.signals())
+    signal_controller.replace({**automation_graph.aspects(state_manager), **route_engine.aspects()})
+
+
+async def reload_models() -> None:
+    """Reload the entity registry and all automations."""
+    await load_registry()
+    await load_automations()
 
 
 async def setup_automations() -> None:
-    """Set up all automation listeners."""
-    await state_manager.add_listener(signal_automations)
+    """Set up all automations and start running them on the `automation_executor`.
+
+    The automations are reloaded whenever another server instance in the cluster changes the models. Routes are
+    set and released on the leader, which announces the set routes to the other instances.
+    """
+    try:
+        await load_automations()
+    except Exception as e:
+        logger.error(e)
+    cluster_node.on_models_changed = reload_models
+    cluster_node.request_handlers["routes"] = handle_route_request
+    cluster_node.announcement_handlers["routes"] = route_engine.restore
+    automation_executor.register(
+        "signal_automations",
+        signal_automations,
+        Subscription(types=frozenset(["points", "block_detector", "signal"])),
+    )
+    automation_executor.register(
+        "route_automations", route_automations, Subscription(types=frozenset(["points", "block_detector"]))
+    )
+    await automation_executor.start(state_manager)
+
+
+async def stop_automations() -> None:
+    """Stop running the automations."""
+    await automation_executor.stop(state_manager)
@@ -0,0 +1,104 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Signal controller, which drives the signals towards their desired aspects."""
+
+import asyncio
+from collections.abc import Callable, Mapping
+
+from mr_fat_controller import codec
+from mr_fat_controller.metrics import signal_commands
+from mr_fat_controller.mqtt import cluster_node, mqtt_publisher
+from mr_fat_controller.settings import settings
+from mr_fat_controller.state import StateManager, state_manager
+
+ASPECT_COMMANDS = {
+    "danger": {"state": "ON", "color": {"r": 255, "g": 0, "b": 0}},
+    "clear": {"state": "ON", "color": {"r": 0, "g": 255, "b": 0}},
+}
+"""The command that sets each aspect, in the order in which the aspects are sent."""
+
+
+class SignalController:
+    """Keeps the desired aspect of each automated signal and compares it with the aspect the signal reports.
+
+    Signals that need checking are queued and checked together `debounce` seconds after the first of them was
+    queued. A command is only sent to a queued signal if its reported aspect differs from its desired aspect. All
+    danger aspects are sent before any clear aspects. Commands are only sent while `is_active` returns `True`, which
+    for the `signal_controller` is while this server instance is the cluster leader.
+    """
+
+    def __init__(
+        self,
+        manager: StateManager,
+        publish: Callable[[str, bytes], None],
+        debounce: float = 0.02,
+        is_active: Callable[[], bool] | None = None,
+    ) -> None:
+        """Initialise the controller without any desired aspects."""
+        self.manager = manager
+        self.publish = publish
+        self.debounce = debounce
+        self.is_active = is_active
+        self.desired: dict[int, str] = {}
+        self._released: set[int] = set()
+        self._queued: dict[int, None] = {}
+        self._handle: asyncio.TimerHandle | None = None
+
+    def set_desired(self, signal_id: int, aspect: str) -> None:
+        """Set the desired `aspect` of the signal and queue it for checking."""
+        self.desired[signal_id] = aspect
+        self._released.discard(signal_id)
+        self.check(signal_id)
+
+    def replace(self, desired: Mapping[int, str]) -> None:
+        """Replace all desired aspects with the `desired` ones.
+
+        Signals that no longer have a desired aspect are set to danger once more and then released, so that a signal
+        whose automation was removed is never left clear.
+        """
+        for signal_id in self.desired:
+            if signal_id not in desired:
+                self.set_desired(signal_id, "danger")
+                self._released.add(signal_id)
+        for signal_id, aspect in desired.items():
+            self.set_desired(signal_id, aspect)
+
+    def check(self, signal_id: int) -> None:
+        """Queue the signal for checking, if it has a desired aspect."""
+        if signal_id in self.desired:
+            self._queued[signal_id] = None
+            if self._handle is None:
+                self._handle = asyncio.get_running_loop().call_later(self.debounce, self.flush)
+
+    def flush(self) -> None:
+        """Send a command to each queued signal that does not show its desired aspect."""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        queued = self._queued
+        self._queued = {}
+        if self.is_active is None or self.is_active():
+            self._send(queued)
+        for signal_id in self._released:
+            self.desired.pop(signal_id, None)
+        self._released = set()
+
+    def _send(self, queued: dict[int, None]) -> None:
+        """Send a command to each of the `queued` signals that does not show its desired aspect."""
+        for aspect, command in ASPECT_COMMANDS.items():
+            for signal_id in queued:
+                if self.desired.get(signal_id) == aspect:
+                    record = self.manager.find("signal", signal_id)
+                    if record is None:
+                        continue
+                    if record.state != aspect:
+                        self.publish(record.topic, codec.dumps(command))
+                        signal_commands.inc("sent")
+                    else:
+                        signal_commands.inc("skipped")
+
+
+signal_controller = SignalController(
+    state_manager, mqtt_publisher.publish, settings.automation.signal_debounce, lambda: cluster_node.is_leader
+)
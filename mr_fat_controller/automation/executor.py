@@ -0,0 +1,177 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Executor that runs the automations on their own task."""
+
+import asyncio
+import logging
+from time import monotonic, perf_counter
+
+from mr_fat_controller.metrics import StageStats, automation_backlog, automation_seconds
+from mr_fat_controller.settings import settings
+from mr_fat_controller.state import Listener, StateChange, StateManager, Subscription, merge_diffs
+
+logger = logging.getLogger(__name__)
+
+
+class AutomationExecutor:
+    """Runs all automations, one after the other, on a single task of its own.
+
+    The executor is registered as one state listener, which only queues the changed topics and returns at once, so
+    that the automations never delay the other listeners. Repeated changes to a queued topic are coalesced into
+    one. If more than `queue_size` topics are queued, then the queue is replaced by a single full evaluation.
+
+    A watchdog checks every `watchdog_interval` seconds whether the oldest queued change has waited longer than
+    `max_lag` seconds, or whether the queue has overflowed, and logs a warning if so.
+    """
+
+    def __init__(self, queue_size: int = 1000, max_lag: float = 1, watchdog_interval: float = 5) -> None:
+        """Initialise the executor without any automations."""
+        self.queue_size = queue_size
+        self.max_lag = max_lag
+        self.watchdog_interval = watchdog_interval
+        self.automations: dict[str, tuple[Listener, Subscription]] = {}
+        self.automation_stats: dict[str, StageStats] = {}
+        self.automation_errors: dict[str, int] = {}
+        self.received = 0
+        self.coalesced = 0
+        self.overflows = 0
+        self.batches = 0
+        self._pending: dict[str, dict | None] = {}
+        self._full = False
+        self._sequence = 0
+        self._queued_since: float | None = None
+        self._reported_overflows = 0
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    def register(self, name: str, automation: Listener, subscription: Subscription) -> None:
+        """Register the `automation` to be run for changes matching its `subscription`."""
+        self.automations[name] = (automation, subscription)
+        self.automation_stats[name] = StageStats()
+        self.automation_errors[name] = 0
+
+    @property
+    def subscription(self) -> Subscription:
+        """Return the subscription covering the changes that any of the automations is interested in."""
+        subscriptions = [subscription for _, subscription in self.automations.values()]
+        if any(subscription.everything for subscription in subscriptions):
+            return Subscription()
+        types = frozenset().union(*(sub.types for sub in subscriptions if sub.types is not None))
+        topics = tuple(topic for sub in subscriptions if sub.topics is not None for topic in sub.topics)
+        models = frozenset().union(*(sub.models for sub in subscriptions if sub.models is not None))
+        return Subscription(types=types or None, topics=topics or None, models=models or None)
+
+    async def start(self, manager: StateManager) -> None:
+        """Start running the automations for all changes to the `manager`'s state."""
+        self._tasks = [asyncio.create_task(self._run(manager)), asyncio.create_task(self._watchdog())]
+        await manager.add_listener(self.enqueue, subscription=self.subscription)
+
+    async def stop(self, manager: StateManager) -> None:
+        """Stop running the automations."""
+        await manager.remove_listener(self.enqueue)
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def enqueue(self, state: dict, change: StateChange) -> None:  # noqa: ARG002
+        """Queue the `change` for the automations."""
+        self._sequence = change.sequence
+        if self._queued_since is None:
+            self._queued_since = monotonic()
+        if change.topics is None:
+            self._full = True
+            self._pending = {}
+        elif not self._full:
+            for topic in change.topics:
+                self.received = self.received + 1
+                if topic in self._pending:
+                    self.coalesced = self.coalesced + 1
+                    self._pending[topic] = merge_diffs(self._pending[topic], change.diffs.get(topic))
+                else:
+                    self._pending[topic] = change.diffs.get(topic)
+            if len(self._pending) > self.queue_size:
+                self.overflows = self.overflows + 1
+                self._full = True
+                self._pending = {}
+        automation_backlog.set(value=len(self._pending))
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        """Return the executor statistics."""
+        return {
+            "backlog": len(self._pending),
+            "lag_ms": (monotonic() - self._queued_since) * 1000 if self._queued_since is not None else 0,
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "overflows": self.overflows,
+            "batches": self.batches,
+            "automations": {
+                name: {**stats.stats(), "errors": self.automation_errors[name]}
+                for name, stats in self.automation_stats.items()
+            },
+        }
+
+    async def _run(self, manager: StateManager) -> None:
+        """Run the automations for all queued changes."""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self._full:
+                change = StateChange(self._sequence, None)
+            else:
+                change = StateChange(
+                    self._sequence,
+                    frozenset(self._pending),
+                    {topic: diff for topic, diff in self._pending.items() if diff is not None},
+                )
+            self._pending = {}
+            self._full = False
+            self._queued_since = None
+            automation_backlog.set(value=0)
+            self.batches = self.batches + 1
+            for name, (automation, subscription) in self.automations.items():
+                automation_change = change
+                if change.topics is not None and not subscription.everything:
+                    topics = frozenset(
+                        topic for topic in change.topics if subscription.matches(topic, manager.state.get(topic))
+                    )
+                    if not topics:
+                        continue
+                    automation_change = StateChange(
+                        change.sequence,
+                        topics,
+                        {topic: change.diffs[topic] for topic in topics if topic in change.diffs},
+                    )
+                start = perf_counter()
+                try:
+                    await automation(manager.state, automation_change)
+                except Exception as e:
+                    self.automation_errors[name] = self.automation_errors[name] + 1
+                    logger.error(e)
+                duration = perf_counter() - start
+                self.automation_stats[name].record(duration)
+                automation_seconds.observe(duration, name)
+
+    async def _watchdog(self) -> None:
+        """Log a warning whenever the automations fall behind the incoming changes."""
+        while True:
+            await asyncio.sleep(self.watchdog_interval)
+            if self._queued_since is not None and monotonic() - self._queued_since > self.max_lag:
+                logger.warning(
+                    f"Automations are falling behind, the oldest change has waited for "
+                    f"{monotonic() - self._queued_since:.2f}s with {len(self._pending)} topics queued"
+                )
+            if self.overflows > self._reported_overflows:
+                logger.warning(
+                    f"Automations are falling behind, the change queue overflowed "
+                    f"{self.overflows - self._reported_overflows} times"
+                )
+                self._reported_overflows = self.overflows
+
+
+automation_executor = AutomationExecutor(
+    queue_size=settings.automation.queue_size,
+    max_lag=settings.automation.max_lag,
+    watchdog_interval=settings.automation.watchdog_interval,
+)
@@ -0,0 +1,124 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""In-memory dependency graph of the signal automations."""
+
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from mr_fat_controller.models import SignalAutomation, db_session
+from mr_fat_controller.state import StateManager
+
+
+@dataclass(frozen=True, slots=True)
+class SignalRule:
+    """A single signal automation, which clears its signal if its block is free and its points are set."""
+
+    signal_id: int
+    block_detector_id: int
+    points_id: int | None
+    points_state: str
+
+    def evaluate(self, manager: StateManager) -> str | None:
+        """Return the aspect the rule requires, or `None` if its signal or block detector have no state.
+
+        Stale states, which have not yet been confirmed by their device, never clear the signal.
+        """
+        block_detector = manager.find("block_detector", self.block_detector_id)
+        if manager.find("signal", self.signal_id) is None or block_detector is None:
+            return None
+        points = manager.find("points", self.points_id) if self.points_id is not None else None
+        if points is not None and (points.stale or points.state != self.points_state):
+            return "danger"
+        return "clear" if block_detector.state == "off" and not block_detector.stale else "danger"
+
+
+class AutomationGraph:
+    """The signal automations, compiled into indexes from block detectors and points to the signals they affect.
+
+    A change to a block detector or points only needs to re-evaluate the rules of the affected signals, which is
+    done purely against the state, without any database access. Rules for `excluded` signals, which are owned by
+    the routes, are ignored.
+    """
+
+    def __init__(self) -> None:
+        """Initialise an empty graph."""
+        self.rules: dict[int, tuple[SignalRule, ...]] = {}
+        self.by_block_detector: dict[int, frozenset[int]] = {}
+        self.by_points: dict[int, frozenset[int]] = {}
+
+    def compile(self, rules: Iterable[SignalRule], excluded: frozenset[int] = frozenset()) -> None:
+        """Replace the graph with one compiled from the `rules`, ignoring those for the `excluded` signals."""
+        by_signal: dict[int, list[SignalRule]] = {}
+        by_block_detector: dict[int, set[int]] = {}
+        by_points: dict[int, set[int]] = {}
+        for rule in rules:
+            if rule.signal_id in excluded:
+                continue
+            by_signal.setdefault(rule.signal_id, []).append(rule)
+            by_block_detector.setdefault(rule.block_detector_id, set()).add(rule.signal_id)
+            if rule.points_id is not None:
+                by_points.setdefault(rule.points_id, set()).add(rule.signal_id)
+        self.rules = {signal_id: tuple(signal_rules) for signal_id, signal_rules in by_signal.items()}
+        self.by_block_detector = {key: frozenset(signal_ids) for key, signal_ids in by_block_detector.items()}
+        self.by_points = {key: frozenset(signal_ids) for key, signal_ids in by_points.items()}
+
+    async def load(self, dbsession: AsyncSession, excluded: frozenset[int] = frozenset()) -> None:
+        """Compile the graph from all signal automations in the database, except for the `excluded` signals."""
+        result = await dbsession.execute(
+            select(
+                SignalAutomation.signal_id,
+                SignalAutomation.block_detector_id,
+                SignalAutomation.points_id,
+                SignalAutomation.points_state,
+            )
+        )
+        self.compile((SignalRule(*row) for row in result), excluded)
+
+    def signals(self) -> frozenset[int]:
+        """Return the ids of all signals that are automated."""
+        return frozenset(self.rules)
+
+    def aspects(self, manager: StateManager) -> dict[int, str]:
+        """Return the aspects of all automated signals whose rules can be evaluated against the current state."""
+        aspects = {}
+        for signal_id in self.rules:
+            aspect = self.evaluate(signal_id, manager)
+            if aspect is not None:
+                aspects[signal_id] = aspect
+        return aspects
+
+    def affected_signals(self, block_detector_ids: Iterable[int], points_ids: Iterable[int]) -> set[int]:
+        """Return the ids of the signals affected by changes to the block detectors and points."""
+        signal_ids = set()
+        for block_detector_id in block_detector_ids:
+            signal_ids.update(self.by_block_detector.get(block_detector_id, ()))
+        for points_id in points_ids:
+            signal_ids.update(self.by_points.get(points_id, ()))
+        return signal_ids
+
+    def evaluate(self, signal_id: int, manager: StateManager) -> str | None:
+        """Return the aspect for the signal, which is clear if any of its rules clears it.
+
+        Returns `None` if none of the signal's rules can be evaluated against the current state.
+        """
+        aspects = {rule.evaluate(manager) for rule in self.rules.get(signal_id, ())}
+        if "clear" in aspects:
+            return "clear"
+        if "danger" in aspects:
+            return "danger"
+        return None
+
+
+async def load_automation_graph(excluded: frozenset[int] = frozenset()) -> None:
+    """Load the `automation_graph` from the database, except for the `excluded` signals, using a separate session."""
+    async with (
+        db_session() as dbsession  # pyright: ignore[reportGeneralTypeIssues]
+    ):
+        await automation_graph.load(dbsession, excluded)
+
+
+automation_graph = AutomationGraph()
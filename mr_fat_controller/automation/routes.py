@@ -0,0 +1,319 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Route-based interlocking."""
+
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from mr_fat_controller import codec
+from mr_fat_controller.automation.controller import SignalController, signal_controller
+from mr_fat_controller.models import Route, db_session
+from mr_fat_controller.mqtt import cluster_node, mqtt_publisher
+from mr_fat_controller.registry import entity_registry
+from mr_fat_controller.state import StateChange, StateManager, StateRecord, state_manager
+
+
+@dataclass(frozen=True, slots=True)
+class RouteDefinition:
+    """A single route, with the position each of its points must be in."""
+
+    id: int
+    name: str
+    points: tuple[tuple[int, str], ...]
+    signals: tuple[int, ...]
+    block_detectors: tuple[int, ...]
+
+    @classmethod
+    def from_route(cls, route: Route) -> "RouteDefinition":
+        """Return the definition of the database `route`."""
+        return cls(
+            id=route.id,
+            name=route.name,
+            points=tuple((points.points_id, points.state) for points in route.points),
+            signals=tuple(signal.signal_id for signal in route.signals),
+            block_detectors=tuple(block_detector.block_detector_id for block_detector in route.block_detectors),
+        )
+
+
+def bits(mask: int) -> Iterable[int]:
+    """Return the indexes of the bits set in the `mask`."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask = mask ^ low
+
+
+class RouteEngine:
+    """Sets and releases routes, using conflict masks that are precomputed whenever the routes change.
+
+    Each route is assigned one bit. Two routes conflict if they share any points, signals, or block detectors, and
+    the conflicting routes of each route are held as a bit mask. The engine tracks the set routes, the routes with
+    an occupied block detector, and the routes whose points are all in position as bit masks, which are updated
+    incrementally through indexes from points and block detectors to routes. Checking whether a route can be set
+    is then a single mask operation.
+
+    The signals of a set route are cleared while all its points are in position and all its block detectors are
+    free and are set to danger otherwise. A signal that is part of several routes is clear if any of them clears it.
+    The signals of all routes are owned by the engine and are excluded from the signal automations. Whenever the
+    routes are compiled, all their signals are set to danger unless their route is set and ready.
+    """
+
+    def __init__(
+        self,
+        manager: StateManager,
+        controller: SignalController,
+        command_points: Callable[[int, str], None],
+    ) -> None:
+        """Initialise the engine without any routes."""
+        self.manager = manager
+        self.controller = controller
+        self.command_points = command_points
+        self.routes: list[RouteDefinition] = []
+        self.index: dict[int, int] = {}
+        self.conflicts: list[int] = []
+        self.by_points: dict[int, int] = {}
+        self.by_block_detector: dict[int, int] = {}
+        self.by_signal: dict[int, int] = {}
+        self.active = 0
+        self.occupied = 0
+        self.in_position = 0
+        self._required: list[dict[int, str]] = []
+        self._misplaced: list[int] = []
+        self._occupied_counts: list[int] = []
+        self._points_states: dict[int, str] = {}
+        self._block_occupied: dict[int, bool] = {}
+
+    def compile(self, routes: Iterable[RouteDefinition]) -> None:
+        """Replace the routes and precompute the conflict masks and indexes.
+
+        Routes that were set and still exist remain set.
+        """
+        active_ids = self.active_routes()
+        self.routes = list(routes)
+        self.index = {route.id: idx for idx, route in enumerate(self.routes)}
+        self.by_points = {}
+        self.by_block_detector = {}
+        self.by_signal = {}
+        for idx, route in enumerate(self.routes):
+            for points_id, _ in route.points:
+                self.by_points[points_id] = self.by_points.get(points_id, 0) | 1 << idx
+            for block_detector_id in route.block_detectors:
+                self.by_block_detector[block_detector_id] = self.by_block_detector.get(block_detector_id, 0) | 1 << idx
+            for signal_id in route.signals:
+                self.by_signal[signal_id] = self.by_signal.get(signal_id, 0) | 1 << idx
+        self.conflicts = [0] * len(self.routes)
+        for index in (self.by_points, self.by_block_detector, self.by_signal):
+            for mask in index.values():
+                for idx in bits(mask):
+                    self.conflicts[idx] = self.conflicts[idx] | mask
+        for idx in range(len(self.routes)):
+            self.conflicts[idx] = self.conflicts[idx] & ~(1 << idx)
+        self._required = [dict(route.points) for route in self.routes]
+        self.restore(active_ids)
+        self.sync()
+        for signal_id, aspect in self.aspects().items():
+            self.controller.set_desired(signal_id, aspect)
+
+    def sync(self) -> None:
+        """Recompute the occupied and in-position masks from the current state.
+
+        Points and block detectors without a confirmed state are treated as not in position and occupied.
+        """
+        self._points_states = {}
+        self._block_occupied = {}
+        for points_id in self.by_points:
+            self._points_states[points_id] = points_state(self.manager.find("points", points_id))
+        for block_detector_id in self.by_block_detector:
+            record = self.manager.find("block_detector", block_detector_id)
+            self._block_occupied[block_detector_id] = is_occupied(record)
+        self._misplaced = [
+            sum(1 for points_id, state in required.items() if self._points_states[points_id] != state)
+            for required in self._required
+        ]
+        self._occupied_counts = [
+            sum(1 for block_detector_id in route.block_detectors if self._block_occupied[block_detector_id])
+            for route in self.routes
+        ]
+        self.in_position = sum(1 << idx for idx, count in enumerate(self._misplaced) if count == 0)
+        self.occupied = sum(1 << idx for idx, count in enumerate(self._occupied_counts) if count > 0)
+
+    def signals(self) -> frozenset[int]:
+        """Return the ids of the signals of all routes."""
+        return frozenset(self.by_signal)
+
+    def aspects(self) -> dict[int, str]:
+        """Return the aspects of the signals of all routes, which are clear only for signals of a ready route."""
+        ready = self.active & self.in_position & ~self.occupied
+        return {signal_id: "clear" if mask & ready else "danger" for signal_id, mask in self.by_signal.items()}
+
+    def active_routes(self) -> list[int]:
+        """Return the ids of the set routes."""
+        return sorted(self.routes[idx].id for idx in bits(self.active))
+
+    def restore(self, route_ids: Iterable[int]) -> None:
+        """Mark the routes as set, without moving their points or changing their signals."""
+        self.active = 0
+        for route_id in route_ids:
+            if route_id in self.index:
+                self.active = self.active | 1 << self.index[route_id]
+
+    def can_set(self, route_id: int) -> bool:
+        """Return whether the route can be set, which requires no conflicting route to be set and its blocks free."""
+        bit = 1 << self.index[route_id]
+        return (self.conflicts[self.index[route_id]] & self.active) == 0 and (self.occupied & bit) == 0
+
+    def set_route(self, route_id: int) -> bool:
+        """Set the route, moving its points into position. Returns whether the route could be set."""
+        if not self.can_set(route_id):
+            return False
+        idx = self.index[route_id]
+        self.active = self.active | 1 << idx
+        for points_id, state in self.routes[idx].points:
+            if self._points_states.get(points_id) != state:
+                self.command_points(points_id, state)
+        self.update_signals(1 << idx)
+        return True
+
+    def release_route(self, route_id: int) -> None:
+        """Release the route, setting its signals to danger."""
+        idx = self.index[route_id]
+        self.active = self.active & ~(1 << idx)
+        self.update_signals(1 << idx)
+
+    def update_signals(self, mask: int) -> None:
+        """Pass the aspects for the signals of the routes in the `mask` to the signal controller."""
+        ready = self.active & self.in_position & ~self.occupied
+        signal_ids = {signal_id for idx in bits(mask) for signal_id in self.routes[idx].signals}
+        for signal_id in signal_ids:
+            self.controller.set_desired(signal_id, "clear" if self.by_signal[signal_id] & ready else "danger")
+
+    def points_changed(self, points_id: int, state: str) -> int:
+        """Update the masks for the new `state` of the points and return the mask of the affected routes."""
+        previous = self._points_states.get(points_id)
+        mask = self.by_points.get(points_id, 0)
+        if previous == state:
+            return 0
+        self._points_states[points_id] = state
+        for idx in bits(mask):
+            required = self._required[idx][points_id]
+            if previous == required:
+                self._misplaced[idx] = self._misplaced[idx] + 1
+                self.in_position = self.in_position & ~(1 << idx)
+            elif state == required:
+                self._misplaced[idx] = self._misplaced[idx] - 1
+                if self._misplaced[idx] == 0:
+                    self.in_position = self.in_position | 1 << idx
+        return mask
+
+    def block_detector_changed(self, block_detector_id: int, occupied: bool) -> int:  # noqa: FBT001
+        """Update the masks for the block detector's occupancy and return the mask of the affected routes."""
+        mask = self.by_block_detector.get(block_detector_id, 0)
+        if self._block_occupied.get(block_detector_id) == occupied:
+            return 0
+        self._block_occupied[block_detector_id] = occupied
+        for idx in bits(mask):
+            if occupied:
+                self._occupied_counts[idx] = self._occupied_counts[idx] + 1
+                self.occupied = self.occupied | 1 << idx
+            else:
+                self._occupied_counts[idx] = self._occupied_counts[idx] - 1
+                if self._occupied_counts[idx] == 0:
+                    self.occupied = self.occupied & ~(1 << idx)
+        return mask
+
+    def status(self) -> list[dict]:
+        """Return the status of all routes."""
+        return [
+            {
+                "id": route.id,
+                "name": route.name,
+                "active": bool(self.active & 1 << idx),
+                "available": self.can_set(route.id),
+                "in_position": bool(self.in_position & 1 << idx),
+                "occupied": bool(self.occupied & 1 << idx),
+            }
+            for idx, route in enumerate(self.routes)
+        ]
+
+    async def load(self, dbsession: AsyncSession) -> None:
+        """Compile the routes from the database."""
+        result = await dbsession.execute(
+            select(Route).options(
+                selectinload(Route.points), selectinload(Route.signals), selectinload(Route.block_detectors)
+            )
+        )
+        self.compile(RouteDefinition.from_route(route) for route in result.scalars())
+
+    def handle(self, state: dict, change: StateChange) -> None:
+        """Update the masks and the signals of the set routes for a change to the state."""
+        if change.topics is None:
+            self.sync()
+            self.update_signals(self.active)
+            return
+        mask = 0
+        for topic in change.topics:
+            record = state.get(topic)
+            if record is not None:
+                if record.type == "points":
+                    mask = mask | self.points_changed(record.model_id, points_state(record))
+                elif record.type == "block_detector":
+                    mask = mask | self.block_detector_changed(record.model_id, is_occupied(record))
+        if mask & self.active:
+            self.update_signals(mask & self.active)
+
+
+def points_state(record: StateRecord | None) -> str:
+    """Return the state of the points, which is unknown if they have no state or it has not been confirmed."""
+    return record.state if record is not None and not record.stale else "unknown"
+
+
+def is_occupied(record: StateRecord | None) -> bool:
+    """Return whether the block detector is occupied, which it is unless it has confirmed that it is free."""
+    return record is None or record.stale or record.state != "off"
+
+
+def command_points(points_id: int, state: str) -> None:
+    """Send the command to move the points into the `state`."""
+    entry = entity_registry.find("points", points_id)
+    if entry is not None and entry.command_topic is not None:
+        if state == "through":
+            mqtt_publisher.publish(entry.command_topic, codec.dumps({"state": entry.through_state}))
+        elif state == "diverge":
+            mqtt_publisher.publish(entry.command_topic, codec.dumps({"state": entry.diverge_state}))
+
+
+async def handle_route_request(data: dict) -> dict:
+    """Set or release a route on the leader and announce the set routes to the other server instances.
+
+    The reply's `result` is `ok`, `not_found`, or, if the route cannot be set, `conflict`.
+    """
+    if data["route"] not in route_engine.index:
+        return {"result": "not_found"}
+    if data["action"] == "set":
+        if not route_engine.set_route(data["route"]):
+            return {"result": "conflict"}
+    else:
+        route_engine.release_route(data["route"])
+    cluster_node.announce("routes", route_engine.active_routes())
+    return {"result": "ok"}
+
+
+async def request_route(action: str, route_id: int) -> str:
+    """Set or release the route through the leader and return the result."""
+    return (await cluster_node.request("routes", {"action": action, "route": route_id}))["result"]
+
+
+async def load_route_engine() -> None:
+    """Load the `route_engine` from the database, using a separate session."""
+    async with (
+        db_session() as dbsession  # pyright: ignore[reportGeneralTypeIssues]
+    ):
+        await route_engine.load(dbsession)
+
+
+route_engine = RouteEngine(state_manager, signal_controller, command_points)
@@ -0,0 +1,312 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Support for running multiple server instances as a cluster."""
+
+import asyncio
+import logging
+from collections import deque
+from collections.abc import Awaitable, Callable
+from time import monotonic, time
+from typing import Any
+from uuid import uuid4
+
+from mr_fat_controller import codec
+from mr_fat_controller.state import StateManager
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[str, bytes], Awaitable]
+RequestHandler = Callable[[dict], Awaitable[dict]]
+AnnouncementHandler = Callable[[Any], None]
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """Return whether the MQTT `topic_filter`, which may contain `+` and `#` wildcards, matches the `topic`."""
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for idx, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if idx >= len(topic_levels) or (level != "+" and level != topic_levels[idx]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class ClusterNode:
+    """A single server instance in a cluster of instances that share their state.
+
+    Every topic-level change to the local state is replicated to all other instances over the cluster bus, so
+    that each instance can serve its websocket clients from its own copy of the full state. Full state changes are
+    not replicated, as each instance rebuilds its state from the shared database itself.
+
+    As any instance may ingest any update, replicated changes can arrive out of order. Each change is stamped with
+    the time it was made and the node that made it, and a field is only changed by a change that is newer than the
+    last one applied to it, so that all instances converge on the latest value. The time is taken from a hybrid
+    clock, which never goes backwards and never falls behind the stamps received from other instances.
+
+    All instances send a heartbeat every `heartbeat_interval` seconds. The instance with the lowest node id among
+    those heard from within the last `leader_timeout` seconds is the leader, which runs the automations.
+
+    State that only the leader may change, such as the set routes, is changed through `request`, which forwards the
+    request to the leader and waits for its reply. The leader then `announce`s the new state to all instances. The
+    leader also repeats its latest announcements with each heartbeat, so that instances that join later catch up.
+    """
+
+    def __init__(
+        self,
+        manager: StateManager,
+        publish: Callable[[str, bytes], None],
+        node_id: str | None = None,
+        prefix: str = "mrfatcontroller-cluster/mrfatcontroller",
+        heartbeat_interval: float = 2,
+        leader_timeout: float = 6,
+        on_models_changed: Callable[[], Awaitable] | None = None,
+        request_timeout: float = 5,
+    ) -> None:
+        """Initialise the node. It takes no part in the cluster until it is started."""
+        self.manager = manager
+        self.publish = publish
+        self.node_id = node_id if node_id is not None else uuid4().hex
+        self.prefix = prefix
+        self.heartbeat_interval = heartbeat_interval
+        self.leader_timeout = leader_timeout
+        self.on_models_changed = on_models_changed
+        self.request_timeout = request_timeout
+        self.request_handlers: dict[str, RequestHandler] = {}
+        self.announcement_handlers: dict[str, AnnouncementHandler] = {}
+        self.running = False
+        self.peers: dict[str, float] = {}
+        self.replicated = 0
+        self.applied = 0
+        self.discarded = 0
+        self._announced: dict[str, Any] = {}
+        self._clock = 0.0
+        self._stamps: dict[str, dict[str, tuple[float, str]]] = {}
+        self._requests: dict[str, asyncio.Future] = {}
+        self._heartbeat_task: asyncio.Task | None = None
+        self._models_changed_task: asyncio.Task | None = None
+
+    @property
+    def topic_filter(self) -> str:
+        """Return the topic filter for all cluster bus messages."""
+        return f"{self.prefix}/#"
+
+    @property
+    def leader(self) -> str:
+        """Return the node id of the current leader."""
+        now = monotonic()
+        return min([self.node_id, *[node for node, seen in self.peers.items() if now - seen < self.leader_timeout]])
+
+    @property
+    def is_leader(self) -> bool:
+        """Return whether this instance is the leader. An instance that is not part of a cluster always is."""
+        return not self.running or self.leader == self.node_id
+
+    def start(self) -> None:
+        """Start replicating state changes and sending heartbeats."""
+        self.running = True
+        self.manager.replicator = self.replicate
+        self._heartbeat_task = asyncio.create_task(self._send_heartbeats())
+
+    async def stop(self) -> None:
+        """Stop taking part in the cluster."""
+        self.running = False
+        if self.manager.replicator == self.replicate:
+            self.manager.replicator = None
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+
+    def replicate(self, topic: str | None, diff: dict | None) -> None:
+        """Send a local change to the `topic` to all other instances."""
+        if topic is None:
+            return
+        self._clock = max(time(), self._clock + 1e-6)
+        message: dict = {"node": self.node_id, "topic": topic, "stamp": self._clock}
+        self._accept(topic, (self._clock, self.node_id), diff)
+        if diff is not None:
+            message["diff"] = diff
+        else:
+            record = self.manager.get(topic)
+            message["record"] = record.to_dict() if record is not None else None
+        self.publish(f"{self.prefix}/state", codec.dumps(message))
+        self.replicated = self.replicated + 1
+
+    def models_changed(self) -> None:
+        """Tell all other instances that models without any state, such as the routes, have changed."""
+        if self.running:
+            self.publish(f"{self.prefix}/models", codec.dumps({"node": self.node_id}))
+
+    async def request(self, kind: str, data: dict) -> dict:
+        """Send the request to the handler for the `kind` on the leader and return its reply.
+
+        If this instance is the leader, then the handler is called directly. Raises a `TimeoutError` if the leader
+        does not reply within `request_timeout` seconds.
+        """
+        if self.is_leader:
+            return await self.request_handlers[kind](data)
+        request_id = uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._requests[request_id] = future
+        try:
+            self.publish(
+                f"{self.prefix}/request",
+                codec.dumps({"node": self.node_id, "to": self.leader, "id": request_id, "kind": kind, "data": data}),
+            )
+            return await asyncio.wait_for(future, self.request_timeout)
+        finally:
+            del self._requests[request_id]
+
+    def announce(self, kind: str, data: Any) -> None:
+        """Send the leader's current state for the `kind` to all other instances."""
+        self._announced[kind] = data
+        if self.running:
+            self.publish(f"{self.prefix}/announce", codec.dumps({"node": self.node_id, "announced": {kind: data}}))
+
+    async def receive(self, topic: str, payload: bytes) -> None:
+        """Handle a message received from the cluster bus."""
+        message = codec.loads(payload)
+        if message["node"] == self.node_id:
+            return
+        self.peers[message["node"]] = monotonic()
+        if topic == f"{self.prefix}/state":
+            self._clock = max(self._clock, message["stamp"])
+            diff = self._accept(message["topic"], (message["stamp"], message["node"]), message.get("diff"))
+            if diff == {}:
+                self.discarded = self.discarded + 1
+                return
+            await self.manager.apply_remote(message["topic"], diff, message.get("record"))
+            self.applied = self.applied + 1
+            if "record" in message and self.on_models_changed is not None:
+                self._models_changed()
+        elif topic == f"{self.prefix}/models":
+            self._models_changed()
+        elif topic == f"{self.prefix}/request" and message["to"] == self.node_id:
+            await self._handle_request(message)
+        elif topic == f"{self.prefix}/reply" and message["to"] == self.node_id:
+            future = self._requests.get(message["id"])
+            if future is not None and not future.done():
+                future.set_result(message["result"])
+        elif topic in (f"{self.prefix}/announce", f"{self.prefix}/heartbeat") and message["node"] == self.leader:
+            self._apply_announced(message.get("announced", {}))
+
+    def stats(self) -> dict:
+        """Return the cluster statistics."""
+        now = monotonic()
+        return {
+            "running": self.running,
+            "node_id": self.node_id,
+            "leader": self.leader,
+            "peers": {node: now - seen for node, seen in self.peers.items()},
+            "replicated": self.replicated,
+            "applied": self.applied,
+            "discarded": self.discarded,
+        }
+
+    def _accept(self, topic: str, stamp: tuple[float, str], diff: dict | None) -> dict | None:
+        """Record the `stamp` for the change to the `topic` and return the part of the change that is newer.
+
+        For a `diff` only the fields last changed before the `stamp` are returned. A change to the whole record is
+        returned as `None` if it is newer than all earlier changes and as an empty dict otherwise.
+        """
+        stamps = self._stamps.setdefault(topic, {})
+        if diff is None:
+            if max(stamps.values(), default=stamp) > stamp:
+                return {}
+            self._stamps[topic] = {"": stamp}
+            return None
+        if stamps.get("", stamp) > stamp:
+            return {}
+        accepted = {}
+        for name, value in diff.items():
+            if stamps.get(name, stamp) <= stamp:
+                stamps[name] = stamp
+                accepted[name] = value
+        return accepted
+
+    async def _handle_request(self, message: dict) -> None:
+        """Handle a request from another instance and send the reply."""
+        try:
+            result = await self.request_handlers[message["kind"]](message["data"])
+        except Exception as e:
+            logger.error(e)
+            return
+        self.publish(
+            f"{self.prefix}/reply",
+            codec.dumps({"node": self.node_id, "to": message["node"], "id": message["id"], "result": result}),
+        )
+
+    def _apply_announced(self, announced: dict) -> None:
+        """Pass the state announced by the leader to the announcement handlers."""
+        for kind, data in announced.items():
+            if self._announced.get(kind) != data and kind in self.announcement_handlers:
+                self._announced[kind] = data
+                self.announcement_handlers[kind](data)
+
+    def _models_changed(self) -> None:
+        """Call `on_models_changed`, unless a call is already pending."""
+        if self.on_models_changed is not None and (
+            self._models_changed_task is None or self._models_changed_task.done()
+        ):
+            self._models_changed_task = asyncio.create_task(self.on_models_changed())
+
+    async def _send_heartbeats(self) -> None:
+        """Send a heartbeat every `heartbeat_interval` seconds."""
+        while True:
+            message: dict = {"node": self.node_id}
+            if self.is_leader and self._announced:
+                message["announced"] = self._announced
+            self.publish(f"{self.prefix}/heartbeat", codec.dumps(message))
+            await asyncio.sleep(self.heartbeat_interval)
+
+
+class InMemoryBroker:
+    """An in-process stand-in for an MQTT broker, for testing and local development of clusters.
+
+    It supports plain subscriptions, which receive every matching message, and shared subscriptions of the form
+    `$share/<group>/<filter>`, where each matching message is delivered to only one subscriber of the group in
+    turn. Messages are delivered in the order they were published.
+    """
+
+    def __init__(self) -> None:
+        """Initialise the broker without any subscriptions."""
+        self._subscriptions: list[tuple[str | None, str, MessageHandler]] = []
+        self._next_shared: dict[tuple[str, str], int] = {}
+        self._queue: deque[tuple[str, bytes]] = deque()
+        self._task: asyncio.Task | None = None
+
+    def subscribe(self, topic_filter: str, handler: MessageHandler) -> None:
+        """Subscribe the `handler` to all messages matching the `topic_filter`."""
+        if topic_filter.startswith("$share/"):
+            _, group, topic_filter = topic_filter.split("/", 2)
+            self._subscriptions.append((group, topic_filter, handler))
+        else:
+            self._subscriptions.append((None, topic_filter, handler))
+
+    def publish(self, topic: str, payload: bytes | str) -> None:
+        """Publish the `payload` to the `topic`."""
+        self._queue.append((topic, payload.encode() if isinstance(payload, str) else payload))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._deliver())
+
+    async def drain(self) -> None:
+        """Wait until all published messages have been delivered."""
+        while self._task is not None and not self._task.done():
+            await self._task
+
+    async def _deliver(self) -> None:
+        """Deliver all queued messages to their subscribers."""
+        while self._queue:
+            topic, payload = self._queue.popleft()
+            shared: dict[tuple[str, str], list[MessageHandler]] = {}
+            for group, topic_filter, handler in self._subscriptions:
+                if topic_matches(topic_filter, topic):
+                    if group is None:
+                        await handler(topic, payload)
+                    else:
+                        shared.setdefault((group, topic_filter), []).append(handler)
+            for key, handlers in shared.items():
+                idx = self._next_shared.get(key, 0) % len(handlers)
+                self._next_shared[key] = idx + 1
+                await handlers[idx](topic, payload)
@@ -0,0 +1,49 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""JSON encoding and decoding.
+
+If the optional `orjson` package is installed, then it is used for all encoding and decoding. Otherwise the standard
+library `json` module is used. Either way, values are always encoded to `bytes`, so that they can be sent over the
+websocket or MQTT without further conversion.
+"""
+
+import json
+from collections.abc import Callable
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def json_dumps(value: Any, sort_keys: bool = False) -> bytes:  # noqa: FBT001, FBT002
+    """Encode the `value` to JSON using the standard library."""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, sort_keys=sort_keys).encode()
+
+
+def json_loads(data: bytes | bytearray | str) -> Any:
+    """Decode the JSON `data` using the standard library."""
+    return json.loads(data)
+
+
+BACKENDS: dict[str, tuple[Callable[..., bytes], Callable[[bytes | bytearray | str], Any]]] = {
+    "json": (json_dumps, json_loads),
+}
+"""The available encoding and decoding functions, by backend name."""
+
+if orjson is not None:
+
+    def orjson_dumps(value: Any, sort_keys: bool = False) -> bytes:  # noqa: FBT001, FBT002
+        """Encode the `value` to JSON using `orjson`."""
+        if sort_keys:
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS)
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+
+    BACKENDS["orjson"] = (orjson_dumps, orjson.loads)
+
+backend = "orjson" if "orjson" in BACKENDS else "json"
+"""The name of the backend in use."""
+
+dumps, loads = BACKENDS[backend]
@@ -35,6 +35,7 @@ type BlockDetector = {
 
 type BlockDetectorState = {
   model: BlockDetector,
+  stale: boolean,
   state: "off" | "on" | "unknown"
 };
 
@@ -47,6 +48,7 @@ type Points = {
 
 type PointsState = {
   model: Points,
+  stale: boolean,
   state: "through" | "diverge" | "unknown" | "switching",
 };
 
@@ -57,6 +59,7 @@ type PowerSwitch = {
 
 type PowerSwitchState = {
   model: PowerSwitch,
+  stale: boolean,
   state: "on" | "off" | "unknown" | "switching",
 };
 
@@ -67,6 +70,7 @@ type Signal = {
 
 type SignalState = {
   model: Signal,
+  stale: boolean,
   state: "off" | "danger" | "clear" | "unknown",
 };
 
@@ -90,6 +94,7 @@ type Train = {
 
 type TrainState = {
   model: Train,
+  stale: boolean,
   state: "on" | "off",
   speed: number,
   direction: "forward" | "reverse",
@@ -132,7 +137,12 @@ type PowerSwitchStatePayload = {
 
 type FullStateMessage = {
   type: "state",
+  epoch: string,
+  sequence: number,
+  full: boolean,
   payload: { [key: string]: PointsStatePayload | PowerSwitchStatePayload },
+  diffs: { [key: string]: { [key: string]: any } },
+  removed: string[],
 };
 
 type SetPointsMessage = {
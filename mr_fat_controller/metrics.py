@@ -0,0 +1,199 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Runtime metrics in the Prometheus text format.
+
+All metrics are plain in-process counters, so that recording a value only costs a dictionary lookup and, for
+histograms, a bisection into the bucket boundaries.
+"""
+
+from bisect import bisect_left
+from typing import TypeVar
+
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+"""The default histogram bucket boundaries, in seconds."""
+
+
+def escape_label(value: str) -> str:
+    """Escape a label `value` for the Prometheus text format."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    """Return the Prometheus label set for the label `names` and `values`, followed by an `extra` label."""
+    labels = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values, strict=True)]
+    if extra:
+        labels.append(extra)
+    if labels:
+        return "{" + ",".join(labels) + "}"
+    return ""
+
+
+class Metric:
+    """Base class for all metrics."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()) -> None:
+        """Initialise the metric without any values."""
+        self.name = name
+        self.description = description
+        self.labels = labels
+
+    def samples(self) -> list[str]:
+        """Return the sample lines for the metric."""
+        return []
+
+    def render(self) -> str:
+        """Return the metric in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type}", *self.samples()]
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """A value that only ever increases."""
+
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()) -> None:
+        """Initialise the counter without any values."""
+        super().__init__(name, description, labels)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        """Increase the counter for the `labels` by `amount`."""
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> list[str]:
+        """Return the sample lines for the counter."""
+        return [f"{self.name}{format_labels(self.labels, labels)} {value}" for labels, value in self.values.items()]
+
+
+class Gauge(Counter):
+    """A value that can go up and down."""
+
+    type = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        """Decrease the gauge for the `labels` by `amount`."""
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def set(self, *labels: str, value: float) -> None:
+        """Set the gauge for the `labels` to `value`."""
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    """The distribution of observed values across fixed buckets."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        """Initialise the histogram without any observations."""
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+        self.counts: dict[tuple[str, ...], list[int]] = {}
+        self.sums: dict[tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        """Record one observed `value` for the `labels`."""
+        counts = self.counts.get(labels)
+        if counts is None:
+            counts = [0] * (len(self.buckets) + 1)
+            self.counts[labels] = counts
+            self.sums[labels] = 0
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[labels] = self.sums[labels] + value
+
+    def samples(self) -> list[str]:
+        """Return the cumulative bucket, sum, and count lines for the histogram."""
+        lines = []
+        for labels, counts in self.counts.items():
+            total = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts, strict=True):
+                total = total + count
+                bucket_labels = format_labels(self.labels, labels, 'le="' + str(bound) + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {total}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {self.sums[labels]}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {total}")
+        return lines
+
+
+class StageStats:
+    """Count, mean, and maximum of the durations of one stage of processing, such as an ingestion stage."""
+
+    __slots__ = ("count", "max", "total")
+
+    def __init__(self) -> None:
+        """Initialise the empty statistics."""
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, duration: float) -> None:
+        """Record one `duration` (in seconds)."""
+        self.count = self.count + 1
+        self.total = self.total + duration
+        self.max = max(self.max, duration)
+
+    def stats(self) -> dict:
+        """Return the statistics."""
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000 if self.count > 0 else 0,
+            "max_ms": self.max * 1000,
+        }
+
+
+MetricT = TypeVar("MetricT", bound=Metric)
+
+
+class MetricsRegistry:
+    """Holds all metrics."""
+
+    def __init__(self) -> None:
+        """Initialise the registry without any metrics."""
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: MetricT) -> MetricT:
+        """Add the `metric` to the registry and return it."""
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text format."""
+        return "".join(metric.render() for metric in self.metrics.values())
+
+
+registry = MetricsRegistry()
+
+mqtt_messages = registry.register(
+    Counter("mfc_mqtt_messages_total", "MQTT messages received, by component and message kind.", ("component", "kind"))
+)
+update_state_seconds = registry.register(
+    Histogram("mfc_update_state_seconds", "Time taken to apply a state message to the state.")
+)
+listener_notify_seconds = registry.register(
+    Histogram("mfc_listener_notify_seconds", "Time taken by a state listener to handle a change.", ("listener",))
+)
+automation_seconds = registry.register(
+    Histogram("mfc_automation_seconds", "Time taken to evaluate an automation.", ("automation",))
+)
+automation_backlog = registry.register(Gauge("mfc_automation_backlog", "Changed topics queued for the automations."))
+signal_commands = registry.register(
+    Counter("mfc_signal_commands_total", "Signal aspect checks, by whether a command was sent.", ("result",))
+)
+mqtt_publish_seconds = registry.register(
+    Histogram("mfc_mqtt_publish_seconds", "Time from queueing an MQTT message to it being sent.")
+)
+websocket_send_seconds = registry.register(
+    Histogram("mfc_websocket_send_seconds", "Time taken to send a state message to a websocket client.")
+)
+websocket_clients = registry.register(Gauge("mfc_websocket_clients", "Connected websocket clients."))
+db_query_seconds = registry.register(Histogram("mfc_db_query_seconds", "Time taken by database queries."))
@@ -7,8 +7,10 @@ import logging
 from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
 from threading import local  # pyright: ignore[reportAttributeAccessIssue]
+from time import perf_counter
 from typing import Any
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
     AsyncSession,
@@ -16,12 +18,20 @@ from sqlalchemy.ext.asyncio import (
     create_async_engine,
 )
 
+from mr_fat_controller.metrics import db_query_seconds
 from mr_fat_controller.models.block_detector import BlockDetector, BlockDetectorModel  # noqa: F401
 from mr_fat_controller.models.device import Device, DeviceModel  # noqa: F401
 from mr_fat_controller.models.entity import Entity, EntityModel  # noqa: F401
 from mr_fat_controller.models.meta import Base, MetaData  # noqa: F401
 from mr_fat_controller.models.points import Points, PointsModel  # noqa: F401
 from mr_fat_controller.models.power_switch import PowerSwitch, PowerSwitchModel  # noqa: F401
+from mr_fat_controller.models.route import (  # noqa: F401
+    Route,
+    RouteBlockDetector,
+    RouteModel,
+    RoutePoints,
+    RouteSignal,
+)
 from mr_fat_controller.models.signal import Signal, SignalModel  # noqa: F401
 from mr_fat_controller.models.signal_automation import SignalAutomation, SignalAutomationModel  # noqa:F401
 from mr_fat_controller.models.train import Train, TrainModel  # noqa:F401
@@ -32,12 +42,29 @@ logger = logging.getLogger(__name__)
 local_cache = local()
 
 
+def start_query_timer(**kwargs: Any) -> None:
+    """Record the start time of a query on its execution context.
+
+    The time is kept on the context, which is discarded with the query, so that failed queries leave nothing behind.
+    """
+    kwargs["context"].query_start = perf_counter()
+
+
+def stop_query_timer(**kwargs: Any) -> None:
+    """Record the duration of the query from the start time on its execution context."""
+    start = getattr(kwargs["context"], "query_start", None)
+    if start is not None:
+        db_query_seconds.observe(perf_counter() - start)
+
+
 def get_engine() -> AsyncEngine:
     """Get a thread-local engine."""
     try:
         return local_cache.engine
     except Exception:
         local_cache.engine = create_async_engine(settings.dsn)
+        event.listen(local_cache.engine.sync_engine, "before_cursor_execute", start_query_timer, named=True)
+        event.listen(local_cache.engine.sync_engine, "after_cursor_execute", stop_query_timer, named=True)
         return local_cache.engine
 
 
@@ -0,0 +1,89 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Models for routes."""
+
+from typing import Annotated
+
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field
+from sqlalchemy import Column, ForeignKey, Integer, Unicode
+from sqlalchemy.orm import relationship
+
+from mr_fat_controller.models.meta import Base
+
+
+class Route(Base):
+    """The route database model.
+
+    A route is a set of points positions, the block detectors that must be free, and the signals that are cleared
+    when the route is set.
+    """
+
+    __tablename__ = "routes"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode(255))
+
+    points = relationship("RoutePoints", cascade="all, delete-orphan")
+    signals = relationship("RouteSignal", cascade="all, delete-orphan")
+    block_detectors = relationship("RouteBlockDetector", cascade="all, delete-orphan")
+
+
+class RoutePoints(Base):
+    """The position of one set of points in a route."""
+
+    __tablename__ = "route_points"
+
+    route_id = Column(Integer, ForeignKey("routes.id", ondelete="CASCADE"), primary_key=True)
+    points_id = Column(Integer, ForeignKey("points.id", ondelete="CASCADE"), primary_key=True)
+    state = Column(Unicode(255))
+
+
+class RouteSignal(Base):
+    """A signal cleared by a route."""
+
+    __tablename__ = "route_signals"
+
+    route_id = Column(Integer, ForeignKey("routes.id", ondelete="CASCADE"), primary_key=True)
+    signal_id = Column(Integer, ForeignKey("signals.id", ondelete="CASCADE"), primary_key=True)
+
+
+class RouteBlockDetector(Base):
+    """A block detector that must be free for a route to be set."""
+
+    __tablename__ = "route_block_detectors"
+
+    route_id = Column(Integer, ForeignKey("routes.id", ondelete="CASCADE"), primary_key=True)
+    block_detector_id = Column(Integer, ForeignKey("block_detectors.id", ondelete="CASCADE"), primary_key=True)
+
+
+def route_signal_ids(signals: list[RouteSignal]) -> list[int]:
+    """Return the signal ids for a list of route signals."""
+    return [signal.signal_id for signal in signals]
+
+
+def route_block_detector_ids(block_detectors: list[RouteBlockDetector]) -> list[int]:
+    """Return the block detector ids for a list of route block detectors."""
+    return [block_detector.block_detector_id for block_detector in block_detectors]
+
+
+class RoutePointsModel(BaseModel):
+    """Model for returning the position of one set of points in a route."""
+
+    points: int = Field(validation_alias="points_id")
+    state: str
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class RouteModel(BaseModel):
+    """Model for returning a Route."""
+
+    id: int
+    name: str
+
+    points: list[RoutePointsModel]
+    signals: Annotated[list[int], BeforeValidator(route_signal_ids)]
+    block_detectors: Annotated[list[int], BeforeValidator(route_block_detector_ids)]
+
+    model_config = ConfigDict(from_attributes=True)
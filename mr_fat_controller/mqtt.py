@@ -4,18 +4,29 @@
 """MQTT functionality."""
 
 import asyncio
-import json
 import logging
 import ssl
 from asyncio import sleep
+from collections import deque
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import replace
 from datetime import datetime, timezone
-from typing import cast
+from hashlib import sha256
+from time import monotonic, perf_counter
+from typing import Any, cast
 
 from aiomqtt import Client
 from pydantic import BaseModel, conlist
 from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload, selectinload
 
+from mr_fat_controller import codec
+from mr_fat_controller.activity import device_activity
+from mr_fat_controller.cluster import ClusterNode
+from mr_fat_controller.metrics import StageStats, mqtt_messages, mqtt_publish_seconds, update_state_seconds
 from mr_fat_controller.models import (
     BlockDetector,
     BlockDetectorModel,
@@ -26,13 +37,23 @@ from mr_fat_controller.models import (
     PowerSwitch,
     PowerSwitchModel,
     Signal,
+    SignalAutomation,
     SignalModel,
     Train,
     TrainModel,
     db_session,
 )
+from mr_fat_controller.registry import entity_registry, entry_for_model
 from mr_fat_controller.settings import settings
-from mr_fat_controller.state import state_manager
+from mr_fat_controller.state import (
+    BlockDetectorRecord,
+    PointsRecord,
+    PowerSwitchRecord,
+    SignalRecord,
+    StateRecord,
+    TrainRecord,
+    state_manager,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -55,28 +76,215 @@ def mqtt_client() -> Client:
     )
 
 
+class MqttPublisher:
+    """Publishes all outgoing MQTT messages through a single, long-lived connection.
+
+    Messages are queued and sent in order by a background task, which reconnects automatically if the connection
+    is lost. If the queue is full, then the oldest queued message is dropped. Messages that can never be sent, such
+    as those with an invalid topic, are dropped instead of being retried.
+    """
+
+    def __init__(self, queue_size: int = 1000, reconnect_delay: float = 5) -> None:
+        """Initialise the publisher with an empty queue."""
+        self.queue_size = queue_size
+        self.reconnect_delay = reconnect_delay
+        self.connected = False
+        self.published = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self._queue: deque[tuple[str, bytes | str, float]] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def publish(self, topic: str, payload: bytes | str) -> None:
+        """Queue the `payload` for publishing to the `topic`. This never waits for the message to be sent."""
+        if len(self._queue) >= self.queue_size:
+            self._queue.popleft()
+            self.dropped = self.dropped + 1
+        self._queue.append((topic, payload, perf_counter()))
+        self._wakeup.set()
+
+    def start(self) -> None:
+        """Start the background publishing task."""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background publishing task."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        """Return the publishing statistics."""
+        return {
+            "connected": self.connected,
+            "queue_depth": len(self._queue),
+            "published": self.published,
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+            "mean_latency_ms": self.latency_total / self.published * 1000 if self.published > 0 else 0,
+            "max_latency_ms": self.latency_max * 1000,
+        }
+
+    async def _run(self) -> None:
+        """Send all queued messages, reconnecting whenever the connection fails."""
+        while True:
+            try:
+                async with mqtt_client() as client:
+                    self.connected = True
+                    while True:
+                        while self._queue:
+                            topic, payload, queued = self._queue[0]
+                            try:
+                                await client.publish(topic, payload)
+                            except (ValueError, TypeError) as e:
+                                self._queue.popleft()
+                                self.dropped = self.dropped + 1
+                                logger.error(f"Dropped invalid message for {topic!r}: {e}")
+                                continue
+                            self._queue.popleft()
+                            latency = perf_counter() - queued
+                            mqtt_publish_seconds.observe(latency)
+                            self.published = self.published + 1
+                            self.latency_total = self.latency_total + latency
+                            self.latency_max = max(self.latency_max, latency)
+                        self._wakeup.clear()
+                        await self._wakeup.wait()
+            except asyncio.CancelledError:
+                self.connected = False
+                raise
+            except Exception as e:
+                self.connected = False
+                self.reconnects = self.reconnects + 1
+                logger.error(e)
+                await sleep(self.reconnect_delay)
+
+
+mqtt_publisher = MqttPublisher(settings.mqtt.publish_queue_size)
+
+
+class IngestionPipeline:
+    """Processes incoming MQTT messages independently of receiving them.
+
+    State messages are sharded by topic across `workers` bounded queues, each processed by its own worker, so that
+    messages for a single topic are always handled in order. If a state queue is full, the receiver waits for it.
+    Discovery messages go through a separate queue and worker, so that they never delay state messages. If the
+    discovery queue is full, then its oldest message is dropped, as devices re-send their discovery messages
+    whenever they are asked to.
+    """
+
+    def __init__(
+        self,
+        state_handler: Callable[[str, dict], Awaitable],
+        discovery_handler: Callable[[dict], Awaitable],
+        workers: int = 4,
+        queue_size: int = 1000,
+    ) -> None:
+        """Initialise the pipeline's queues."""
+        self.state_handler = state_handler
+        self.discovery_handler = discovery_handler
+        self.queues: list[asyncio.Queue[tuple[str, bytes | str, float]]] = [
+            asyncio.Queue(queue_size) for _ in range(workers)
+        ]
+        self.discovery_queue: asyncio.Queue[tuple[str, bytes | str, float]] = asyncio.Queue(queue_size)
+        self.received = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.failed = 0
+        self.stages = {"queued": StageStats(), "decode": StageStats(), "state": StageStats(), "discovery": StageStats()}
+        self._tasks: list[asyncio.Task] = []
+
+    async def submit(self, topic: str, payload: bytes | str) -> None:
+        """Queue the `payload` received for the `topic`."""
+        self.received = self.received + 1
+        parts = topic.split("/")
+        mqtt_messages.inc(parts[1] if len(parts) > 1 else "", parts[-1])
+        if topic.endswith("/config"):
+            if self.discovery_queue.full():
+                self.discovery_queue.get_nowait()
+                self.dropped = self.dropped + 1
+            self.discovery_queue.put_nowait((topic, payload, perf_counter()))
+        elif topic.endswith("/state"):
+            queue = self.queues[hash(topic) % len(self.queues)]
+            if queue.full():
+                self.blocked = self.blocked + 1
+            await queue.put((topic, payload, perf_counter()))
+
+    def start(self) -> None:
+        """Start the workers."""
+        self._tasks = [asyncio.create_task(self._work(queue, discovery=False)) for queue in self.queues]
+        self._tasks.append(asyncio.create_task(self._work(self.discovery_queue, discovery=True)))
+
+    async def stop(self) -> None:
+        """Stop the workers."""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def join(self) -> None:
+        """Wait until all queued messages have been processed."""
+        for queue in [*self.queues, self.discovery_queue]:
+            await queue.join()
+
+    def stats(self) -> dict:
+        """Return the pipeline statistics."""
+        return {
+            "received": self.received,
+            "dropped": self.dropped,
+            "blocked": self.blocked,
+            "failed": self.failed,
+            "queue_depths": [queue.qsize() for queue in self.queues],
+            "discovery_queue_depth": self.discovery_queue.qsize(),
+            "stages": {name: stage.stats() for name, stage in self.stages.items()},
+        }
+
+    async def _work(self, queue: asyncio.Queue[tuple[str, bytes | str, float]], discovery: bool) -> None:  # noqa: FBT001
+        """Process the messages in the `queue`."""
+        while True:
+            topic, payload, queued = await queue.get()
+            try:
+                start = perf_counter()
+                self.stages["queued"].record(start - queued)
+                data = codec.loads(payload)
+                decoded = perf_counter()
+                self.stages["decode"].record(decoded - start)
+                if discovery:
+                    await self.discovery_handler(data)
+                    self.stages["discovery"].record(perf_counter() - decoded)
+                else:
+                    await self.state_handler(topic, data)
+                    self.stages["state"].record(perf_counter() - decoded)
+            except Exception as e:
+                self.failed = self.failed + 1
+                logger.error(e)
+            finally:
+                queue.task_done()
+
+
 async def mqtt_listener() -> None:
-    """Run the MQTT broker listener."""
+    """Run the MQTT broker listener, which passes all received messages to the `mqtt_ingestion` pipeline.
+
+    If the `cluster_node` is running, then the device topics are subscribed to as shared subscriptions, so that each
+    message is ingested by only one server instance, and cluster bus messages are passed to the `cluster_node`.
+    """
     running = True
     while running:
         try:
             await recalculate_state()
             async with mqtt_client() as client:
-                await client.subscribe("mrfatcontroller/+/+/config")
-                await client.subscribe("mrfatcontroller/+/+/state")
+                prefix = f"$share/{settings.cluster.group}/" if cluster_node.running else ""
+                await client.subscribe(f"{prefix}mrfatcontroller/+/+/config")
+                await client.subscribe(f"{prefix}mrfatcontroller/+/+/state")
+                if cluster_node.running:
+                    await client.subscribe(cluster_node.topic_filter)
                 await client.publish("mrfatcontroller/status", "online")
                 async for message in client.messages:
-                    try:
-                        topic = tuple(message.topic.value.split("/"))
-                        if topic[-1] == "config":
-                            await register_new_entity(json.loads(cast(str, message.payload)))
-                        elif topic[-1] == "state":
-                            await state_manager.update_state(
-                                message.topic.value, json.loads(cast(str, message.payload))
-                            )
-                            await update_device_active(message.topic.value)
-                    except Exception as e:
-                        logger.error(e)
+                    if cluster_node.running and message.topic.matches(cluster_node.topic_filter):
+                        await cluster_node.receive(message.topic.value, cast(bytes, message.payload))
+                    else:
+                        await mqtt_ingestion.submit(message.topic.value, cast(bytes | str, message.payload))
         except asyncio.CancelledError:
             running = False
         except Exception as e:
@@ -84,10 +292,17 @@ async def mqtt_listener() -> None:
             await sleep(5)
 
 
+async def handle_state_message(topic: str, data: dict) -> None:
+    """Apply the state message `data` received for the `topic`."""
+    start = perf_counter()
+    await state_manager.update_state(topic, data)
+    update_state_seconds.observe(perf_counter() - start)
+    device_activity.seen(topic)
+
+
 async def full_state_refresh() -> None:
     """Request that all connected devices refresh their state."""
-    async with mqtt_client() as client:
-        await client.publish("mrfatcontroller/status", "online")
+    mqtt_publisher.publish("mrfatcontroller/status", "online")
 
 
 class NewDeviceModel(BaseModel):
@@ -108,159 +323,383 @@ class NewEntityModel(BaseModel):
     device: NewDeviceModel
 
 
-async def register_new_entity(data: dict) -> None:
-    """Register a new entity and device in the database."""
-    try:
+def config_hash(data: dict) -> str:
+    """Return a hash of the discovery `data`, which is independent of the order of its keys."""
+    return sha256(codec.dumps(data, sort_keys=True)).hexdigest()
+
+
+class DiscoveryBatcher:
+    """Registers the devices and entities from discovery messages in batches.
+
+    Discovery messages are collected for `window` seconds and then applied as one bulk upsert of their devices and
+    entities, followed by reloading the entity registry and the state of the affected models. Messages for an
+    already registered entity with an unchanged configuration are skipped. If the bulk upsert violates a constraint,
+    for example because two entities use the same state topic, then the entities are upserted one at a time and
+    only those that still fail are rejected. If loading the configuration hashes fails, then it is not retried for
+    `retry_delay` seconds, during which all messages are registered.
+    """
+
+    def __init__(self, window: float = 0.5, retry_delay: float = 30) -> None:
+        """Initialise the batcher without any pending messages."""
+        self.window = window
+        self.retry_delay = retry_delay
+        self.received = 0
+        self.skipped = 0
+        self.batches = 0
+        self.upserted = 0
+        self.rejected = 0
+        self._pending: dict[str, tuple[NewEntityModel, dict, str]] = {}
+        self._hashes: dict[str, str] | None = None
+        self._hashes_retry_at = 0.0
+        self._task: asyncio.Task | None = None
+
+    async def submit(self, data: dict) -> None:
+        """Queue the discovery `data` to be registered with the next batch."""
+        self.received = self.received + 1
         entity = NewEntityModel(**data)
-        async with (
-            db_session() as dbsession  # pyright: ignore[reportGeneralTypeIssues]
+        if self._hashes is None and monotonic() >= self._hashes_retry_at:
+            await self.load_hashes()
+        data_hash = config_hash(data)
+        if (
+            self._hashes is not None
+            and self._hashes.get(entity.unique_id) == data_hash
+            and entity_registry.find_by_external_id(entity.unique_id) is not None
         ):
-            query = select(Device).filter(Device.external_id == entity.device.identifiers[0])
-            result = await dbsession.execute(query)
-            device = result.scalar()
-            if device is None:
-                device = Device(
-                    external_id=entity.device.identifiers[0],
-                    name=entity.device.name,
-                    last_seen=datetime.now(tz=timezone.utc).replace(tzinfo=None),  # noqa: UP017
-                    attrs=data["device"],
-                )
-                dbsession.add(device)
-            else:
-                device.name = entity.device.name  # type: ignore
-                device.last_seen = datetime.now(tz=timezone.utc).replace(tzinfo=None)  # noqa: UP017
-                device.attrs = data["device"]
-            query = select(Entity).filter(Entity.external_id == entity.unique_id)
-            result = await dbsession.execute(query)
-            db_entity = result.scalar()
-            del data["device"]
-            if db_entity is None:
-                db_entity = Entity(
-                    name=entity.name,
-                    external_id=entity.unique_id,
-                    device=device,
-                    device_class=entity.device_class,
-                    state_topic=entity.state_topic,
-                    command_topic=entity.command_topic,
-                    attrs=data,
+            self.skipped = self.skipped + 1
+            return
+        self._pending[entity.unique_id] = (entity, data, data_hash)
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_later())
+
+    async def load_hashes(self) -> None:
+        """Load the configuration hashes for all entities stored in the database."""
+        try:
+            async with (
+                db_session() as dbsession  # pyright: ignore[reportGeneralTypeIssues]
+            ):
+                result = await dbsession.execute(
+                    select(Entity.external_id, Entity.attrs, Device.attrs).join(Device, Entity.device_id == Device.id)
                 )
-                dbsession.add(db_entity)
-            else:
-                db_entity.device = device
-                db_entity.name = entity.name  # type: ignore
-                db_entity.state_topic = entity.state_topic  # type: ignore
-                db_entity.command_topic = entity.command_topic  # type: ignore
-                db_entity.attrs = data  # type: ignore
-            await dbsession.commit()
-            await recalculate_state()
-    except Exception as e:
-        logger.error(e)
+                self._hashes = {
+                    external_id: config_hash({**entity_attrs, "device": device_attrs})
+                    for external_id, entity_attrs, device_attrs in result
+                    if entity_attrs is not None and device_attrs is not None
+                }
+        except Exception as e:
+            self._hashes_retry_at = monotonic() + self.retry_delay
+            logger.error(e)
 
+    async def flush(self) -> None:
+        """Register all pending devices and entities."""
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+        self._task = None
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = {}
+        try:
+            async with (
+                db_session() as dbsession  # pyright: ignore[reportGeneralTypeIssues]
+            ):
+                try:
+                    await self.upsert(dbsession, pending)
+                    await dbsession.commit()
+                except IntegrityError:
+                    await dbsession.rollback()
+                    pending = await self.upsert_each(dbsession, pending)
+        except Exception as e:
+            logger.error(e)
+            return
+        if not pending:
+            return
+        self.batches = self.batches + 1
+        self.upserted = self.upserted + len(pending)
+        if self._hashes is not None:
+            for external_id, (_, _, data_hash) in pending.items():
+                self._hashes[external_id] = data_hash
+        previous = {external_id: entity_registry.find_by_external_id(external_id) for external_id in pending}
+        await load_registry()
+        models = []
+        for external_id, previous_entry in previous.items():
+            entry = entity_registry.find_by_external_id(external_id)
+            if previous_entry is not None and (entry is None or entry.state_topic != previous_entry.state_topic):
+                await state_manager.remove_state(previous_entry.state_topic)
+            if entry is not None and entry.model_type is not None:
+                models.append((entry.model_type, entry.model_id))
+        await refresh_states(models)
 
-async def recalculate_state() -> None:  # TODO: This needs a better name.
-    """Recalculate the current state."""
+    async def upsert(self, dbsession: AsyncSession, pending: dict[str, tuple[NewEntityModel, dict, str]]) -> None:
+        """Upsert the devices and entities of the `pending` discovery messages, without committing them."""
+        now = datetime.now(tz=timezone.utc).replace(tzinfo=None)  # noqa: UP017
+        devices = {}
+        for entity, data, _ in pending.values():
+            devices[entity.device.identifiers[0]] = {
+                "external_id": entity.device.identifiers[0],
+                "name": entity.device.name,
+                "last_seen": now,
+                "attrs": data["device"],
+            }
+        device_table = Device.__table__
+        stmt = pg_insert(device_table).values(list(devices.values()))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[device_table.c.external_id],
+            set_={
+                "name": stmt.excluded.name,
+                "last_seen": stmt.excluded.last_seen,
+                "attrs": stmt.excluded.attrs,
+            },
+        ).returning(device_table.c.id, device_table.c.external_id)
+        device_ids = {external_id: device_id for device_id, external_id in await dbsession.execute(stmt)}
+        entity_table = Entity.__table__
+        stmt = pg_insert(entity_table).values(
+            [
+                {
+                    "external_id": entity.unique_id,
+                    "device_id": device_ids[entity.device.identifiers[0]],
+                    "name": entity.name,
+                    "device_class": entity.device_class,
+                    "state_topic": entity.state_topic,
+                    "command_topic": entity.command_topic,
+                    "attrs": {key: value for key, value in data.items() if key != "device"},
+                }
+                for entity, data, _ in pending.values()
+            ]
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[entity_table.c.external_id],
+            set_={
+                name: getattr(stmt.excluded, name)
+                for name in ("device_id", "name", "device_class", "state_topic", "command_topic", "attrs")
+            },
+        )
+        await dbsession.execute(stmt)
+
+    async def upsert_each(
+        self, dbsession: AsyncSession, pending: dict[str, tuple[NewEntityModel, dict, str]]
+    ) -> dict[str, tuple[NewEntityModel, dict, str]]:
+        """Upsert and commit the `pending` discovery messages one at a time and return those that succeeded."""
+        stored = {}
+        for external_id, item in pending.items():
+            try:
+                await self.upsert(dbsession, {external_id: item})
+                await dbsession.commit()
+                stored[external_id] = item
+            except IntegrityError as e:
+                await dbsession.rollback()
+                self.rejected = self.rejected + 1
+                logger.error(f"Rejected the discovery message for {external_id}: {e}")
+        return stored
+
+    async def stop(self) -> None:
+        """Register any pending devices and entities immediately."""
+        await self.flush()
+
+    def stats(self) -> dict:
+        """Return the discovery statistics."""
+        return {
+            "received": self.received,
+            "skipped": self.skipped,
+            "batches": self.batches,
+            "upserted": self.upserted,
+            "rejected": self.rejected,
+            "pending": len(self._pending),
+        }
+
+    async def _flush_later(self) -> None:
+        """Flush the pending messages once the batching window has passed."""
+        await sleep(self.window)
+        await self.flush()
+
+
+discovery_batcher = DiscoveryBatcher(settings.mqtt.discovery_window)
+
+
+STATE_MODELS: dict[str, tuple[type, type[BaseModel], type[StateRecord], tuple]] = {
+    "block_detector": (
+        BlockDetector,
+        BlockDetectorModel,
+        BlockDetectorRecord,
+        (joinedload(BlockDetector.entity), selectinload(BlockDetector.signal_automations)),
+    ),
+    "points": (
+        Points,
+        PointsModel,
+        PointsRecord,
+        (joinedload(Points.entity), selectinload(Points.signal_automations)),
+    ),
+    "power_switch": (PowerSwitch, PowerSwitchModel, PowerSwitchRecord, (joinedload(PowerSwitch.entity),)),
+    "signal": (
+        Signal,
+        SignalModel,
+        SignalRecord,
+        (joinedload(Signal.entity), selectinload(Signal.signal_automations)),
+    ),
+    "train": (Train, TrainModel, TrainRecord, (selectinload(Train.entity), selectinload(Train.controllers))),
+}
+"""The database class, validation model, state record class, and loading options for each type of state."""
+
+
+rebuild_stats = {"rebuilds": 0, "load_ms": 0.0, "apply_ms": 0.0, "models": 0}
+"""Timings of the last full state rebuild."""
+
+
+async def load_models(type_: str) -> list:
+    """Load all models of the given `type_` with everything needed for their state, using a separate session."""
+    cls, _, _, options = STATE_MODELS[type_]
     async with (
         db_session() as dbsession  # pyright: ignore[reportGeneralTypeIssues]
     ):
-        query = select(BlockDetector).options(
-            joinedload(BlockDetector.entity), selectinload(BlockDetector.signal_automations)
-        )
-        result = await dbsession.execute(query)
-        for block_detector in result.scalars():
-            await state_manager.add_state(
-                block_detector.entity.state_topic,
-                {
-                    "type": "block_detector",
-                    "model": BlockDetectorModel.model_validate(block_detector).model_dump(),
-                    "state": "unknown",
-                },
-            )
-        query = select(Points).options(joinedload(Points.entity), selectinload(Points.signal_automations))
-        result = await dbsession.execute(query)
-        for points in result.scalars():
-            if points.entity.state_topic in state_manager:
-                await state_manager.update_model(
-                    points.entity.state_topic, PointsModel.model_validate(points).model_dump(), notify=False
-                )
-            else:
-                await state_manager.add_state(
-                    points.entity.state_topic,
-                    {
-                        "type": "points",
-                        "model": PointsModel.model_validate(points).model_dump(),
-                        "state": "unknown",
-                    },
-                    notify=False,
-                )
-        query = select(PowerSwitch).options(joinedload(PowerSwitch.entity))
-        result = await dbsession.execute(query)
-        for power_switch in result.scalars():
-            if power_switch.entity.state_topic in state_manager:
-                await state_manager.update_model(
-                    power_switch.entity.state_topic,
-                    PowerSwitchModel.model_validate(power_switch).model_dump(),
-                    notify=False,
-                )
-            else:
-                await state_manager.add_state(
-                    power_switch.entity.state_topic,
-                    {
-                        "type": "power_switch",
-                        "model": PowerSwitchModel.model_validate(power_switch).model_dump(),
-                        "state": "unknown",
-                    },
-                    notify=False,
-                )
-        query = select(Signal).options(joinedload(Signal.entity), selectinload(Signal.signal_automations))
-        result = await dbsession.execute(query)
-        for signal in result.scalars():
-            if signal.entity.state_topic in state_manager:
-                await state_manager.update_model(
-                    signal.entity.state_topic, SignalModel.model_validate(signal).model_dump(), notify=False
-                )
-            else:
-                await state_manager.add_state(
-                    signal.entity.state_topic,
-                    {
-                        "type": "signal",
-                        "model": SignalModel.model_validate(signal).model_dump(),
-                        "state": "unknown",
-                    },
-                    notify=False,
-                )
-        query = select(Train).options(selectinload(Train.entity)).options(selectinload(Train.controllers))
-        result = await dbsession.execute(query)
-        for train in result.scalars():
-            if train.entity.state_topic in state_manager:
-                await state_manager.update_model(
-                    train.entity.state_topic, TrainModel.model_validate(train).model_dump(), notify=False
-                )
-            else:
-                await state_manager.add_state(
-                    train.entity.state_topic,
-                    {
-                        "type": "train",
-                        "model": TrainModel.model_validate(train).model_dump(),
-                        "state": "on",
-                        "speed": 0,
-                        "direction": "forward",
-                        "functions": {},
-                    },
-                    notify=False,
-                )
+        result = await dbsession.execute(select(cls).options(*options))
+        return list(result.scalars())
+
+
+async def load_registry() -> None:
+    """Load the entity registry, using a separate session."""
+    async with (
+        db_session() as dbsession  # pyright: ignore[reportGeneralTypeIssues]
+    ):
+        await entity_registry.load(dbsession)
+
+
+async def recalculate_state() -> None:  # TODO: This needs a better name.
+    """Rebuild the full state from the database.
+
+    This is only needed at startup and for an explicit resync. Changes to individual models are applied with
+    `refresh_state` and `remove_model_state`. All types are loaded concurrently, each on its own pooled session.
+    """
+    start = perf_counter()
+    loaded = await asyncio.gather(*[load_models(type_) for type_ in STATE_MODELS], load_registry())
+    loaded_at = perf_counter()
+    topics = set()
+    for type_, objs in zip(STATE_MODELS, loaded, strict=False):
+        for obj in objs:
+            await apply_model(type_, obj, notify=False, register=False)
+            topics.add(obj.entity.state_topic)
+    for topic in [topic for topic in state_manager.state if topic not in topics]:
+        await state_manager.remove_state(topic, notify=False)
+    state_manager.discard_restored()
     await state_manager._notify(None)
+    rebuild_stats["rebuilds"] = rebuild_stats["rebuilds"] + 1
+    rebuild_stats["load_ms"] = (loaded_at - start) * 1000
+    rebuild_stats["apply_ms"] = (perf_counter() - loaded_at) * 1000
+    rebuild_stats["models"] = len(topics)
+    logger.info(
+        f"Rebuilt the state for {len(topics)} models in {rebuild_stats['load_ms']:.1f}ms loading and "
+        f"{rebuild_stats['apply_ms']:.1f}ms applying"
+    )
 
 
-async def update_device_active(entity_topic) -> None:
-    """Update the database to note that a device was active."""
+async def apply_model(type_: str, obj: Any, notify: bool = True, register: bool = True) -> None:  # noqa: FBT001, FBT002
+    """Add or update the state record for the database `obj` of the given `type_`.
+
+    Unless `register` is `False`, the `obj`'s entity is also updated in the entity registry.
+    """
+    _, model_cls, record_cls, _ = STATE_MODELS[type_]
+    topic = obj.entity.state_topic
+    model = model_cls.model_validate(obj).model_dump()
+    existing = state_manager.find(type_, obj.id)
+    if existing is not None and existing.topic != topic:
+        await state_manager.remove_state(existing.topic, notify=notify)
+    existing = state_manager.get(topic)
+    if existing is not None and existing.type != type_:
+        await state_manager.remove_state(topic, notify=notify)
+    if topic in state_manager:
+        await state_manager.update_model(topic, model, notify=notify)
+    else:
+        await state_manager.add_state(record_cls(topic=topic, model=model), notify=notify)
+    if register:
+        entity_registry.add(entry_for_model(obj.entity, type_, obj))
+
+
+async def refresh_state(type_: str, model_id: int) -> None:
+    """Reload the state for the model of the given `type_` and `model_id` from the database.
+
+    If the model no longer exists, then its state is removed.
+    """
+    cls, _, _, options = STATE_MODELS[type_]
     async with (
         db_session() as dbsession  # pyright: ignore[reportGeneralTypeIssues]
     ):
-        query = (
-            select(Entity).filter(Entity.external_id == entity_topic.split("/")[2]).options(joinedload(Entity.device))
-        )
-        result = await dbsession.execute(query)
-        entity = result.scalar()
-        if entity is not None:
-            entity.device.last_seen = datetime.now(tz=timezone.utc).replace(tzinfo=None)  # noqa: UP017
-            await dbsession.commit()
+        result = await dbsession.execute(select(cls).filter(cls.id == model_id).options(*options))
+        obj = result.scalar()
+        if obj is not None:
+            await apply_model(type_, obj)
+            return
+    await remove_model_state(type_, model_id)
+
+
+async def refresh_states(models: Iterable[tuple[str, int | None]]) -> None:
+    """Reload the state for all `models`, given as `(type, id)`. Models without an id are ignored.
+
+    The models of each type are loaded with a single query. The state of models that no longer exist is removed.
+    """
+    by_type: dict[str, set[int]] = {}
+    for type_, model_id in models:
+        if model_id is not None:
+            by_type.setdefault(type_, set()).add(model_id)
+    if not by_type:
+        return
+    async with (
+        db_session() as dbsession  # pyright: ignore[reportGeneralTypeIssues]
+    ):
+        for type_, model_ids in by_type.items():
+            cls, _, _, options = STATE_MODELS[type_]
+            result = await dbsession.execute(select(cls).filter(cls.id.in_(model_ids)).options(*options))
+            for obj in result.scalars():
+                await apply_model(type_, obj)
+                model_ids.discard(obj.id)
+    for type_, model_ids in by_type.items():
+        for model_id in model_ids:
+            await remove_model_state(type_, model_id)
+
+
+async def remove_model_state(type_: str, model_id: int) -> None:
+    """Remove the state for the model of the given `type_` and `model_id`, keeping its entity registered."""
+    record = state_manager.find(type_, model_id)
+    if record is not None:
+        await state_manager.remove_state(record.topic)
+    entry = entity_registry.find(type_, model_id)
+    if entry is not None:
+        entity_registry.add(replace(entry, model_type=None, model_id=None, through_state=None, diverge_state=None))
+
+
+async def remove_entity_state(entity_id: int) -> None:
+    """Remove the state for the entity with the given `entity_id` and unregister the entity."""
+    record = state_manager.find_by_entity(entity_id)
+    if record is not None:
+        await state_manager.remove_state(record.topic)
+    entity_registry.remove(entity_id)
+
+
+async def remove_device_state(device_id: int) -> None:
+    """Remove the state for all entities of the device with the given `device_id` and unregister them."""
+    for entry in entity_registry.device_entries(device_id):
+        await remove_entity_state(entry.entity_id)
+
+
+def signal_automation_models(signal_automations: Iterable[SignalAutomation]) -> list[tuple[str, int | None]]:
+    """Return the `(type, id)` of all models whose state includes any of the `signal_automations`."""
+    models = []
+    for signal_automation in signal_automations:
+        models.append(("signal", signal_automation.signal_id))
+        models.append(("block_detector", signal_automation.block_detector_id))
+        models.append(("points", signal_automation.points_id))
+    return models
+
+
+mqtt_ingestion = IngestionPipeline(
+    handle_state_message,
+    discovery_batcher.submit,
+    workers=settings.mqtt.ingestion_workers,
+    queue_size=settings.mqtt.ingestion_queue_size,
+)
+cluster_node = ClusterNode(
+    state_manager,
+    mqtt_publisher.publish,
+    node_id=settings.cluster.node,
+    prefix=f"mrfatcontroller-cluster/{settings.cluster.group}",
+    heartbeat_interval=settings.cluster.heartbeat_interval,
+    leader_timeout=settings.cluster.leader_timeout,
+    on_models_changed=load_registry,
+)
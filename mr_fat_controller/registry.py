@@ -0,0 +1,177 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""In-memory registry of entities."""
+
+from dataclasses import dataclass
+from typing import Any
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from mr_fat_controller.models import BlockDetector, Entity, Points, PowerSwitch, Signal, Train
+
+MODEL_TYPES = ("block_detector", "points", "power_switch", "signal", "train")
+
+
+@dataclass(frozen=True, slots=True)
+class RegistryEntry:
+    """The identifiers and topics of a single entity and of the model it is used for."""
+
+    entity_id: int
+    external_id: str
+    device_id: int | None
+    state_topic: str
+    command_topic: str | None
+    model_type: str | None = None
+    model_id: int | None = None
+    through_state: str | None = None
+    diverge_state: str | None = None
+
+
+class EntityRegistry:
+    """Maps between entities, their models, topics, and devices without accessing the database."""
+
+    def __init__(self) -> None:
+        """Initialise the empty registry."""
+        self._by_id: dict[int, RegistryEntry] = {}
+        self._by_external_id: dict[str, RegistryEntry] = {}
+        self._by_state_topic: dict[str, RegistryEntry] = {}
+        self._by_command_topic: dict[str, RegistryEntry] = {}
+        self._by_model: dict[tuple[str, int], RegistryEntry] = {}
+
+    async def load(self, dbsession: AsyncSession) -> None:
+        """Replace the registry's content with all entities in the database.
+
+        This uses a single query that only fetches the columns the registry needs.
+        """
+        query = (
+            select(
+                Entity.id,
+                Entity.external_id,
+                Entity.device_id,
+                Entity.state_topic,
+                Entity.command_topic,
+                BlockDetector.id,
+                Points.id,
+                Points.through_state,
+                Points.diverge_state,
+                PowerSwitch.id,
+                Signal.id,
+                Train.id,
+            )
+            .outerjoin(BlockDetector, BlockDetector.entity_id == Entity.id)
+            .outerjoin(Points, Points.entity_id == Entity.id)
+            .outerjoin(PowerSwitch, PowerSwitch.entity_id == Entity.id)
+            .outerjoin(Signal, Signal.entity_id == Entity.id)
+            .outerjoin(Train, Train.entity_id == Entity.id)
+        )
+        result = await dbsession.execute(query)
+        self.clear()
+        for row in result:
+            entity_id, external_id, device_id, state_topic, command_topic = row[:5]
+            block_detector_id, points_id, through_state, diverge_state, power_switch_id, signal_id, train_id = row[5:]
+            kwargs = {}
+            for model_type, model_id in zip(
+                MODEL_TYPES, (block_detector_id, points_id, power_switch_id, signal_id, train_id), strict=True
+            ):
+                if model_id is not None:
+                    kwargs = {"model_type": model_type, "model_id": model_id}
+                    if model_type == "points":
+                        kwargs["through_state"] = through_state
+                        kwargs["diverge_state"] = diverge_state
+                    break
+            self.add(
+                RegistryEntry(
+                    entity_id=entity_id,
+                    external_id=external_id,
+                    device_id=device_id,
+                    state_topic=state_topic,
+                    command_topic=command_topic,
+                    **kwargs,
+                )
+            )
+
+    def add(self, entry: RegistryEntry) -> None:
+        """Add the `entry` to the registry, replacing any existing entry for the same entity."""
+        self.remove(entry.entity_id)
+        self._by_id[entry.entity_id] = entry
+        self._by_external_id[entry.external_id] = entry
+        self._by_state_topic[entry.state_topic] = entry
+        if entry.command_topic is not None:
+            self._by_command_topic[entry.command_topic] = entry
+        if entry.model_type is not None and entry.model_id is not None:
+            self._by_model[(entry.model_type, entry.model_id)] = entry
+
+    def remove(self, entity_id: int) -> None:
+        """Remove the entry for the entity with the given `entity_id`."""
+        entry = self._by_id.pop(entity_id, None)
+        if entry is not None:
+            self._by_external_id.pop(entry.external_id, None)
+            self._by_state_topic.pop(entry.state_topic, None)
+            if entry.command_topic is not None:
+                self._by_command_topic.pop(entry.command_topic, None)
+            if entry.model_type is not None and entry.model_id is not None:
+                self._by_model.pop((entry.model_type, entry.model_id), None)
+
+    def remove_device(self, device_id: int) -> None:
+        """Remove the entries for all entities of the device with the given `device_id`."""
+        for entry in self.device_entries(device_id):
+            self.remove(entry.entity_id)
+
+    def device_entries(self, device_id: int) -> list[RegistryEntry]:
+        """Return the entries for all entities of the device with the given `device_id`."""
+        return [entry for entry in self._by_id.values() if entry.device_id == device_id]
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        self._by_id = {}
+        self._by_external_id = {}
+        self._by_state_topic = {}
+        self._by_command_topic = {}
+        self._by_model = {}
+
+    def get(self, entity_id: int) -> RegistryEntry | None:
+        """Return the entry for the entity with the given `entity_id`."""
+        return self._by_id.get(entity_id)
+
+    def find(self, type_: str, model_id: int) -> RegistryEntry | None:
+        """Return the entry for the entity used by the model of the given `type_` and `model_id`."""
+        return self._by_model.get((type_, model_id))
+
+    def find_by_external_id(self, external_id: str) -> RegistryEntry | None:
+        """Return the entry for the entity with the given `external_id`."""
+        return self._by_external_id.get(external_id)
+
+    def find_by_state_topic(self, topic: str) -> RegistryEntry | None:
+        """Return the entry for the entity with the given state `topic`."""
+        return self._by_state_topic.get(topic)
+
+    def find_by_command_topic(self, topic: str) -> RegistryEntry | None:
+        """Return the entry for the entity with the given command `topic`."""
+        return self._by_command_topic.get(topic)
+
+    def __len__(self) -> int:
+        """Return the number of entities in the registry."""
+        return len(self._by_id)
+
+
+def entry_for_model(entity: Entity, model_type: str | None, model: Any) -> RegistryEntry:
+    """Return the `RegistryEntry` for the `entity`, which is used by the `model` of the given `model_type`."""
+    kwargs = {}
+    if model_type is not None and model is not None:
+        kwargs = {"model_type": model_type, "model_id": model.id}
+        if model_type == "points":
+            kwargs["through_state"] = model.through_state
+            kwargs["diverge_state"] = model.diverge_state
+    return RegistryEntry(
+        entity_id=entity.id,  # type: ignore
+        external_id=entity.external_id,  # type: ignore
+        device_id=entity.device_id,  # type: ignore
+        state_topic=entity.state_topic,  # type: ignore
+        command_topic=entity.command_topic,  # type: ignore
+        **kwargs,
+    )
+
+
+entity_registry = EntityRegistry()
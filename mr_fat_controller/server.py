@@ -15,16 +15,40 @@ from fastapi.staticfiles import StaticFiles
 from httpx import AsyncClient
 
 from mr_fat_controller import api, automation, mqtt
+from mr_fat_controller.activity import device_activity
 from mr_fat_controller.settings import settings
+from mr_fat_controller.state import state_manager
+from mr_fat_controller.state.journal import StateJournal
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, Any]:  # noqa: ARG001
     """Set up all lifespan activities."""
+    journal = None
+    if settings.state.journal_path is not None:
+        journal = StateJournal(
+            settings.state.journal_path,
+            flush_interval=settings.state.journal_flush_interval,
+            compact_threshold=settings.state.journal_compact_threshold,
+        )
+        await journal.start(state_manager)
+    device_activity.start()
+    mqtt.mqtt_publisher.start()
+    mqtt.mqtt_ingestion.start()
+    if settings.cluster.enabled:
+        mqtt.cluster_node.start()
     mqtt_listener_task = asyncio.create_task(mqtt.mqtt_listener())
     await automation.setup_automations()
     yield
     mqtt_listener_task.cancel()
+    await automation.stop_automations()
+    await mqtt.mqtt_ingestion.stop()
+    await mqtt.cluster_node.stop()
+    await mqtt.discovery_batcher.stop()
+    await mqtt.mqtt_publisher.stop()
+    await device_activity.stop()
+    if journal is not None:
+        await journal.stop()
 
 
 app = FastAPI(lifespan=lifespan)  # pyright: ignore[reportArgumentType]
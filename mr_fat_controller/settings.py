@@ -3,6 +3,8 @@
 # SPDX-License-Identifier: MIT
 """Access to the application settings."""
 
+from typing import Literal
+
 from pydantic import BaseModel
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -16,6 +18,10 @@ class MqttSettings(BaseModel):
     password: str | None = None
     tls: bool = True
     insecure_tls: bool = True
+    publish_queue_size: int = 1000
+    ingestion_workers: int = 4
+    ingestion_queue_size: int = 1000
+    discovery_window: float = 0.5
 
 
 class WiThrottleSettings(BaseModel):
@@ -26,12 +32,54 @@ class WiThrottleSettings(BaseModel):
     name: str = "Unknown"
 
 
+class StateSettings(BaseModel):
+    """State management settings model."""
+
+    listener_queue_size: int = 100
+    listener_overflow: Literal["drop-oldest", "snapshot"] = "snapshot"
+    change_log_size: int = 1000
+    coalesce_window: float = 0
+    coalesce_windows: dict[str, float] = {"block_detector": 0}
+    journal_path: str | None = None
+    journal_flush_interval: float = 1
+    journal_compact_threshold: int = 10000
+    history_size: int = 600
+    activity_flush_interval: float = 10
+
+
+class AutomationSettings(BaseModel):
+    """Automation settings model."""
+
+    signal_debounce: float = 0.02
+    queue_size: int = 1000
+    max_lag: float = 1
+    watchdog_interval: float = 5
+
+
+class ClusterSettings(BaseModel):
+    """Cluster settings model."""
+
+    enabled: bool = False
+    group: str = "mrfatcontroller"
+    node: str | None = None
+    heartbeat_interval: float = 2
+    leader_timeout: float = 6
+
+
 class Settings(BaseSettings):
-    """Application settings model."""
+    """Application settings model.
+
+    Settings are read from environment variables prefixed with `MFC_`. Nested settings are named by their group
+    and their name, for example `MFC_MQTT_HOST` or `MFC_STATE_JOURNAL_PATH`. Only the first `_` after the group
+    separates it from the name, so that names that themselves contain `_` can be set directly.
+    """
 
     dsn: str
     mqtt: MqttSettings
     withrottle: WiThrottleSettings = WiThrottleSettings()
+    state: StateSettings = StateSettings()
+    automation: AutomationSettings = AutomationSettings()
+    cluster: ClusterSettings = ClusterSettings()
     dev: bool = False
 
     model_config = SettingsConfigDict(
@@ -39,6 +87,7 @@ class Settings(BaseSettings):
         env_file_encoding="utf-8",
         env_prefix="mfc_",
         env_nested_delimiter="_",
+        env_nested_max_split=1,
         extra="ignore",
     )
 
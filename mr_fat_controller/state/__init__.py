@@ -0,0 +1,430 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""State management support."""
+
+import asyncio
+import logging
+from collections.abc import Callable, Iterable
+from time import monotonic
+from uuid import uuid4
+
+from mr_fat_controller import codec
+from mr_fat_controller.settings import settings
+from mr_fat_controller.state.history import RingBuffer, StateHistory  # noqa: F401
+from mr_fat_controller.state.listeners import (  # noqa: F401
+    ChangeLog,
+    Listener,
+    ListenerChannel,
+    OverflowPolicy,
+    StateChange,
+    Subscription,
+    merge_diffs,
+)
+from mr_fat_controller.state.records import (  # noqa: F401
+    BlockDetectorRecord,
+    PointsRecord,
+    PowerSwitchRecord,
+    SignalRecord,
+    StateRecord,
+    TrainRecord,
+)
+from mr_fat_controller.state.reducers import Reducer, reducers, register_reducer  # noqa: F401
+
+logger = logging.getLogger(__name__)
+
+
+class StateManager:
+    """Implements a state management engine."""
+
+    def __init__(
+        self,
+        listener_queue_size: int = 100,
+        listener_overflow: OverflowPolicy = "snapshot",
+        change_log_size: int = 1000,
+        coalesce_window: float = 0,
+        coalesce_windows: dict[str, float] | None = None,
+        history_size: int = 0,
+    ) -> None:
+        """Initialise the state management with an empty state and empty listeners.
+
+        Every change to the state is assigned the next `sequence` number. The `epoch` identifies this state
+        manager instance, so that sequence numbers from a previous server run are never mistaken for current ones.
+
+        If the `coalesce_window` (in seconds) is greater than zero, then changes are held back for that long and
+        all changes within the window are notified together, with only the latest value for each topic. The
+        `coalesce_windows` override the window for individual state types, with a zero window notifying changes
+        to that type immediately.
+
+        If the `history_size` is greater than zero, then the last `history_size` values of each topic are kept in
+        the `history`.
+
+        If a `replicator` is set, then it is called with every change to the state that did not itself come from
+        `apply_remote`, so that it can be sent to other server instances.
+        """
+        self.state: dict[str, StateRecord] = {}
+        self.listeners: list[ListenerChannel] = []
+        self.epoch = uuid4().hex
+        self.sequence = 0
+        self.change_log = ChangeLog(change_log_size)
+        self.coalesce_window = coalesce_window
+        self.coalesce_windows = coalesce_windows if coalesce_windows is not None else {}
+        self._coalesced: dict[str, dict | None] = {}
+        self._coalesce_handle: asyncio.TimerHandle | None = None
+        self._coalesce_deadline = 0.0
+        self.listener_queue_size = listener_queue_size
+        self.listener_overflow = listener_overflow
+        self._by_model: dict[tuple[str, int], StateRecord] = {}
+        self._by_entity: dict[int, StateRecord] = {}
+        self._routes: dict[str, tuple[ListenerChannel, ...]] = {}
+        self._removed: dict[str, StateRecord] = {}
+        self.restored: dict[str, dict] = {}
+        self.history = StateHistory(history_size) if history_size > 0 else None
+        self._encoded: dict[str, bytes] = {}
+        self._encoded_snapshot: bytes | None = None
+        self.replicator: Callable[[str | None, dict | None], None] | None = None
+        self._remote = False
+
+    async def clear_state(self) -> None:
+        """Clear all state."""
+        self.state = {}
+        self._by_model = {}
+        self._by_entity = {}
+        self._routes = {}
+        self._removed = {}
+        if self.history is not None:
+            self.history.clear()
+        self._invalidate(None)
+        await self._notify(None)
+
+    def restore(self, values: dict[str, dict]) -> None:
+        """Restore the last known `values` for each topic.
+
+        The values are applied to the records when they are added to the state and the records are marked as stale
+        until their device reports its state. Values that have not yet been applied are kept in `restored`.
+        """
+        self.restored = values
+        for topic, record in self.state.items():
+            if topic in self.restored:
+                self._restore_record(record)
+                self._invalidate(topic)
+
+    def discard_restored(self) -> None:
+        """Discard the restored values that have not been applied, once all models are known to be in the state."""
+        self.restored = {}
+
+    async def add_state(self, record: StateRecord, notify: bool = True) -> None:  # noqa: FBT001, FBT002
+        """Add the state `record` to the state manager.
+
+        This will have no effect if the record's topic is already held in the state.
+        """
+        if record.topic not in self.state:
+            record.reducer = reducers.get(record.type)
+            self._removed.pop(record.topic, None)
+            if record.topic in self.restored:
+                self._restore_record(record)
+            self.state[record.topic] = record
+            self._index(record)
+            self._invalidate(record.topic)
+            if self.history is not None:
+                self.history.record(record, monotonic())
+            if notify:
+                await self._notify(record.topic)
+
+    async def remove_state(self, topic: str, notify: bool = True) -> None:  # noqa: FBT001, FBT002
+        """Remove the state record for the `topic` from the state manager.
+
+        Listeners are notified of the removal as a change to the `topic`, which is then no longer held in the state.
+        """
+        record = self.state.pop(topic, None)
+        if record is not None:
+            self._unindex(record)
+            self._invalidate(topic)
+            self._removed[topic] = record
+            if self.history is not None:
+                self.history.remove(topic)
+            if notify:
+                await self._notify(topic)
+
+    async def update_model(self, topic: str, model: dict, notify: bool = True) -> None:  # noqa: FBT001, FBT002
+        """Update the model of a state held in the state manager.
+
+        This will have no effect if the `topic` is not held in the state.
+        """
+        if topic in self.state:
+            record = self.state[topic]
+            self._unindex(record)
+            record.model = model
+            self._index(record)
+            self._invalidate(topic)
+            if notify:
+                await self._notify(topic)
+
+    async def update_state(self, topic: str, data: dict) -> None:
+        """Update the state of the given `topic` with the `data`.
+
+        Listeners are only notified if this actually changes the state, and are given the changed fields.
+        """
+        record = self.state.get(topic)
+        if record is None:
+            logger.error(f"Unknown topic {topic}")
+        elif record.reducer is None:
+            logger.debug(record)
+        else:
+            changes = record.reducer(record, data)
+            if record.stale:
+                record.stale = False
+                changes["stale"] = False
+            if changes:
+                self._invalidate(topic)
+                if self.history is not None:
+                    self.history.record(record, monotonic())
+                await self._notify(topic, changes)
+
+    async def apply_remote(self, topic: str, diff: dict | None, record: dict | None) -> None:
+        """Apply a change to the `topic` that was made by another server instance.
+
+        If a `diff` is given, then only its fields are applied to the record held for the `topic`. Otherwise the
+        `record`, in its serialised form, replaces the held record or, if it is `None`, the held record is removed.
+        The change is not passed to the `replicator`.
+        """
+        self._remote = True
+        try:
+            held = self.state.get(topic)
+            if diff is not None:
+                if held is not None:
+                    changes = held.apply(diff)
+                    if changes:
+                        self._invalidate(topic)
+                        if self.history is not None:
+                            self.history.record(held, monotonic())
+                        await self._notify(topic, changes)
+            elif record is None:
+                await self.remove_state(topic)
+            else:
+                values = {name: value for name, value in record.items() if name not in ("type", "model")}
+                if held is not None and held.type == record["type"]:
+                    held.apply(values)
+                    await self.update_model(topic, record["model"])
+                elif record["type"] in reducers:
+                    if held is not None:
+                        await self.remove_state(topic, notify=False)
+                    new_record = reducers[record["type"]].record_type(topic=topic, model=record["model"])
+                    new_record.apply(values)
+                    await self.add_state(new_record)
+                else:
+                    logger.error(f"Unknown state type {record['type']}")
+        finally:
+            self._remote = False
+
+    def get(self, topic: str) -> StateRecord | None:
+        """Return the state record for the `topic`, if it is held in the state."""
+        return self.state.get(topic)
+
+    def find(self, type_: str, model_id: int) -> StateRecord | None:
+        """Return the state record for the model of the given `type_` and `model_id`."""
+        return self._by_model.get((type_, model_id))
+
+    def find_by_entity(self, entity_id: int) -> StateRecord | None:
+        """Return the state record for the entity with the given `entity_id`."""
+        return self._by_entity.get(entity_id)
+
+    def serialize(self, topic: str | None = None) -> dict:
+        """Return the JSON-compatible representation of a single `topic` or of the full state."""
+        if topic is not None:
+            return {topic: self.state[topic].to_dict()}
+        return {topic: record.to_dict() for topic, record in self.state.items()}
+
+    def encoded(self, topic: str | None = None) -> bytes:
+        """Return the JSON-encoded record for a single `topic` or the JSON-encoded full state.
+
+        The encoded bytes are cached until the state changes, so that they can be shared by all listeners.
+        """
+        if topic is not None:
+            if topic not in self._encoded:
+                self._encoded[topic] = codec.dumps(self.state[topic].to_dict())
+            return self._encoded[topic]
+        if self._encoded_snapshot is None:
+            self._encoded_snapshot = self.encoded_topics(self.state)
+        return self._encoded_snapshot
+
+    def encoded_topics(self, topics: Iterable[str]) -> bytes:
+        """Return the JSON-encoded object mapping each of the `topics` to its record, built from the cached records."""
+        return b"{" + b",".join(codec.dumps(topic) + b":" + self.encoded(topic) for topic in topics) + b"}"
+
+    async def add_listener(
+        self,
+        listener: Listener,
+        overflow: OverflowPolicy | None = None,
+        resume_from: int | None = None,
+        subscription: Subscription | None = None,
+    ) -> None:
+        """Add a callback listener.
+
+        The listener is called from its own delivery task, starting with the current state. The `overflow` policy
+        overrides the default policy for handling a listener that falls behind. If `resume_from` is set to the
+        sequence number the listener has last seen, then it starts with only the topics changed since then,
+        unless those are no longer available in the change log. If a `subscription` is given, then the listener
+        is only called for changes to the topics it is interested in and for full state changes.
+        """
+        channel = ListenerChannel(
+            self,
+            listener,
+            self.listener_queue_size,
+            overflow if overflow is not None else self.listener_overflow,
+            subscription,
+        )
+        self.listeners.append(channel)
+        self._routes = {}
+        topics = None
+        if resume_from is not None:
+            topics = self.change_log.since(resume_from, self.sequence)
+        if topics is not None:
+            channel.put(
+                [topic for topic in topics if channel.subscription.matches(topic, self._routing_record(topic))],
+                self.sequence,
+            )
+        else:
+            channel.put_snapshot(self.sequence)
+
+    async def remove_listener(self, listener: Listener) -> None:
+        """Remove a callback listener."""
+        for channel in self.listeners:
+            if channel.listener == listener:
+                channel.close()
+        self.listeners = [channel for channel in self.listeners if channel.listener != listener]
+        self._routes = {}
+
+    def listener_stats(self) -> list[dict]:
+        """Return the delivery statistics for all listeners."""
+        return [channel.stats() for channel in self.listeners]
+
+    def reducer_stats(self) -> list[dict]:
+        """Return the timing statistics for all reducers."""
+        return [reducer.stats() for reducer in reducers.values()]
+
+    async def _notify(self, change_topic: str | None, diff: dict | None = None) -> None:
+        """Notify all listeners of a change to the `change_topic` or, if it is `None`, to the full state.
+
+        If only individual fields of the `change_topic` have changed, then `diff` holds those fields. This only
+        queues the change with each listener and never waits for the listeners to process it. If coalescing is
+        enabled for the `change_topic`, the change is held back until its window has passed.
+        """
+        if self.replicator is not None and not self._remote:
+            self.replicator(change_topic, diff)
+        if change_topic is None:
+            self._flush_coalesced()
+            self._publish(None)
+            return
+        window = self.coalesce_window
+        if change_topic in self.state:
+            window = self.coalesce_windows.get(self.state[change_topic].type, window)
+        if window <= 0:
+            self._publish({change_topic: diff})
+            return
+        if change_topic in self._coalesced:
+            self._coalesced[change_topic] = merge_diffs(self._coalesced[change_topic], diff)
+        else:
+            self._coalesced[change_topic] = diff
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + window
+        if self._coalesce_handle is None or deadline < self._coalesce_deadline:
+            if self._coalesce_handle is not None:
+                self._coalesce_handle.cancel()
+            self._coalesce_handle = loop.call_at(deadline, self._flush_coalesced)
+            self._coalesce_deadline = deadline
+
+    def _flush_coalesced(self) -> None:
+        """Notify all listeners of the changes held back for coalescing as a single change."""
+        if self._coalesce_handle is not None:
+            self._coalesce_handle.cancel()
+            self._coalesce_handle = None
+        if self._coalesced:
+            changes = self._coalesced
+            self._coalesced = {}
+            self._publish(changes)
+
+    def _publish(self, changes: dict[str, dict | None] | None) -> None:
+        """Assign the next sequence number to the `changes` and queue them with all listeners.
+
+        The `changes` map each changed topic to its field-level diff, or `None` if the whole record has changed. If
+        `changes` is `None`, then the full state has changed.
+        """
+        self.sequence = self.sequence + 1
+        if changes is None:
+            self.change_log.append(self.sequence, None)
+            for channel in self.listeners:
+                channel.put_snapshot(self.sequence)
+        else:
+            self.change_log.append(self.sequence, frozenset(changes))
+            diffs = {topic: diff for topic, diff in changes.items() if diff is not None}
+            routed: dict[ListenerChannel, list[str]] = {}
+            for topic in changes:
+                for channel in self._route(topic):
+                    if channel in routed:
+                        routed[channel].append(topic)
+                    else:
+                        routed[channel] = [topic]
+            for channel, topics in routed.items():
+                channel.put(topics, self.sequence, diffs)
+
+    def _route(self, topic: str) -> tuple[ListenerChannel, ...]:
+        """Return the listener channels interested in changes to the `topic`.
+
+        The routes are cached until the listeners or the record held for the `topic` change.
+        """
+        if topic not in self._routes:
+            record = self._routing_record(topic)
+            self._routes[topic] = tuple(
+                channel for channel in self.listeners if channel.subscription.matches(topic, record)
+            )
+        return self._routes[topic]
+
+    def _routing_record(self, topic: str) -> StateRecord | None:
+        """Return the record to route changes to the `topic` by, which for a removed topic is its last record."""
+        if topic in self.state:
+            return self.state[topic]
+        return self._removed.get(topic)
+
+    def _invalidate(self, topic: str | None) -> None:
+        """Drop the cached encoding of the `topic` or, if it is `None`, of all topics."""
+        if topic is None:
+            self._encoded = {}
+        else:
+            self._encoded.pop(topic, None)
+        self._encoded_snapshot = None
+
+    def _restore_record(self, record: StateRecord) -> None:
+        """Apply the restored values to the `record` and mark it as stale."""
+        values = self.restored.pop(record.topic)
+        record.apply({name: value for name, value in values.items() if name in record.values()})
+        record.stale = True
+
+    def _index(self, record: StateRecord) -> None:
+        """Add the `record` to the secondary indexes."""
+        self._routes.pop(record.topic, None)
+        self._by_model[(record.type, record.model_id)] = record
+        if record.entity_id is not None:
+            self._by_entity[record.entity_id] = record
+
+    def _unindex(self, record: StateRecord) -> None:
+        """Remove the `record` from the secondary indexes."""
+        self._routes.pop(record.topic, None)
+        if self._by_model.get((record.type, record.model_id)) is record:
+            del self._by_model[(record.type, record.model_id)]
+        if record.entity_id is not None and self._by_entity.get(record.entity_id) is record:
+            del self._by_entity[record.entity_id]
+
+    def __contains__(self, topic: str) -> bool:
+        """Return whether the given `topic` is held in the state."""
+        return topic in self.state
+
+
+state_manager = StateManager(
+    listener_queue_size=settings.state.listener_queue_size,
+    listener_overflow=settings.state.listener_overflow,
+    change_log_size=settings.state.change_log_size,
+    coalesce_window=settings.state.coalesce_window,
+    coalesce_windows=settings.state.coalesce_windows,
+    history_size=settings.state.history_size,
+)
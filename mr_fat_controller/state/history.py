@@ -0,0 +1,144 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Bounded history of state values."""
+
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+from time import monotonic, time
+from typing import Literal
+
+from mr_fat_controller.state.records import StateRecord
+
+STATE_VALUES: dict[str, dict[str, float]] = {
+    "block_detector": {"off": 0, "on": 1},
+    "points": {"through": 0, "diverge": 1},
+    "power_switch": {"off": 0, "on": 1},
+    "signal": {"off": -1, "danger": 0, "clear": 1},
+}
+"""The numeric values recorded for the states of each type. Unknown states are recorded as NaN."""
+
+Aggregate = Literal["last", "mean", "min", "max"]
+
+
+def wall_clock_offset() -> float:
+    """Return the offset to add to a `time.monotonic` timestamp to convert it into the current wall-clock time."""
+    return time() - monotonic()
+
+
+def record_value(record: StateRecord) -> float:
+    """Return the numeric value to record for the `record`. For trains this is the speed."""
+    if record.type == "train":
+        return float(getattr(record, "speed", math.nan))
+    return STATE_VALUES.get(record.type, {}).get(record.state, math.nan)
+
+
+class RingBuffer:
+    """A fixed-size ring buffer of timestamped values, backed by two arrays of doubles."""
+
+    __slots__ = ("_head", "count", "size", "times", "values")
+
+    def __init__(self, size: int) -> None:
+        """Initialise the buffer to hold at most `size` values."""
+        self.size = size
+        self.times = array("d", bytes(8 * size))
+        self.values = array("d", bytes(8 * size))
+        self.count = 0
+        self._head = 0
+
+    def append(self, timestamp: float, value: float) -> None:
+        """Append the `value` at the given `timestamp`, overwriting the oldest value if the buffer is full."""
+        self.times[self._head] = timestamp
+        self.values[self._head] = value
+        self._head = (self._head + 1) % self.size
+        if self.count < self.size:
+            self.count = self.count + 1
+
+    def last(self) -> float:
+        """Return the most recently appended value."""
+        return self.values[self._head - 1]
+
+    def ordered(self) -> tuple[array, array]:
+        """Return the timestamps and values in chronological order."""
+        if self.count < self.size:
+            return self.times[: self.count], self.values[: self.count]
+        return (
+            self.times[self._head :] + self.times[: self._head],
+            self.values[self._head :] + self.values[: self._head],
+        )
+
+    def window(self, since: float, until: float) -> tuple[array, array]:
+        """Return the timestamps and values recorded between `since` and `until` (inclusive)."""
+        times, values = self.ordered()
+        start = bisect_left(times, since)
+        end = bisect_right(times, until)
+        return times[start:end], values[start:end]
+
+    def downsample(self, since: float, until: float, buckets: int, aggregate: Aggregate) -> tuple[list, list]:
+        """Return the values between `since` and `until` aggregated into `buckets` equally long time buckets.
+
+        Each bucket is identified by its start time. For the `"last"` aggregate, buckets without any values carry
+        forward the last value before them, as the recorded values are states. For all other aggregates they are
+        `NaN`.
+        """
+        times, values = self.ordered()
+        width = (until - since) / buckets
+        bucket_times = []
+        bucket_values = []
+        previous = bisect_left(times, since)
+        last = values[previous - 1] if previous > 0 else math.nan
+        for idx in range(buckets):
+            start = since + idx * width
+            end = bisect_left(times, start + width) if idx < buckets - 1 else bisect_right(times, until)
+            bucket = values[previous:end]
+            if len(bucket) == 0:
+                value = last if aggregate == "last" else math.nan
+            elif aggregate == "mean":
+                value = math.fsum(bucket) / len(bucket)
+            elif aggregate == "min":
+                value = min(bucket)
+            elif aggregate == "max":
+                value = max(bucket)
+            else:
+                value = bucket[-1]
+            if len(bucket) > 0:
+                last = bucket[-1]
+            bucket_times.append(start)
+            bucket_values.append(value)
+            previous = end
+        return bucket_times, bucket_values
+
+
+class StateHistory:
+    """Keeps a bounded history of values for each topic.
+
+    Each topic gets a `RingBuffer` holding its last `size` values, so the memory used is fixed at 16 bytes per
+    value per topic. Values are recorded at `time.monotonic` timestamps, so that they stay ordered if the wall clock
+    is changed. Use the `wall_clock_offset` to convert between the two.
+    """
+
+    def __init__(self, size: int) -> None:
+        """Initialise the empty history, keeping `size` values per topic."""
+        self.size = size
+        self.buffers: dict[str, RingBuffer] = {}
+
+    def record(self, record: StateRecord, timestamp: float) -> None:
+        """Record the current value of the `record` at the given `timestamp`, unless it is unchanged."""
+        if record.topic not in self.buffers:
+            self.buffers[record.topic] = RingBuffer(self.size)
+        buffer = self.buffers[record.topic]
+        value = record_value(record)
+        if buffer.count > 0:
+            last = buffer.last()
+            if last == value or (math.isnan(last) and math.isnan(value)):
+                return
+        buffer.append(timestamp, value)
+
+    def remove(self, topic: str) -> None:
+        """Remove the history for the `topic`."""
+        self.buffers.pop(topic, None)
+
+    def clear(self) -> None:
+        """Remove all history."""
+        self.buffers = {}
@@ -0,0 +1,153 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Persistent journal of the last known state."""
+
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO
+
+from mr_fat_controller import codec
+from mr_fat_controller.state.listeners import StateChange
+
+if TYPE_CHECKING:
+    from mr_fat_controller.state import StateManager
+
+logger = logging.getLogger(__name__)
+
+
+class StateJournal:
+    """Keeps the last known values for each topic on disk, so that they can be restored after a restart.
+
+    The journal consists of a snapshot file at `path`, holding the values for all topics, and an append-only log
+    next to it, into which every change is written as one JSON line. Changes are buffered in memory and written every
+    `flush_interval` seconds, with all file access running in a worker thread, so that recording a change never
+    blocks the event loop. Repeated changes to a topic between two flushes are only written once. Once the log holds
+    more than `compact_threshold` entries or the full state has changed, the current state is written as the new
+    snapshot and the log is truncated, which also drops all topics that are no longer held in the state.
+    """
+
+    def __init__(self, path: str | Path, flush_interval: float = 1, compact_threshold: int = 10000) -> None:
+        """Initialise the journal."""
+        self.path = Path(path)
+        self.log_path = self.path.with_name(f"{self.path.name}.log")
+        self.flush_interval = flush_interval
+        self.compact_threshold = compact_threshold
+        self._buffer: dict[str, dict | None] = {}
+        self._log: BinaryIO | None = None
+        self._log_entries = 0
+        self._full_change = False
+        self._lock = asyncio.Lock()
+        self._manager: StateManager | None = None
+        self._task: asyncio.Task | None = None
+
+    def load(self) -> dict[str, dict]:
+        """Load the last known values for each topic from the snapshot and the log."""
+        values = {}
+        if self.path.exists():
+            try:
+                with open(self.path, "rb") as in_f:
+                    values = codec.loads(in_f.read())
+            except Exception as e:
+                logger.error(f"Failed to load the state journal snapshot: {e}")
+        if self.log_path.exists():
+            with open(self.log_path, "rb") as in_f:
+                for line in in_f:
+                    try:
+                        entry = codec.loads(line)
+                    except ValueError:
+                        logger.warning("Ignoring a corrupt state journal entry")
+                        continue
+                    self._log_entries = self._log_entries + 1
+                    if entry["values"] is None:
+                        values.pop(entry["topic"], None)
+                    else:
+                        values[entry["topic"]] = entry["values"]
+        return values
+
+    async def flush(self) -> None:
+        """Write the buffered changes to the log, or compact the journal if that is due."""
+        if (
+            self._full_change or self._log_entries + len(self._buffer) > self.compact_threshold
+        ) and self._manager is not None:
+            await self.compact(self._manager.state)
+        elif self._buffer:
+            buffer = self._buffer
+            self._buffer = {}
+            lines = b"".join(
+                codec.dumps({"topic": topic, "values": values}) + b"\n" for topic, values in buffer.items()
+            )
+            async with self._lock:
+                await asyncio.to_thread(self._append, lines)
+            self._log_entries = self._log_entries + len(buffer)
+
+    async def compact(self, state: dict) -> None:
+        """Write the values of the full `state` as the new snapshot and truncate the log.
+
+        Restored values that have not yet been applied to the state are kept in the snapshot.
+        """
+        values = dict(self._manager.restored) if self._manager is not None else {}
+        values.update({topic: record.values() for topic, record in state.items()})
+        self._buffer = {}
+        self._full_change = False
+        async with self._lock:
+            await asyncio.to_thread(self._write_snapshot, codec.dumps(values))
+        self._log_entries = 0
+
+    async def start(self, manager: "StateManager") -> None:
+        """Restore the `manager`'s state from the journal and start recording its changes."""
+        self._manager = manager
+        manager.restore(self.load())
+        await manager.add_listener(self.record, resume_from=manager.sequence)
+        self._task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        """Stop recording changes and write a final snapshot."""
+        if self._task is not None:
+            async with self._lock:
+                self._task.cancel()
+            self._task = None
+        if self._manager is not None:
+            await self._manager.remove_listener(self.record)
+            await self.compact(self._manager.state)
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    async def record(self, state: dict, change: StateChange) -> None:
+        """Buffer the `change` to be written with the next flush. A change to the full state is compacted instead."""
+        if change.topics is None:
+            self._full_change = True
+            return
+        for topic in change.topics:
+            self._buffer[topic] = state[topic].values() if topic in state else None
+
+    def _append(self, lines: bytes) -> None:
+        """Append the `lines` to the log and flush it to disk. Runs in a worker thread."""
+        if self._log is None:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            self._log = open(self.log_path, "ab")
+        self._log.write(lines)
+        self._log.flush()
+
+    def _write_snapshot(self, data: bytes) -> None:
+        """Replace the snapshot with the `data` and truncate the log. Runs in a worker thread."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        with open(tmp_path, "wb") as out_f:
+            out_f.write(data)
+        os.replace(tmp_path, self.path)
+        if self._log is not None:
+            self._log.close()
+        self._log = open(self.log_path, "wb")
+
+    async def _flush_periodically(self) -> None:
+        """Flush the buffered changes every `flush_interval` seconds."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(e)
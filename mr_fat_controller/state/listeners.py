@@ -0,0 +1,241 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""State change delivery to listeners."""
+
+import asyncio
+import logging
+from collections import deque
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import dataclass, field
+from fnmatch import fnmatchcase
+from time import perf_counter
+from typing import TYPE_CHECKING, Literal
+
+from mr_fat_controller.metrics import listener_notify_seconds
+
+if TYPE_CHECKING:
+    from mr_fat_controller.state import StateManager
+    from mr_fat_controller.state.records import StateRecord
+
+logger = logging.getLogger(__name__)
+
+OverflowPolicy = Literal["drop-oldest", "snapshot"]
+
+
+@dataclass(frozen=True, slots=True)
+class StateChange:
+    """A change to the state, as delivered to a listener.
+
+    The `sequence` is the sequence number of the latest change included. If `topics` is `None`, then the change
+    is a full state snapshot, otherwise it lists the topics that have changed. For topics where only individual
+    fields of the state record have changed, `diffs` maps the topic to the changed fields and their new values.
+    Topics without an entry in `diffs` have changed as a whole.
+    """
+
+    sequence: int
+    topics: frozenset[str] | None
+    diffs: dict[str, dict] = field(default_factory=dict)
+
+    @property
+    def full(self) -> bool:
+        """Return whether this change is a full state snapshot."""
+        return self.topics is None
+
+
+Listener = Callable[[dict, StateChange], Awaitable]
+
+
+@dataclass(frozen=True, slots=True)
+class Subscription:
+    """The changes a listener is interested in.
+
+    A listener is interested in a topic if the topic's state type is in `types`, the topic matches one of the
+    glob patterns in `topics`, or the topic's `(type, model id)` is in `models`. A subscription without any of
+    these is interested in everything.
+    """
+
+    types: frozenset[str] | None = None
+    topics: tuple[str, ...] | None = None
+    models: frozenset[tuple[str, int]] | None = None
+
+    @property
+    def everything(self) -> bool:
+        """Return whether this subscription is interested in all changes."""
+        return self.types is None and self.topics is None and self.models is None
+
+    def matches(self, topic: str, record: "StateRecord | None") -> bool:
+        """Return whether the subscription is interested in changes to the `topic` holding the `record`."""
+        if self.everything:
+            return True
+        if record is not None:
+            if self.types is not None and record.type in self.types:
+                return True
+            if self.models is not None and (record.type, record.model_id) in self.models:
+                return True
+        return self.topics is not None and any(fnmatchcase(topic, pattern) for pattern in self.topics)
+
+
+def merge_diffs(current: dict | None, diff: dict | None) -> dict | None:
+    """Merge two successive field-level diffs. `None` means that the whole record has changed."""
+    if current is None or diff is None:
+        return None
+    return {**current, **diff}
+
+
+class ChangeLog:
+    """A bounded log of which topics changed at which sequence number."""
+
+    def __init__(self, max_size: int) -> None:
+        """Initialise the empty log, holding at most `max_size` entries."""
+        self._entries: deque[tuple[int, frozenset[str] | None]] = deque(maxlen=max_size)
+
+    def append(self, sequence: int, topics: frozenset[str] | None) -> None:
+        """Record that the `topics` changed at `sequence`. `None` records a full state change."""
+        self._entries.append((sequence, topics))
+
+    def since(self, sequence: int, current: int) -> set[str] | None:
+        """Return the topics changed after `sequence`.
+
+        Returns `None` if the changes cannot be reconstructed from the log, either because the log has been
+        truncated, a full state change happened in the meantime, or the `sequence` is not from this log at all.
+        """
+        if sequence == current:
+            return set()
+        if sequence > current or not self._entries or self._entries[0][0] > sequence + 1:
+            return None
+        changed = set()
+        for entry_sequence, topics in reversed(self._entries):
+            if entry_sequence <= sequence:
+                break
+            if topics is None:
+                return None
+            changed.update(topics)
+        return changed
+
+    def clear(self) -> None:
+        """Remove all entries from the log."""
+        self._entries.clear()
+
+
+class ListenerChannel:
+    """Delivers state changes to a single listener.
+
+    Each channel has its own bounded queue of changed topics and its own delivery task, so that a slow listener
+    only ever delays itself. All changes that have queued up while the listener was busy are delivered together
+    as a single `StateChange`, and a topic is only ever queued once, as the listener always receives the current
+    state at delivery time. If the queue is full, the `overflow` policy determines whether the oldest change is
+    dropped (`"drop-oldest"`) or the whole queue is collapsed into a single full state snapshot (`"snapshot"`).
+    """
+
+    def __init__(
+        self,
+        manager: "StateManager",
+        listener: Listener,
+        max_size: int,
+        overflow: OverflowPolicy,
+        subscription: Subscription | None = None,
+    ) -> None:
+        """Initialise the channel and start its delivery task."""
+        self.manager = manager
+        self.listener = listener
+        self.subscription = subscription if subscription is not None else Subscription()
+        self.max_size = max_size
+        self.overflow = overflow
+        self.delivered = 0
+        self.dropped = 0
+        self._pending: dict[str, dict | None] = {}
+        self._snapshot = False
+        self._sequence: int | None = None
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._deliver())
+
+    @property
+    def name(self) -> str:
+        """Return a human-readable name for the listener."""
+        return getattr(self.listener, "__qualname__", repr(self.listener))
+
+    @property
+    def depth(self) -> int:
+        """Return the number of changes waiting to be delivered."""
+        if self._snapshot:
+            return 1
+        return len(self._pending)
+
+    def put(self, topics: Iterable[str], sequence: int, diffs: dict[str, dict] | None = None) -> None:
+        """Queue the changed `topics` for delivery without waiting for the listener.
+
+        The `diffs` hold the changed fields for those topics where only individual fields have changed. The change
+        is queued even if there are no `topics`, so that the listener learns the current `sequence`.
+        """
+        if not self._snapshot:
+            for topic in topics:
+                diff = diffs.get(topic) if diffs is not None else None
+                if topic in self._pending:
+                    self._pending[topic] = merge_diffs(self._pending[topic], diff)
+                    continue
+                if len(self._pending) >= self.max_size:
+                    if self.overflow == "drop-oldest":
+                        del self._pending[next(iter(self._pending))]
+                        self.dropped = self.dropped + 1
+                    else:
+                        self.put_snapshot(sequence)
+                        self.dropped = self.dropped + 1
+                        return
+                    logger.warning(f"Listener {self.name} is falling behind, {self.dropped} changes dropped so far")
+                self._pending[topic] = diff
+        self._sequence = sequence
+        self._wakeup.set()
+
+    def put_snapshot(self, sequence: int) -> None:
+        """Queue a full state snapshot for delivery, replacing all queued changes."""
+        if self._pending:
+            self.dropped = self.dropped + len(self._pending)
+            logger.warning(f"Listener {self.name} is falling behind, {self.dropped} changes dropped so far")
+            self._pending.clear()
+        self._snapshot = True
+        self._sequence = sequence
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        """Return the delivery statistics for this channel."""
+        return {
+            "listener": self.name,
+            "queue_depth": self.depth,
+            "queue_size": self.max_size,
+            "overflow": self.overflow,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+    def close(self) -> None:
+        """Stop delivering changes to the listener."""
+        self._task.cancel()
+
+    async def _deliver(self) -> None:
+        """Deliver queued changes to the listener."""
+        while True:
+            if self._sequence is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if self._snapshot:
+                change = StateChange(self.manager.sequence, None)
+            else:
+                change = StateChange(
+                    self._sequence,
+                    frozenset(self._pending),
+                    {topic: diff for topic, diff in self._pending.items() if diff is not None},
+                )
+            self._pending = {}
+            self._snapshot = False
+            self._sequence = None
+            try:
+                start = perf_counter()
+                await self.listener(self.manager.state, change)
+                listener_notify_seconds.observe(perf_counter() - start, self.name)
+                self.delivered = self.delivered + 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(e)
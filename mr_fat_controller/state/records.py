@@ -0,0 +1,99 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Typed state records."""
+
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, ClassVar
+
+if TYPE_CHECKING:
+    from mr_fat_controller.state.reducers import Reducer
+
+
+@dataclass(slots=True)
+class StateRecord:
+    """Base class for the state held for a single entity.
+
+    A record is `stale` if its values were restored from the journal and have not yet been confirmed by the device.
+    """
+
+    type: ClassVar[str] = "unknown"
+
+    topic: str
+    model: dict
+    state: str = "unknown"
+    reducer: "Reducer | None" = field(default=None, repr=False, compare=False)
+    stale: bool = False
+
+    @property
+    def model_id(self) -> int:
+        """Return the id of the model this state belongs to."""
+        return self.model["id"]
+
+    @property
+    def entity_id(self) -> int | None:
+        """Return the id of the entity this state belongs to."""
+        if "entity_id" in self.model:
+            return self.model["entity_id"]
+        return self.model.get("entity")
+
+    def apply(self, fields: dict) -> dict:
+        """Apply the values in `fields` to the record and return only those that actually changed."""
+        changes = {}
+        for name, value in fields.items():
+            if getattr(self, name) != value:
+                setattr(self, name, value)
+                changes[name] = value
+        return changes
+
+    def values(self) -> dict:
+        """Return the values reported by the device."""
+        return {"state": self.state}
+
+    def to_dict(self) -> dict:
+        """Return the JSON-compatible representation of the record."""
+        return {"type": self.type, "model": self.model, "stale": self.stale, **self.values()}
+
+
+@dataclass(slots=True)
+class BlockDetectorRecord(StateRecord):
+    """The state of a block detector."""
+
+    type: ClassVar[str] = "block_detector"
+
+
+@dataclass(slots=True)
+class PointsRecord(StateRecord):
+    """The state of a set of points."""
+
+    type: ClassVar[str] = "points"
+
+
+@dataclass(slots=True)
+class PowerSwitchRecord(StateRecord):
+    """The state of a power switch."""
+
+    type: ClassVar[str] = "power_switch"
+
+
+@dataclass(slots=True)
+class SignalRecord(StateRecord):
+    """The state of a signal."""
+
+    type: ClassVar[str] = "signal"
+
+
+@dataclass(slots=True)
+class TrainRecord(StateRecord):
+    """The state of a train."""
+
+    type: ClassVar[str] = "train"
+
+    state: str = "on"
+    speed: int = 0
+    direction: str = "forward"
+    functions: dict = field(default_factory=dict)
+
+    def values(self) -> dict:
+        """Return the values reported by the device."""
+        return {"state": self.state, "speed": self.speed, "direction": self.direction, "functions": self.functions}
@@ -0,0 +1,154 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""State reducers that parse device payloads into state records."""
+
+from abc import ABC, abstractmethod
+from time import perf_counter_ns
+from typing import ClassVar
+
+from mr_fat_controller.state.records import (
+    BlockDetectorRecord,
+    PointsRecord,
+    PowerSwitchRecord,
+    SignalRecord,
+    StateRecord,
+    TrainRecord,
+)
+
+SIGNAL_COLOUR_THRESHOLD = 128
+
+
+class Reducer(ABC):
+    """Base class for all reducers.
+
+    A reducer handles all state records of one `type`. It is assigned to a record when that is added to the state
+    and from then on parses every payload received for the record's topic. Subclasses implement `reduce`, which
+    returns the fields to set on the record.
+    """
+
+    type: ClassVar[str]
+    record_type: ClassVar[type[StateRecord]]
+
+    def __init__(self) -> None:
+        """Initialise the reducer's timing counters."""
+        self.calls = 0
+        self.duration = 0
+
+    def __call__(self, record: StateRecord, data: dict) -> dict:
+        """Apply the payload `data` to the `record` and return the fields that actually changed."""
+        start = perf_counter_ns()
+        try:
+            return record.apply(self.reduce(record, data))
+        finally:
+            self.calls = self.calls + 1
+            self.duration = self.duration + perf_counter_ns() - start
+
+    @abstractmethod
+    def reduce(self, record: StateRecord, data: dict) -> dict:
+        """Return the fields of the `record` to set from the payload `data`."""
+
+    def stats(self) -> dict:
+        """Return the timing statistics for this reducer."""
+        return {
+            "type": self.type,
+            "calls": self.calls,
+            "duration_ms": self.duration / 1000000,
+            "mean_duration_us": self.duration / self.calls / 1000 if self.calls > 0 else 0,
+        }
+
+
+class BlockDetectorReducer(Reducer):
+    """Reducer for block detector states."""
+
+    type = "block_detector"
+    record_type = BlockDetectorRecord
+    states: ClassVar[dict[str, str]] = {"ON": "on", "OFF": "off"}
+
+    def reduce(self, record: StateRecord, data: dict) -> dict:  # noqa: ARG002
+        """Return the block detector state from `data`."""
+        if data["state"] in self.states:
+            return {"state": self.states[data["state"]]}
+        return {}
+
+
+class PointsReducer(Reducer):
+    """Reducer for points states."""
+
+    type = "points"
+    record_type = PointsRecord
+
+    def reduce(self, record: StateRecord, data: dict) -> dict:
+        """Return the points state from `data`, based on the points' configured through and diverge states."""
+        if data["state"] == record.model["through_state"]:
+            return {"state": "through"}
+        elif data["state"] == record.model["diverge_state"]:
+            return {"state": "diverge"}
+        return {"state": "unknown"}
+
+
+class PowerSwitchReducer(Reducer):
+    """Reducer for power switch states."""
+
+    type = "power_switch"
+    record_type = PowerSwitchRecord
+    states: ClassVar[dict[str, str]] = {"ON": "on", "OFF": "off", "UNKNOWN": "unknown"}
+
+    def reduce(self, record: StateRecord, data: dict) -> dict:  # noqa: ARG002
+        """Return the power switch state from `data`."""
+        if data["state"] in self.states:
+            return {"state": self.states[data["state"]]}
+        return {}
+
+
+class SignalReducer(Reducer):
+    """Reducer for signal states, which are reported as lights with a colour."""
+
+    type = "signal"
+    record_type = SignalRecord
+
+    def reduce(self, record: StateRecord, data: dict) -> dict:  # noqa: ARG002
+        """Return the signal aspect from `data`."""
+        if data["state"] == "OFF":
+            return {"state": "off"}
+        elif data["state"] == "ON" and "color" in data:
+            if data["color"].get("r", 0) > SIGNAL_COLOUR_THRESHOLD:
+                return {"state": "danger"}
+            elif data["color"].get("g", 0) > SIGNAL_COLOUR_THRESHOLD:
+                return {"state": "clear"}
+        return {}
+
+
+class TrainReducer(Reducer):
+    """Reducer for train states."""
+
+    type = "train"
+    record_type = TrainRecord
+
+    def reduce(self, record: StateRecord, data: dict) -> dict:  # noqa: ARG002
+        """Return the train state, functions, speed, and direction from `data`."""
+        fields = {}
+        if "state" in data:
+            fields["state"] = "on" if data["state"] == "ON" else "off"
+        if "functions" in data:
+            fields["functions"] = data["functions"]
+        if "speed" in data:
+            fields["speed"] = data["speed"]
+        if "direction" in data:
+            fields["direction"] = data["direction"]
+        return fields
+
+
+reducers: dict[str, Reducer] = {}
+
+
+def register_reducer(reducer: Reducer) -> None:
+    """Register the `reducer` for its state type, replacing any reducer already registered for that type.
+
+    This is the extension point for supporting additional types of devices.
+    """
+    reducers[reducer.type] = reducer
+
+
+for default_reducer in (BlockDetectorReducer, PointsReducer, PowerSwitchReducer, SignalReducer, TrainReducer):
+    register_reducer(default_reducer())
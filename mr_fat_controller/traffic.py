@@ -0,0 +1,164 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Recording and replaying of MQTT traffic.
+
+Recordings are gzip-compressed files, starting with a fixed header, followed by one frame per message. Each frame
+holds the time since the start of the recording in seconds, the lengths of the topic and the payload, and then
+the topic and payload bytes.
+"""
+
+import asyncio
+import gzip
+import logging
+import struct
+from collections.abc import Awaitable, Callable, Iterable, Iterator
+from pathlib import Path
+from time import monotonic, perf_counter
+from typing import BinaryIO, cast
+
+from mr_fat_controller.mqtt import discovery_batcher, mqtt_client, mqtt_ingestion, recalculate_state
+
+logger = logging.getLogger(__name__)
+
+HEADER = b"MFCTRAFFIC1\n"
+FRAME = struct.Struct("<dHI")
+
+
+class TrafficWriter:
+    """Writes MQTT messages to a recording file."""
+
+    def __init__(self, path: str | Path) -> None:
+        """Open the recording file at `path`, replacing any existing file."""
+        self._file = cast(BinaryIO, gzip.open(path, "wb"))
+        self._file.write(HEADER)
+        self.count = 0
+
+    def write(self, offset: float, topic: str, payload: bytes) -> None:
+        """Write the `payload` received for the `topic` at `offset` seconds after the start of the recording."""
+        encoded_topic = topic.encode()
+        self._file.write(FRAME.pack(offset, len(encoded_topic), len(payload)))
+        self._file.write(encoded_topic)
+        self._file.write(payload)
+        self.count = self.count + 1
+
+    def close(self) -> None:
+        """Close the recording file."""
+        self._file.close()
+
+    def __enter__(self) -> "TrafficWriter":
+        """Return the writer."""
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        """Close the recording file."""
+        self.close()
+
+
+def read_traffic(path: str | Path) -> Iterator[tuple[float, str, bytes]]:
+    """Return the offset, topic, and payload of each message in the recording file at `path`."""
+    with gzip.open(path, "rb") as in_f:
+        if in_f.read(len(HEADER)) != HEADER:
+            msg = f"{path} is not an MQTT traffic recording"
+            raise ValueError(msg)
+        while True:
+            frame = in_f.read(FRAME.size)
+            if len(frame) < FRAME.size:
+                break
+            offset, topic_length, payload_length = FRAME.unpack(frame)
+            topic = in_f.read(topic_length).decode()
+            yield offset, topic, in_f.read(payload_length)
+
+
+async def replay(
+    messages: Iterable[tuple[float, str, bytes]], submit: Callable[[str, bytes], Awaitable], speed: float = 1
+) -> int:
+    """Pass the recorded `messages` to `submit` and return the number of messages replayed.
+
+    With a `speed` of 1 the messages are replayed with their original timing and with a `speed` of N they are
+    replayed N times as fast. A `speed` of 0 replays them as fast as possible.
+    """
+    start = monotonic()
+    count = 0
+    for offset, topic, payload in messages:
+        if speed > 0:
+            delay = start + offset / speed - monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await submit(topic, payload)
+        count = count + 1
+    return count
+
+
+async def record_traffic(path: str | Path, duration: float | None = None, stop: asyncio.Event | None = None) -> int:
+    """Record all `mrfatcontroller/#` messages to the file at `path` and return the number recorded.
+
+    Recording stops after `duration` seconds or, if that is `None`, once the `stop` event is set.
+    """
+    with TrafficWriter(path) as writer:
+
+        async def run() -> None:
+            async with mqtt_client() as client:
+                await client.subscribe("mrfatcontroller/#")
+                start = monotonic()
+                async for message in client.messages:
+                    payload = message.payload
+                    writer.write(
+                        monotonic() - start,
+                        message.topic.value,
+                        payload.encode() if isinstance(payload, str) else cast(bytes, payload),
+                    )
+
+        receiver = asyncio.create_task(run())
+        stopper = asyncio.create_task(stop.wait() if stop is not None else asyncio.Event().wait())
+        try:
+            done, _ = await asyncio.wait([receiver, stopper], timeout=duration, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            receiver.cancel()
+            stopper.cancel()
+        if receiver in done:
+            receiver.result()
+        logger.info(f"Recorded {writer.count} messages to {path}")
+        return writer.count
+
+
+async def replay_traffic(
+    path: str | Path,
+    speed: float = 1,
+    direct: bool = False,  # noqa: FBT001, FBT002
+    discovery: bool = True,  # noqa: FBT001, FBT002
+) -> dict:
+    """Replay the recording file at `path` and return the replay statistics.
+
+    The messages are published to the broker, in which case only the publish rate is measured, as the messages are
+    processed by the server. If `direct` is set, they are instead passed straight into the `mqtt_ingestion` pipeline
+    of this process, after loading the state from the database, and the processing rate is measured once all
+    messages have been processed. As discovery messages are written to the database, they can be skipped by setting
+    `discovery` to `False`, which only replays the state messages against the entities already in the database.
+    """
+    messages = read_traffic(path)
+    if not discovery:
+        messages = (message for message in messages if not message[1].endswith("/config"))
+    if direct:
+        await recalculate_state()
+        mqtt_ingestion.start()
+        try:
+            start = perf_counter()
+            count = await replay(messages, mqtt_ingestion.submit, speed)
+            await mqtt_ingestion.join()
+            elapsed = perf_counter() - start
+        finally:
+            await mqtt_ingestion.stop()
+            await discovery_batcher.stop()
+        return {
+            "messages": count,
+            "seconds": elapsed,
+            "processed_per_second": count / elapsed if elapsed else 0,
+            "ingestion": mqtt_ingestion.stats(),
+            "discovery": discovery_batcher.stats(),
+        }
+    async with mqtt_client() as client:
+        start = perf_counter()
+        count = await replay(messages, client.publish, speed)
+        elapsed = perf_counter() - start
+    return {"messages": count, "seconds": elapsed, "published_per_second": count / elapsed if elapsed else 0}
@@ -1,9 +1,9 @@
 """Async MQTT client for the WiThrottle bridge."""
 
 import asyncio
-import json
 import logging
 
+from mr_fat_controller import codec
 from mr_fat_controller.__about__ import __version__
 from mr_fat_controller.mqtt import mqtt_client as mqtt_client_connection
 from mr_fat_controller.settings import settings
@@ -30,12 +30,12 @@ async def publish_full_state(client, only_publish: str | None = None) -> None:
             if state["power"]["state"] == "on":
                 await client.publish(
                     f"mrfatcontroller/switch/{slugify(settings.withrottle.name)}-withrottle-power/state",
-                    json.dumps({"state": "ON"}),
+                    codec.dumps({"state": "ON"}),
                 )
             else:
                 await client.publish(
                     f"mrfatcontroller/switch/{slugify(settings.withrottle.name)}-withrottle-power/state",
-                    json.dumps({"state": "OFF"}),
+                    codec.dumps({"state": "OFF"}),
                 )
         elif value["type"] == "train":
             msg = {"state": value["state"].upper()}
@@ -45,7 +45,7 @@ async def publish_full_state(client, only_publish: str | None = None) -> None:
                 msg["direction"] = value["direction"]
             if "functions" in value:
                 msg["functions"] = value["functions"]
-            await client.publish(f"mrfatcontroller/train/{key}/state", json.dumps(msg))
+            await client.publish(f"mrfatcontroller/train/{key}/state", codec.dumps(msg))
 
 
 async def publish_entities(client) -> None:
@@ -54,7 +54,7 @@ async def publish_entities(client) -> None:
         if key == "power":
             await client.publish(
                 f"mrfatcontroller/switch/{slugify(settings.withrottle.name)}-withrottle-power/config",
-                json.dumps(
+                codec.dumps(
                     {
                         "unique_id": f"{slugify(settings.withrottle.name)}-withrottle-power",
                         "name": f"{settings.withrottle.name} WiThrottle Power",
@@ -68,7 +68,7 @@ async def publish_entities(client) -> None:
         elif value["type"] == "train":
             await client.publish(
                 f"mrfatcontroller/train/{key}/config",
-                json.dumps(
+                codec.dumps(
                     {
                         "unique_id": f"mrfatcontroller/train/{key}",
                         "name": value["name"],
@@ -101,12 +101,12 @@ async def mqtt_client(wt_to_mqtt: asyncio.Queue, mqtt_to_wt: asyncio.Queue) -> N
                             if state["power"]["state"] == "on":
                                 await client.publish(
                                     f"mrfatcontroller/switch/{slugify(settings.withrottle.name)}-withrottle-power/state",
-                                    json.dumps({"state": "ON"}),
+                                    codec.dumps({"state": "ON"}),
                                 )
                             else:
                                 await client.publish(
                                     f"mrfatcontroller/switch/{slugify(settings.withrottle.name)}-withrottle-power/state",
-                                    json.dumps({"state": "OFF"}),
+                                    codec.dumps({"state": "OFF"}),
                                 )
                         elif msg["type"] == "train":
                             if msg["address"] not in state:
@@ -144,7 +144,7 @@ async def mqtt_client(wt_to_mqtt: asyncio.Queue, mqtt_to_wt: asyncio.Queue) -> N
                         message.topic.value
                         == f"mrfatcontroller/switch/{slugify(settings.withrottle.name)}-withrottle-power/set"
                     ):
-                        data = json.loads(message.payload)  # type: ignore
+                        data = codec.loads(message.payload)  # type: ignore
                         if data["state"] == "ON":
                             await mqtt_to_wt.put({"type": "power", "state": "on"})
                         else:
@@ -152,7 +152,7 @@ async def mqtt_client(wt_to_mqtt: asyncio.Queue, mqtt_to_wt: asyncio.Queue) -> N
                     elif message.topic.value.startswith("mrfatcontroller/train/"):
                         _, _, address, _ = message.topic.value.split("/")
                         if address in state:
-                            data = json.loads(message.payload)  # type:ignore
+                            data = codec.loads(message.payload)  # type:ignore
                             if "speed" in data:
                                 await mqtt_to_wt.put({"type": "train", "address": address, "speed": data["speed"]})
                             if "direction" in data:
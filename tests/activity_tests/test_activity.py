@@ -0,0 +1,54 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Device activity tests."""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from mr_fat_controller.activity import DeviceActivity
+from mr_fat_controller.registry import RegistryEntry, entity_registry
+
+
+def test_activity_is_tracked_by_state_topic() -> None:
+    """Test that activity is recorded for the device registered for a state topic and ignored otherwise."""
+    entity_registry.add(RegistryEntry(101, "bd-101", 11, "mrfatcontroller/bd-101/state", None))
+    entity_registry.add(RegistryEntry(102, "bd-102", None, "mrfatcontroller/bd-102/state", None))
+    try:
+        assert entity_registry.find_by_state_topic("mrfatcontroller/bd-101/state").device_id == 11
+        activity = DeviceActivity()
+        activity.seen("mrfatcontroller/bd-101/state")
+        activity.seen("mrfatcontroller/bd-102/state")
+        activity.seen("mrfatcontroller/unknown/state")
+        assert list(activity.last_seen) == [11]
+        first = activity.last_seen[11]
+        activity.seen("mrfatcontroller/bd-101/state")
+        assert activity.last_seen[11] >= first
+    finally:
+        entity_registry.remove(101)
+        entity_registry.remove(102)
+
+
+def test_activity_is_kept_if_the_flush_fails(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that activity that could not be written is kept, without replacing newer activity."""
+
+    @asynccontextmanager
+    async def failing_session():
+        await asyncio.sleep(0)
+        msg = "Database unavailable"
+        raise ConnectionError(msg)
+        yield
+
+    async def run() -> None:
+        monkeypatch.setattr("mr_fat_controller.activity.db_session", failing_session)
+        activity = DeviceActivity()
+        activity.last_seen = {1: "old-1", 2: "old-2"}
+        flush = asyncio.create_task(activity.flush())
+        await asyncio.sleep(0)
+        activity.last_seen[2] = "new-2"
+        await flush
+        assert activity.last_seen == {1: "old-1", 2: "new-2"}
+
+    asyncio.run(run())
@@ -0,0 +1,58 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Route API tests."""
+
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from mr_fat_controller.models import BlockDetector, Points, Signal, db_session
+from mr_fat_controller.server import app
+
+
+def add_models() -> None:
+    """Add one set of points, one signal, and one block detector with id 1 to the database."""
+
+    async def run() -> None:
+        async with db_session() as dbsession:
+            dbsession.add_all(
+                [Points(id=1, through_state="OFF", diverge_state="ON"), Signal(id=1), BlockDetector(id=1)]
+            )
+            await dbsession.commit()
+
+    asyncio.run(run())
+
+
+def test_create_route_merges_duplicate_points(empty_database: None) -> None:  # noqa: ARG001
+    """Test that points listed twice with the same state are only stored once."""
+    add_models()
+    client = TestClient(app)
+    response = client.post(
+        "/api/routes",
+        json={
+            "name": "Main",
+            "points": [{"points": 1, "state": "through"}, {"points": 1, "state": "through"}],
+            "signals": [1, 1],
+            "block_detectors": [1],
+        },
+    )
+    assert response.status_code == 200
+    assert response.json()["points"] == [{"points": 1, "state": "through"}]
+    assert response.json()["signals"] == [1]
+
+
+def test_create_route_rejects_invalid_references(empty_database: None) -> None:  # noqa: ARG001
+    """Test that conflicting points states and missing points, signals, or block detectors are rejected."""
+    add_models()
+    client = TestClient(app)
+    base = {"name": "Main", "points": [{"points": 1, "state": "through"}], "signals": [1], "block_detectors": [1]}
+    for override in (
+        {"points": [{"points": 1, "state": "through"}, {"points": 1, "state": "diverge"}]},
+        {"points": [{"points": 2, "state": "through"}]},
+        {"signals": [1, 2]},
+        {"block_detectors": [3]},
+    ):
+        response = client.post("/api/routes", json={**base, **override})
+        assert response.status_code == 422
+    assert client.get("/api/routes").json() == []
@@ -0,0 +1,31 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""State API tests."""
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from mr_fat_controller.api.state import parse_subscription
+from mr_fat_controller.server import app
+
+
+def test_parse_subscription() -> None:
+    """Test parsing valid and invalid subscriptions."""
+    subscription = parse_subscription("points,signal", "points:1,signal:2")
+    assert subscription.types == frozenset(["points", "signal"])
+    assert subscription.models == frozenset([("points", 1), ("signal", 2)])
+    assert parse_subscription(None, None).everything
+    for models in ("abc", "x:y", "points:"):
+        with pytest.raises(ValueError):
+            parse_subscription(None, models)
+
+
+def test_invalid_subscription_closes_socket() -> None:
+    """Test that a websocket with an invalid subscription is closed with a policy violation."""
+    client = TestClient(app)
+    with client.websocket_connect("/api/state?models=x:y") as websocket:
+        with pytest.raises(WebSocketDisconnect) as excinfo:
+            websocket.receive_bytes()
+        assert excinfo.value.code == 1008
@@ -0,0 +1,102 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Signal controller tests."""
+
+import asyncio
+import json
+
+from mr_fat_controller.automation.controller import SignalController
+from mr_fat_controller.automation.graph import AutomationGraph, SignalRule
+from mr_fat_controller.automation.routes import RouteDefinition, RouteEngine
+from mr_fat_controller.state import BlockDetectorRecord, SignalRecord, StateManager
+
+
+def test_controller_only_publishes_differences() -> None:
+    """Test that only signals not showing their desired aspect are sent a command, danger before clear."""
+
+    async def run() -> None:
+        manager = StateManager()
+        await manager.add_state(SignalRecord(topic="signal/1", model={"id": 1}, state="clear"))
+        await manager.add_state(SignalRecord(topic="signal/2", model={"id": 2}, state="clear"))
+        await manager.add_state(SignalRecord(topic="signal/3", model={"id": 3}, state="danger"))
+        published = []
+        controller = SignalController(manager, lambda topic, payload: published.append((topic, payload)), 0.01)
+        controller.set_desired(3, "clear")
+        controller.set_desired(1, "clear")
+        controller.set_desired(2, "danger")
+        assert published == []
+        await asyncio.sleep(0.02)
+        assert [(topic, json.loads(payload)["color"]["r"]) for topic, payload in published] == [
+            ("signal/2", 255),
+            ("signal/3", 0),
+        ]
+        published.clear()
+        controller.check(1)
+        controller.check(4)
+        await asyncio.sleep(0.02)
+        assert published == []
+        manager.find("signal", 1).state = "off"
+        controller.check(1)
+        await asyncio.sleep(0.02)
+        assert [topic for topic, _ in published] == ["signal/1"]
+
+    asyncio.run(run())
+
+
+def test_replacing_desired_aspects_drops_old_owners() -> None:
+    """Test that a signal whose automation is removed or taken over by an unset route is never cleared again."""
+
+    async def run() -> None:
+        manager = StateManager()
+        await manager.add_state(SignalRecord(topic="signal/1", model={"id": 1}, state="danger"))
+        await manager.add_state(SignalRecord(topic="signal/2", model={"id": 2}, state="danger"))
+        await manager.add_state(BlockDetectorRecord(topic="bd/1", model={"id": 1}, state="off"))
+        published = []
+        controller = SignalController(manager, lambda topic, payload: published.append((topic, payload)), 0.01)
+        graph = AutomationGraph()
+        graph.compile([SignalRule(1, 1, None, "through"), SignalRule(2, 1, None, "through")])
+        engine = RouteEngine(manager, controller, lambda points_id, state: None)  # noqa: ARG005
+        controller.replace({**graph.aspects(manager), **engine.aspects()})
+        await asyncio.sleep(0.02)
+        assert [(topic, json.loads(payload)["color"]["g"]) for topic, payload in published] == [
+            ("signal/1", 255),
+            ("signal/2", 255),
+        ]
+        manager.find("signal", 1).state = "clear"
+        manager.find("signal", 2).state = "clear"
+        published.clear()
+        engine.compile([RouteDefinition(10, "Main", (), (1,), (1,))])
+        graph.compile([], excluded=engine.signals())
+        controller.replace({**graph.aspects(manager), **engine.aspects()})
+        await asyncio.sleep(0.02)
+        assert controller.desired == {1: "danger"}
+        assert sorted((topic, json.loads(payload)["color"]["r"]) for topic, payload in published) == [
+            ("signal/1", 255),
+            ("signal/2", 255),
+        ]
+        manager.find("signal", 1).state = "clear"
+        manager.find("signal", 2).state = "clear"
+        published.clear()
+        controller.check(1)
+        controller.check(2)
+        await asyncio.sleep(0.02)
+        assert [(topic, json.loads(payload)["color"]["r"]) for topic, payload in published] == [("signal/1", 255)]
+
+    asyncio.run(run())
+
+
+def test_inactive_controller_sends_nothing() -> None:
+    """Test that no commands are sent while the controller is not active."""
+
+    async def run() -> None:
+        manager = StateManager()
+        await manager.add_state(SignalRecord(topic="signal/1", model={"id": 1}, state="danger"))
+        published = []
+        controller = SignalController(manager, lambda *message: published.append(message), 0.01, lambda: False)
+        controller.set_desired(1, "clear")
+        await asyncio.sleep(0.02)
+        assert published == []
+        assert controller.desired == {1: "clear"}
+
+    asyncio.run(run())
@@ -0,0 +1,58 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Automation executor tests."""
+
+import asyncio
+
+from mr_fat_controller.automation.executor import AutomationExecutor
+from mr_fat_controller.state import BlockDetectorRecord, SignalRecord, StateChange, StateManager, Subscription
+
+
+def test_executor_coalesces_and_routes_changes() -> None:
+    """Test that queued changes are coalesced and each automation only sees the topics it is interested in."""
+
+    async def run() -> None:
+        manager = StateManager()
+        await manager.add_state(BlockDetectorRecord(topic="bd/1", model={"id": 1}))
+        await manager.add_state(SignalRecord(topic="signal/1", model={"id": 1}))
+        release = asyncio.Event()
+        release.set()
+        blocks = []
+        signals = []
+
+        async def block_automation(state: dict, change: StateChange) -> None:  # noqa: ARG001
+            blocks.append(change.topics)
+            await release.wait()
+
+        async def signal_automation(state: dict, change: StateChange) -> None:  # noqa: ARG001
+            signals.append(change.topics)
+
+        executor = AutomationExecutor(queue_size=10)
+        executor.register("blocks", block_automation, Subscription(types=frozenset(["block_detector"])))
+        executor.register("signals", signal_automation, Subscription(types=frozenset(["signal"])))
+        assert executor.subscription.types == {"block_detector", "signal"}
+        await executor.start(manager)
+        await asyncio.sleep(0.01)
+        assert blocks == [None]
+        assert signals == [None]
+        release.clear()
+        await manager.update_state("bd/1", {"state": "OFF"})
+        await asyncio.sleep(0.01)
+        for state in ["ON", "OFF", "ON"]:
+            await manager.update_state("bd/1", {"state": state})
+            await asyncio.sleep(0)
+        await manager.update_state("signal/1", {"state": "ON", "color": {"r": 255}})
+        await asyncio.sleep(0.01)
+        assert executor.stats()["backlog"] == 2
+        release.set()
+        await asyncio.sleep(0.01)
+        assert blocks == [None, frozenset(["bd/1"]), frozenset(["bd/1"])]
+        assert signals == [None, frozenset(["signal/1"])]
+        stats = executor.stats()
+        assert stats["coalesced"] == 2
+        assert stats["backlog"] == 0
+        assert stats["automations"]["blocks"]["count"] == 3
+        await executor.stop(manager)
+
+    asyncio.run(run())
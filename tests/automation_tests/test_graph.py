@@ -0,0 +1,75 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Signal automation graph tests."""
+
+import asyncio
+
+from mr_fat_controller.automation.graph import AutomationGraph, SignalRule
+from mr_fat_controller.state import BlockDetectorRecord, PointsRecord, SignalRecord, StateManager
+
+
+def test_graph_evaluates_affected_signals() -> None:
+    """Test that changes map to the affected signals and that any clearing rule clears the signal."""
+
+    async def run() -> None:
+        manager = StateManager()
+        await manager.add_state(SignalRecord(topic="signal/1", model={"id": 1}))
+        await manager.add_state(SignalRecord(topic="signal/2", model={"id": 2}))
+        await manager.add_state(BlockDetectorRecord(topic="bd/1", model={"id": 1}, state="off"))
+        await manager.add_state(BlockDetectorRecord(topic="bd/2", model={"id": 2}, state="on"))
+        await manager.add_state(PointsRecord(topic="points/1", model={"id": 1}, state="through"))
+        graph = AutomationGraph()
+        graph.compile(
+            [
+                SignalRule(1, 1, 1, "diverge"),
+                SignalRule(1, 2, None, "through"),
+                SignalRule(2, 1, 1, "through"),
+                SignalRule(3, 1, None, "through"),
+            ]
+        )
+        assert graph.signals() == {1, 2, 3}
+        assert graph.affected_signals([2], []) == {1}
+        assert graph.affected_signals([], [1]) == {1, 2}
+        assert graph.evaluate(1, manager) == "danger"
+        assert graph.evaluate(2, manager) == "clear"
+        assert graph.evaluate(3, manager) is None
+        manager.find("points", 1).state = "diverge"
+        assert graph.evaluate(1, manager) == "clear"
+        assert graph.evaluate(2, manager) == "danger"
+
+    asyncio.run(run())
+
+
+def test_graph_excludes_route_signals() -> None:
+    """Test that the rules of signals owned by the routes are ignored."""
+    graph = AutomationGraph()
+    graph.compile([SignalRule(1, 1, None, "through"), SignalRule(2, 1, 1, "through")], excluded=frozenset([2]))
+    assert graph.signals() == {1}
+    assert graph.affected_signals([1], [1]) == {1}
+
+
+def test_stale_states_never_clear() -> None:
+    """Test that stale block detector and points states are treated as unknown until the device confirms them."""
+
+    async def run() -> None:
+        manager = StateManager()
+        await manager.add_state(SignalRecord(topic="signal/1", model={"id": 1}))
+        await manager.add_state(BlockDetectorRecord(topic="bd/1", model={"id": 1}, state="off", stale=True))
+        await manager.add_state(
+            PointsRecord(
+                topic="points/1",
+                model={"id": 1, "through_state": "OFF", "diverge_state": "ON"},
+                state="through",
+                stale=True,
+            )
+        )
+        graph = AutomationGraph()
+        graph.compile([SignalRule(1, 1, 1, "through")])
+        assert graph.evaluate(1, manager) == "danger"
+        await manager.update_state("bd/1", {"state": "OFF"})
+        assert graph.evaluate(1, manager) == "danger"
+        await manager.update_state("points/1", {"state": "OFF"})
+        assert graph.evaluate(1, manager) == "clear"
+
+    asyncio.run(run())
@@ -0,0 +1,109 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Route engine tests."""
+
+import asyncio
+
+from mr_fat_controller.automation.controller import SignalController
+from mr_fat_controller.automation.routes import RouteDefinition, RouteEngine
+from mr_fat_controller.state import BlockDetectorRecord, PointsRecord, SignalRecord, StateChange, StateManager
+
+
+def test_routes_lock_out_conflicts_and_clear_signals() -> None:
+    """Test that conflicting routes cannot be set and that signals clear once the points are in position."""
+
+    async def run() -> None:
+        manager = StateManager()
+        await manager.add_state(SignalRecord(topic="signal/1", model={"id": 1}))
+        await manager.add_state(SignalRecord(topic="signal/2", model={"id": 2}))
+        await manager.add_state(PointsRecord(topic="points/1", model={"id": 1}, state="diverge"))
+        await manager.add_state(BlockDetectorRecord(topic="bd/1", model={"id": 1}, state="off"))
+        await manager.add_state(BlockDetectorRecord(topic="bd/2", model={"id": 2}, state="off"))
+        published = []
+        controller = SignalController(manager, lambda topic, payload: published.append((topic, payload)))
+        commanded = []
+        engine = RouteEngine(manager, controller, lambda points_id, state: commanded.append((points_id, state)))
+        engine.compile(
+            [
+                RouteDefinition(10, "Main", ((1, "through"),), (1,), (1,)),
+                RouteDefinition(20, "Branch", ((1, "diverge"),), (2,), (2,)),
+                RouteDefinition(30, "Yard", (), (), (2,)),
+            ]
+        )
+        assert engine.conflicts == [0b010, 0b101, 0b010]
+        assert engine.set_route(10)
+        assert commanded == [(1, "through")]
+        assert controller.desired == {1: "danger", 2: "danger"}
+        assert not engine.can_set(20)
+        assert not engine.set_route(20)
+        assert engine.can_set(30)
+        manager.find("points", 1).state = "through"
+        engine.handle(manager.state, StateChange(1, frozenset(["points/1"])))
+        assert controller.desired == {1: "clear", 2: "danger"}
+        manager.find("block_detector", 1).state = "on"
+        engine.handle(manager.state, StateChange(2, frozenset(["bd/1"])))
+        assert controller.desired == {1: "danger", 2: "danger"}
+        engine.release_route(10)
+        assert engine.can_set(20)
+        assert not engine.can_set(10)
+        engine.compile(engine.routes)
+        assert engine.active == 0
+        assert [route["occupied"] for route in engine.status()] == [True, False, False]
+
+    asyncio.run(run())
+
+
+def test_compile_sets_signals_of_unset_routes_to_danger() -> None:
+    """Test that compiling the routes sets all their signals to danger, unless their route is set and ready."""
+
+    async def run() -> None:
+        manager = StateManager()
+        await manager.add_state(SignalRecord(topic="signal/1", model={"id": 1}, state="clear"))
+        await manager.add_state(SignalRecord(topic="signal/2", model={"id": 2}, state="clear"))
+        await manager.add_state(BlockDetectorRecord(topic="bd/1", model={"id": 1}, state="off"))
+        await manager.add_state(BlockDetectorRecord(topic="bd/2", model={"id": 2}, state="off"))
+        published = []
+        controller = SignalController(manager, lambda topic, payload: published.append((topic, payload)), 0.01)
+        engine = RouteEngine(manager, controller, lambda points_id, state: None)  # noqa: ARG005
+        routes = [RouteDefinition(10, "Main", (), (1, 2), (1,)), RouteDefinition(20, "Branch", (), (2,), (2,))]
+        engine.compile(routes)
+        assert controller.desired == {1: "danger", 2: "danger"}
+        await asyncio.sleep(0.02)
+        assert sorted(topic for topic, _ in published) == ["signal/1", "signal/2"]
+        assert engine.set_route(10)
+        assert controller.desired == {1: "clear", 2: "clear"}
+        engine.compile(routes)
+        assert controller.desired == {1: "clear", 2: "clear"}
+
+    asyncio.run(run())
+
+
+def test_stale_states_keep_route_signals_at_danger() -> None:
+    """Test that a set route only clears its signals once its points and block detectors confirm their state."""
+
+    async def run() -> None:
+        manager = StateManager()
+        await manager.add_state(SignalRecord(topic="signal/1", model={"id": 1}))
+        await manager.add_state(
+            PointsRecord(
+                topic="points/1",
+                model={"id": 1, "through_state": "OFF", "diverge_state": "ON"},
+                state="through",
+                stale=True,
+            )
+        )
+        await manager.add_state(BlockDetectorRecord(topic="bd/1", model={"id": 1}, state="off", stale=True))
+        controller = SignalController(manager, lambda topic, payload: None, 0.01)  # noqa: ARG005
+        engine = RouteEngine(manager, controller, lambda points_id, state: None)  # noqa: ARG005
+        engine.compile([RouteDefinition(10, "Main", ((1, "through"),), (1,), (1,))])
+        assert engine.set_route(10) is False
+        await manager.update_state("bd/1", {"state": "OFF"})
+        engine.handle(manager.state, StateChange(1, frozenset(["bd/1"])))
+        assert engine.set_route(10)
+        assert controller.desired == {1: "danger"}
+        await manager.update_state("points/1", {"state": "OFF"})
+        engine.handle(manager.state, StateChange(2, frozenset(["points/1"])))
+        assert controller.desired == {1: "clear"}
+
+    asyncio.run(run())
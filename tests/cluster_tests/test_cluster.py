@@ -0,0 +1,146 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Cluster tests."""
+
+import asyncio
+import json
+
+from mr_fat_controller.cluster import ClusterNode, InMemoryBroker, topic_matches
+from mr_fat_controller.state import BlockDetectorRecord, StateManager
+
+
+def test_topic_matches() -> None:
+    """Test matching topics against filters with wildcards."""
+    assert topic_matches("mrfatcontroller/+/+/state", "mrfatcontroller/binary_sensor/bd1/state")
+    assert not topic_matches("mrfatcontroller/+/+/state", "mrfatcontroller/binary_sensor/bd1/config")
+    assert topic_matches("mrfatcontroller-cluster/group/#", "mrfatcontroller-cluster/group/state")
+    assert not topic_matches("mrfatcontroller/+/state", "mrfatcontroller/binary_sensor/bd1/state")
+
+
+def test_state_is_replicated_between_nodes() -> None:
+    """Test that shared ingestion delivers each message to one node and its changes reach all nodes."""
+
+    async def run() -> None:
+        broker = InMemoryBroker()
+        managers = [StateManager(), StateManager()]
+        nodes = [
+            ClusterNode(managers[0], broker.publish, node_id="a", heartbeat_interval=60),
+            ClusterNode(managers[1], broker.publish, node_id="b", heartbeat_interval=60),
+        ]
+        for manager in managers:
+            await manager.add_state(BlockDetectorRecord(topic="mrfatcontroller/bd/1/state", model={"id": 1}))
+        ingested = []
+        for node, manager in zip(nodes, managers, strict=True):
+            node.start()
+
+            async def ingest(topic: str, payload: bytes, node: ClusterNode = node, manager: StateManager = manager):
+                ingested.append(node.node_id)
+                await manager.update_state(topic, json.loads(payload))
+
+            broker.subscribe("$share/mrfatcontroller/mrfatcontroller/+/+/state", ingest)
+            broker.subscribe(node.topic_filter, node.receive)
+        broker.publish("mrfatcontroller/bd/1/state", '{"state": "ON"}')
+        await broker.drain()
+        broker.publish("mrfatcontroller/bd/1/state", '{"state": "OFF"}')
+        await broker.drain()
+        assert ingested == ["a", "b"]
+        for manager in managers:
+            assert manager.get("mrfatcontroller/bd/1/state").state == "off"
+        await managers[0].remove_state("mrfatcontroller/bd/1/state")
+        await managers[0].add_state(BlockDetectorRecord(topic="mrfatcontroller/bd/2/state", model={"id": 2}))
+        await broker.drain()
+        assert "mrfatcontroller/bd/1/state" not in managers[1]
+        assert managers[1].get("mrfatcontroller/bd/2/state").model == {"id": 2}
+        assert nodes[0].replicated == 3
+        assert nodes[1].replicated == 1
+        for node in nodes:
+            await node.stop()
+
+    asyncio.run(run())
+
+
+def test_leader_election() -> None:
+    """Test that the live node with the lowest id leads and that a silent leader is replaced."""
+
+    async def run() -> None:
+        broker = InMemoryBroker()
+        nodes = [
+            ClusterNode(StateManager(), broker.publish, node_id=node_id, heartbeat_interval=0.01, leader_timeout=0.1)
+            for node_id in ["b", "a"]
+        ]
+        assert nodes[0].is_leader
+        for node in nodes:
+            broker.subscribe(node.topic_filter, node.receive)
+            node.start()
+        await asyncio.sleep(0.05)
+        await broker.drain()
+        assert not nodes[0].is_leader
+        assert nodes[1].is_leader
+        await nodes[1].stop()
+        await asyncio.sleep(0.2)
+        assert nodes[0].is_leader
+        await nodes[0].stop()
+
+    asyncio.run(run())
+
+
+def test_requests_are_handled_by_the_leader() -> None:
+    """Test that requests are forwarded to the leader and that its announcements reach the other nodes."""
+
+    async def run() -> None:
+        broker = InMemoryBroker()
+        nodes = [ClusterNode(StateManager(), broker.publish, node_id=node, heartbeat_interval=60) for node in "ab"]
+        handled = []
+        announced = []
+
+        async def handler(data: dict) -> dict:
+            handled.append(data["route"])
+            nodes[0].announce("routes", [data["route"]])
+            return {"result": "ok"}
+
+        nodes[0].request_handlers["routes"] = handler
+        nodes[1].announcement_handlers["routes"] = announced.append
+        for cluster_node in nodes:
+            broker.subscribe(cluster_node.topic_filter, cluster_node.receive)
+            cluster_node.start()
+        await asyncio.sleep(0)
+        await broker.drain()
+        assert nodes[0].is_leader
+        assert not nodes[1].is_leader
+        assert await nodes[1].request("routes", {"route": 3}) == {"result": "ok"}
+        await broker.drain()
+        assert handled == [3]
+        assert announced == [[3]]
+        for cluster_node in nodes:
+            await cluster_node.stop()
+
+    asyncio.run(run())
+
+
+def test_out_of_order_changes_are_discarded() -> None:
+    """Test that a replicated change is only applied to the fields that have not been changed more recently."""
+
+    async def run() -> None:
+        manager = StateManager()
+        node = ClusterNode(manager, lambda topic, payload: None, node_id="c")  # noqa: ARG005
+        await manager.add_state(BlockDetectorRecord(topic="bd/1", model={"id": 1}))
+
+        def message(node_id: str, stamp: float, diff: dict) -> bytes:
+            return json.dumps({"node": node_id, "topic": "bd/1", "stamp": stamp, "diff": diff}).encode()
+
+        await node.receive(f"{node.prefix}/state", message("b", 2, {"state": "off"}))
+        await node.receive(f"{node.prefix}/state", message("a", 1, {"state": "on"}))
+        assert manager.get("bd/1").state == "off"
+        assert node.applied == 1
+        assert node.discarded == 1
+        await node.receive(f"{node.prefix}/state", message("a", 2, {"state": "on"}))
+        assert manager.get("bd/1").state == "off"
+        await node.receive(f"{node.prefix}/state", message("b", 3, {"state": "on"}))
+        assert manager.get("bd/1").state == "on"
+        manager.replicator = node.replicate
+        await manager.update_state("bd/1", {"state": "OFF"})
+        await node.receive(f"{node.prefix}/state", message("a", 3.5, {"state": "on"}))
+        assert manager.get("bd/1").state == "off"
+
+    asyncio.run(run())
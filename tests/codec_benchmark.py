@@ -0,0 +1,82 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Microbenchmark comparing the available JSON codec backends.
+
+Run with `python codec_benchmark.py [number of records]` from the tests directory.
+"""
+
+import sys
+from timeit import timeit
+
+from mr_fat_controller.codec import BACKENDS
+from mr_fat_controller.state import BlockDetectorRecord, PointsRecord, SignalRecord, TrainRecord
+
+
+def build_payloads(size: int) -> dict[str, object]:
+    """Build the payloads to benchmark, for a layout with `size` records of each type."""
+    state = {}
+    for idx in range(size):
+        for record in (
+            BlockDetectorRecord(
+                topic=f"mrfatcontroller/binary_sensor/block-{idx}/state",
+                model={"id": idx, "entity_id": idx, "entity": idx, "signal_automations": [idx]},
+                state="on",
+            ),
+            PointsRecord(
+                topic=f"mrfatcontroller/switch/points-{idx}/state",
+                model={
+                    "id": idx,
+                    "entity_id": idx,
+                    "entity": idx,
+                    "through_state": "OFF",
+                    "diverge_state": "ON",
+                    "signal_automations": [idx],
+                },
+                state="through",
+            ),
+            SignalRecord(
+                topic=f"mrfatcontroller/light/signal-{idx}/state",
+                model={"id": idx, "entity_id": idx, "entity": idx, "signal_automations": [idx]},
+                state="danger",
+            ),
+            TrainRecord(
+                topic=f"mrfatcontroller/train/{idx}/state",
+                model={"id": idx, "entity": idx, "max_speed": 126, "controllers": []},
+                speed=42,
+                functions={str(fn): {"name": f"F{fn}", "state": "off"} for fn in range(10)},
+            ),
+        ):
+            state[record.topic] = record.to_dict()
+    return {
+        "mqtt signal state": {"state": "ON", "color": {"r": 255, "g": 0, "b": 0}},
+        "mqtt train state": {"state": "ON", "speed": 42, "direction": "forward"},
+        "mqtt discovery": {
+            "unique_id": "points-1",
+            "name": "Points 1",
+            "device_class": "switch",
+            "state_topic": "mrfatcontroller/switch/points-1/state",
+            "command_topic": "mrfatcontroller/switch/points-1/set",
+            "device": {"identifiers": ["device-1"], "name": "Device 1", "manufacturer": "Test", "model": "Test"},
+        },
+        "websocket diff": {"mrfatcontroller/train/1/state": {"speed": 42}},
+        "websocket snapshot": state,
+    }
+
+
+def main() -> None:
+    """Run the benchmark and print the time per operation for each backend and payload."""
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 250
+    payloads = build_payloads(size)
+    print(f"{'payload':<20} {'backend':<8} {'encode µs':>12} {'decode µs':>12}")  # noqa: T201
+    for name, payload in payloads.items():
+        number = 10 if name == "websocket snapshot" else 10000
+        for backend, (dumps, loads) in BACKENDS.items():
+            encoded = dumps(payload)
+            encode = timeit(lambda dumps=dumps, payload=payload: dumps(payload), number=number) / number * 1000000
+            decode = timeit(lambda loads=loads, encoded=encoded: loads(encoded), number=number) / number * 1000000
+            print(f"{name:<20} {backend:<8} {encode:>12.2f} {decode:>12.2f}")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""JSON codec tests."""
+
+from mr_fat_controller.codec import BACKENDS
+
+
+def test_backends_are_interchangeable() -> None:
+    """Test that all backends produce bytes that every backend decodes to the same value."""
+    value = {"state": "ON", "color": {"r": 255, "g": 0, "b": 0}, "name": "Signal ä", "speed": 1.5, "list": [None]}
+    for dumps, _ in BACKENDS.values():
+        encoded = dumps(value)
+        assert isinstance(encoded, bytes)
+        for _, loads in BACKENDS.values():
+            assert loads(encoded) == value
+    assert len({dumps({"b": 1, "a": 2}, sort_keys=True) for dumps, _ in BACKENDS.values()}) == 1
@@ -0,0 +1,57 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Metrics tests."""
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+
+from mr_fat_controller.metrics import Counter, Gauge, Histogram, MetricsRegistry, db_query_seconds
+from mr_fat_controller.models import start_query_timer, stop_query_timer
+
+
+def test_render_prometheus_text() -> None:
+    """Test that counters, gauges, and histograms render in the Prometheus text format."""
+    registry = MetricsRegistry()
+    counter = registry.register(Counter("test_total", "A counter.", ("kind",)))
+    gauge = registry.register(Gauge("test_clients", "A gauge."))
+    histogram = registry.register(Histogram("test_seconds", "A histogram.", buckets=(0.1, 1)))
+    counter.inc('st"ate')
+    counter.inc('st"ate', amount=2)
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    assert registry.render().split("\n") == [
+        "# HELP test_total A counter.",
+        "# TYPE test_total counter",
+        'test_total{kind="st\\"ate"} 3',
+        "# HELP test_clients A gauge.",
+        "# TYPE test_clients gauge",
+        "test_clients 1",
+        "# HELP test_seconds A histogram.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        "test_seconds_sum 5.55",
+        "test_seconds_count 3",
+        "",
+    ]
+
+
+def test_query_timer_ignores_failed_queries() -> None:
+    """Test that a failed query is not timed and does not affect the timing of later queries."""
+    engine = create_engine("sqlite://")
+    event.listen(engine, "before_cursor_execute", start_query_timer, named=True)
+    event.listen(engine, "after_cursor_execute", stop_query_timer, named=True)
+    before = sum(db_query_seconds.counts.get((), []))
+    with engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.execute(text("SELECT * FROM missing"))
+        conn.execute(text("SELECT 1"))
+        assert "query_start" not in conn.info
+    assert sum(db_query_seconds.counts.get((), [])) == before + 1
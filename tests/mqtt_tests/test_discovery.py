@@ -0,0 +1,105 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Discovery batching tests."""
+
+import asyncio
+
+from sqlalchemy import select
+
+from mr_fat_controller.models import Entity, db_session
+from mr_fat_controller.mqtt import DiscoveryBatcher, config_hash
+from mr_fat_controller.registry import RegistryEntry, entity_registry
+
+
+def discovery(unique_id: str, state_topic: str, name: str = "Test") -> dict:
+    """Return a discovery message for a binary sensor."""
+    return {
+        "unique_id": unique_id,
+        "name": name,
+        "device_class": "binary_sensor",
+        "state_topic": state_topic,
+        "device": {"identifiers": ["device-1"], "name": "Device"},
+    }
+
+
+def test_discovery_coalesces_and_skips() -> None:
+    """Test that repeated messages for one entity are coalesced and unchanged registered entities are skipped."""
+
+    async def run() -> None:
+        batcher = DiscoveryBatcher(window=60)
+        known = discovery("bd-0", "mrfatcontroller/bd-0/state")
+        batcher._hashes = {"bd-0": config_hash(known)}
+        entity_registry.add(RegistryEntry(1, "bd-0", 1, "mrfatcontroller/bd-0/state", None))
+        await batcher.submit(known)
+        await batcher.submit(discovery("bd-1", "mrfatcontroller/bd-1/state", name="First"))
+        await batcher.submit(discovery("bd-1", "mrfatcontroller/bd-1/state", name="Second"))
+        stats = batcher.stats()
+        assert stats["received"] == 3
+        assert stats["skipped"] == 1
+        assert stats["pending"] == 1
+        assert batcher._pending["bd-1"][0].name == "Second"
+        entity_registry.remove(1)
+        if batcher._task is not None:
+            batcher._task.cancel()
+
+    asyncio.run(run())
+
+
+def test_discovery_batches_upserts(empty_database: None) -> None:  # noqa: ARG001
+    """Test that all pending entities are registered in one batch."""
+
+    async def run() -> None:
+        batcher = DiscoveryBatcher(window=60)
+        for idx in range(3):
+            await batcher.submit(discovery(f"bd-{idx}", f"mrfatcontroller/bd-{idx}/state"))
+        await batcher.flush()
+        assert batcher.stats()["batches"] == 1
+        assert batcher.stats()["upserted"] == 3
+        async with db_session() as dbsession:
+            result = await dbsession.execute(select(Entity.external_id).order_by(Entity.external_id))
+            assert list(result.scalars()) == ["bd-0", "bd-1", "bd-2"]
+
+    asyncio.run(run())
+
+
+def test_discovery_keeps_entities_on_conflict(empty_database: None) -> None:  # noqa: ARG001
+    """Test that an entity that violates a constraint only rejects itself and not the rest of its batch."""
+
+    async def run() -> None:
+        batcher = DiscoveryBatcher(window=60)
+        await batcher.submit(discovery("bd-1", "mrfatcontroller/bd-1/state"))
+        await batcher.submit(discovery("bd-2", "mrfatcontroller/bd-1/state"))
+        await batcher.submit(discovery("bd-3", "mrfatcontroller/bd-3/state"))
+        await batcher.flush()
+        assert batcher.stats()["rejected"] == 1
+        assert batcher.stats()["upserted"] == 2
+        async with db_session() as dbsession:
+            result = await dbsession.execute(select(Entity.external_id).order_by(Entity.external_id))
+            assert list(result.scalars()) == ["bd-1", "bd-3"]
+
+    asyncio.run(run())
+
+
+def test_discovery_backs_off_loading_hashes(monkeypatch) -> None:
+    """Test that loading the configuration hashes is not retried for every message after it has failed."""
+    attempts = []
+
+    def failing_session() -> None:
+        attempts.append(1)
+        raise ConnectionRefusedError
+
+    async def run() -> None:
+        batcher = DiscoveryBatcher(window=60, retry_delay=60)
+        for idx in range(3):
+            await batcher.submit(discovery(f"bd-{idx}", f"mrfatcontroller/bd-{idx}/state"))
+        assert len(attempts) == 1
+        assert batcher.stats()["pending"] == 3
+        batcher._hashes_retry_at = 0
+        await batcher.submit(discovery("bd-3", "mrfatcontroller/bd-3/state"))
+        assert len(attempts) == 2
+        if batcher._task is not None:
+            batcher._task.cancel()
+
+    monkeypatch.setattr("mr_fat_controller.mqtt.db_session", failing_session)
+    asyncio.run(run())
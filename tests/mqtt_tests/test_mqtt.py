@@ -0,0 +1,127 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""MQTT publisher and ingestion tests."""
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+from mr_fat_controller.mqtt import STATE_MODELS, IngestionPipeline, MqttPublisher, rebuild_stats, recalculate_state
+from mr_fat_controller.state import BlockDetectorRecord, state_manager
+
+
+def test_publisher_queue_drops_oldest() -> None:
+    """Test that a full publishing queue drops the oldest message without waiting."""
+    publisher = MqttPublisher(queue_size=2)
+    publisher.publish("test/1", "1")
+    publisher.publish("test/2", "2")
+    publisher.publish("test/3", "3")
+    stats = publisher.stats()
+    assert stats["queue_depth"] == 2
+    assert stats["dropped"] == 1
+    assert [topic for topic, _, _ in publisher._queue] == ["test/2", "test/3"]
+
+
+def test_ingestion_keeps_topic_order() -> None:
+    """Test that state messages for one topic are handled in order and discovery overflow drops the oldest."""
+
+    async def run() -> None:
+        handled = []
+        discovered = []
+
+        async def state_handler(topic: str, data: dict) -> None:
+            await asyncio.sleep(0)
+            handled.append((topic, data["state"]))
+
+        async def discovery_handler(data: dict) -> None:
+            discovered.append(data["unique_id"])
+
+        pipeline = IngestionPipeline(state_handler, discovery_handler, workers=3, queue_size=2)
+        for idx in range(3):
+            await pipeline.submit("mrfatcontroller/test/discover/config", json.dumps({"unique_id": idx}))
+        pipeline.start()
+        for idx in range(10):
+            await pipeline.submit("mrfatcontroller/test/a/state", json.dumps({"state": idx}))
+            await pipeline.submit("mrfatcontroller/test/b/state", json.dumps({"state": idx}))
+        await asyncio.sleep(0.05)
+        await pipeline.stop()
+        for topic in ("mrfatcontroller/test/a/state", "mrfatcontroller/test/b/state"):
+            assert [state for handled_topic, state in handled if handled_topic == topic] == list(range(10))
+        assert discovered == [1, 2]
+        assert pipeline.stats()["dropped"] == 1
+
+    asyncio.run(run())
+
+
+def test_publisher_drops_invalid_message(monkeypatch) -> None:
+    """Test that a message with an invalid topic is dropped and does not block the following messages."""
+
+    class FakeClient:
+        def __init__(self) -> None:
+            self.sent = []
+
+        async def __aenter__(self) -> "FakeClient":
+            return self
+
+        async def __aexit__(self, *args) -> None:
+            pass
+
+        async def publish(self, topic: str, payload: bytes | str) -> None:
+            if "#" in topic or not topic:
+                msg = f"Invalid topic {topic}"
+                raise ValueError(msg)
+            self.sent.append((topic, payload))
+
+    async def run() -> None:
+        client = FakeClient()
+        monkeypatch.setattr("mr_fat_controller.mqtt.mqtt_client", lambda: client)
+        publisher = MqttPublisher(reconnect_delay=0.01)
+        publisher.publish("test/#", "bad")
+        publisher.publish("test/good", "good")
+        publisher.start()
+        await asyncio.sleep(0.05)
+        await publisher.stop()
+        assert client.sent == [("test/good", "good")]
+        stats = publisher.stats()
+        assert stats["dropped"] == 1
+        assert stats["reconnects"] == 0
+        assert stats["published"] == 1
+
+    asyncio.run(run())
+
+
+def test_recalculate_state_loads_concurrently(monkeypatch) -> None:
+    """Test that the full rebuild loads all types concurrently, replaces the state, and records its timings."""
+
+    async def run() -> None:
+        started = []
+        all_started = asyncio.Event()
+
+        async def wait_for_all(name: str) -> None:
+            started.append(name)
+            if len(started) == len(STATE_MODELS) + 1:
+                all_started.set()
+            await all_started.wait()
+
+        async def load_models(type_: str) -> list:
+            await wait_for_all(type_)
+            if type_ == "power_switch":
+                return [SimpleNamespace(id=1, entity_id=5, entity=SimpleNamespace(state_topic="test/ps/1/state"))]
+            return []
+
+        async def load_registry() -> None:
+            await wait_for_all("registry")
+
+        monkeypatch.setattr("mr_fat_controller.mqtt.load_models", load_models)
+        monkeypatch.setattr("mr_fat_controller.mqtt.load_registry", load_registry)
+        await state_manager.add_state(BlockDetectorRecord(topic="test/stale/state", model={"id": 9}))
+        rebuilds = rebuild_stats["rebuilds"]
+        await asyncio.wait_for(recalculate_state(), 1)
+        assert set(state_manager.state) == {"test/ps/1/state"}
+        assert state_manager.get("test/ps/1/state").model == {"id": 1, "entity_id": 5}
+        assert rebuild_stats["rebuilds"] == rebuilds + 1
+        assert rebuild_stats["models"] == 1
+        await state_manager.remove_state("test/ps/1/state")
+
+    asyncio.run(run())
@@ -0,0 +1,31 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Entity registry tests."""
+
+from mr_fat_controller.registry import EntityRegistry, RegistryEntry
+
+
+def test_registry_lookups() -> None:
+    """Test that entries can be found by all their keys and are removed with their device."""
+    registry = EntityRegistry()
+    entry = RegistryEntry(
+        entity_id=1,
+        external_id="points-1",
+        device_id=2,
+        state_topic="mrfatcontroller/points/points-1/state",
+        command_topic="mrfatcontroller/points/points-1/set",
+        model_type="points",
+        model_id=3,
+        through_state="ON",
+        diverge_state="OFF",
+    )
+    registry.add(entry)
+    assert registry.get(1) is entry
+    assert registry.find("points", 3) is entry
+    assert registry.find_by_external_id("points-1") is entry
+    assert registry.find_by_state_topic("mrfatcontroller/points/points-1/state") is entry
+    assert registry.find_by_command_topic("mrfatcontroller/points/points-1/set") is entry
+    registry.remove_device(2)
+    assert len(registry) == 0
+    assert registry.find("points", 3) is None
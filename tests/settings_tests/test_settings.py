@@ -0,0 +1,31 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""Settings tests."""
+
+import pytest
+
+from mr_fat_controller.settings import Settings
+
+
+@pytest.mark.parametrize(
+    ("name", "value", "group", "field", "expected"),
+    [
+        ("MFC_STATE_JOURNAL_PATH", "/tmp/state.json", "state", "journal_path", "/tmp/state.json"),  # noqa: S108
+        ("MFC_STATE_HISTORY_SIZE", "42", "state", "history_size", 42),
+        ("MFC_MQTT_PUBLISH_QUEUE_SIZE", "42", "mqtt", "publish_queue_size", 42),
+        ("MFC_AUTOMATION_MAX_LAG", "2.5", "automation", "max_lag", 2.5),
+        ("MFC_MQTT_HOST", "broker", "mqtt", "host", "broker"),
+    ],
+)
+def test_nested_settings_from_env(
+    monkeypatch: pytest.MonkeyPatch,
+    name: str,
+    value: str,
+    group: str,
+    field: str,
+    expected: str | float,
+) -> None:
+    """Test that nested settings whose names contain an underscore are read from the environment."""
+    monkeypatch.setenv(name, value)
+    assert getattr(getattr(Settings(), group), field) == expected  # pyright: ignore[reportCallIssue]
@@ -0,0 +1,78 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""State reducer tests."""
+
+import pytest
+
+from mr_fat_controller.state.records import (
+    BlockDetectorRecord,
+    PointsRecord,
+    PowerSwitchRecord,
+    SignalRecord,
+    TrainRecord,
+)
+from mr_fat_controller.state.reducers import Reducer, reducers
+
+
+def test_reducer_is_abstract() -> None:
+    """Test that a reducer must implement `reduce`."""
+    with pytest.raises(TypeError):
+        Reducer()  # type: ignore
+
+
+def test_all_types_are_registered() -> None:
+    """Test that a reducer is registered for every default state type."""
+    assert set(reducers) == {"block_detector", "points", "power_switch", "signal", "train"}
+
+
+def test_block_detector_reducer() -> None:
+    """Test that block detector states are mapped and unknown states ignored."""
+    record = BlockDetectorRecord(topic="bd/1", model={"id": 1})
+    assert reducers["block_detector"](record, {"state": "ON"}) == {"state": "on"}
+    assert reducers["block_detector"](record, {"state": "ON"}) == {}
+    assert reducers["block_detector"](record, {"state": "OFF"}) == {"state": "off"}
+    assert reducers["block_detector"](record, {"state": "BROKEN"}) == {}
+    assert record.state == "off"
+
+
+def test_points_reducer() -> None:
+    """Test that points states are mapped through the points' configured through and diverge states."""
+    record = PointsRecord(topic="points/1", model={"id": 1, "through_state": "OFF", "diverge_state": "ON"})
+    assert reducers["points"](record, {"state": "OFF"}) == {"state": "through"}
+    assert reducers["points"](record, {"state": "ON"}) == {"state": "diverge"}
+    assert reducers["points"](record, {"state": "MOVING"}) == {"state": "unknown"}
+
+
+def test_power_switch_reducer() -> None:
+    """Test that power switch states are mapped and unknown states ignored."""
+    record = PowerSwitchRecord(topic="power/1", model={"id": 1})
+    assert reducers["power_switch"](record, {"state": "ON"}) == {"state": "on"}
+    assert reducers["power_switch"](record, {"state": "UNKNOWN"}) == {"state": "unknown"}
+    assert reducers["power_switch"](record, {"state": "BROKEN"}) == {}
+
+
+def test_signal_reducer() -> None:
+    """Test that signal aspects are derived from the colour channels above the threshold."""
+    record = SignalRecord(topic="signal/1", model={"id": 1})
+    assert reducers["signal"](record, {"state": "ON", "color": {"r": 255, "g": 0, "b": 0}}) == {"state": "danger"}
+    assert reducers["signal"](record, {"state": "ON", "color": {"r": 0, "g": 255, "b": 0}}) == {"state": "clear"}
+    assert reducers["signal"](record, {"state": "ON", "color": {"r": 128, "g": 128, "b": 0}}) == {}
+    assert reducers["signal"](record, {"state": "ON"}) == {}
+    assert reducers["signal"](record, {"state": "OFF"}) == {"state": "off"}
+
+
+def test_train_reducer() -> None:
+    """Test that only the train fields present in the payload are changed."""
+    record = TrainRecord(topic="train/1", model={"id": 1})
+    assert reducers["train"](record, {"speed": 20, "direction": "reverse"}) == {"speed": 20, "direction": "reverse"}
+    assert reducers["train"](record, {"state": "OFF", "functions": {"f0": {"state": "on"}}}) == {
+        "state": "off",
+        "functions": {"f0": {"state": "on"}},
+    }
+    assert record.values() == {
+        "state": "off",
+        "speed": 20,
+        "direction": "reverse",
+        "functions": {"f0": {"state": "on"}},
+    }
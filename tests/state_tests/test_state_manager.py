@@ -0,0 +1,356 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""State manager tests."""
+
+import asyncio
+import json
+from pathlib import Path
+from time import monotonic
+
+from mr_fat_controller.state import (
+    BlockDetectorRecord,
+    PointsRecord,
+    RingBuffer,
+    StateChange,
+    StateManager,
+    Subscription,
+    TrainRecord,
+)
+from mr_fat_controller.state.journal import StateJournal
+
+
+def test_slow_listener_does_not_block() -> None:
+    """Test that a slow listener does not delay the other listeners."""
+
+    async def run() -> None:
+        manager = StateManager()
+        fast_changes = []
+        slow_started = asyncio.Event()
+        release_slow = asyncio.Event()
+
+        async def fast_listener(state: dict, change: StateChange) -> None:  # noqa: ARG001
+            fast_changes.append(change.topics)
+
+        async def slow_listener(state: dict, change: StateChange) -> None:  # noqa: ARG001
+            slow_started.set()
+            await release_slow.wait()
+
+        await manager.add_listener(slow_listener)
+        await manager.add_listener(fast_listener)
+        await slow_started.wait()
+        await manager.add_state(BlockDetectorRecord(topic="test/block/state", model={"id": 1, "entity_id": 1}))
+        await asyncio.sleep(0.01)
+        assert fast_changes == [None, {"test/block/state"}]
+        release_slow.set()
+        await manager.remove_listener(slow_listener)
+        await manager.remove_listener(fast_listener)
+
+    asyncio.run(run())
+
+
+def test_listener_overflow_collapses_to_snapshot() -> None:
+    """Test that an overflowing listener queue is collapsed into a full snapshot."""
+
+    async def run() -> None:
+        manager = StateManager(listener_queue_size=2, listener_overflow="snapshot")
+        changes = []
+
+        async def listener(state: dict, change: StateChange) -> None:  # noqa: ARG001
+            changes.append(change.topics)
+
+        await manager.add_listener(listener)
+        await asyncio.sleep(0.01)
+        for idx in range(3):
+            await manager.add_state(BlockDetectorRecord(topic=f"test/{idx}/state", model={"id": idx, "entity_id": idx}))
+        assert manager.listener_stats()[0]["dropped"] == 3
+        await asyncio.sleep(0.01)
+        assert changes == [None, None]
+        await manager.remove_listener(listener)
+
+    asyncio.run(run())
+
+
+def test_record_indexes() -> None:
+    """Test looking up records by model and by entity."""
+
+    async def run() -> None:
+        manager = StateManager()
+        points = PointsRecord(
+            topic="test/points/state", model={"id": 3, "entity_id": 7, "through_state": "T", "diverge_state": "D"}
+        )
+        train = TrainRecord(topic="test/train/state", model={"id": 3, "entity": 8})
+        await manager.add_state(points)
+        await manager.add_state(train)
+        assert manager.find("points", 3) is points
+        assert manager.find("train", 3) is train
+        assert manager.find_by_entity(8) is train
+        await manager.update_state("test/points/state", {"state": "D"})
+        assert manager.serialize("test/points/state") == {
+            "test/points/state": {"type": "points", "model": points.model, "stale": False, "state": "diverge"}
+        }
+        await manager.clear_state()
+        assert manager.find("points", 3) is None
+
+    asyncio.run(run())
+
+
+def test_resume_from_sequence() -> None:
+    """Test that a resuming listener only receives the changes since its last sequence."""
+
+    async def run() -> None:
+        manager = StateManager(change_log_size=2)
+        changes = []
+
+        async def listener(state: dict, change: StateChange) -> None:  # noqa: ARG001
+            changes.append(change)
+
+        for idx in range(3):
+            await manager.add_state(BlockDetectorRecord(topic=f"test/{idx}/state", model={"id": idx, "entity_id": idx}))
+        await manager.add_listener(listener, resume_from=1)
+        await manager.add_listener(listener, resume_from=0)
+        await manager.add_listener(listener, resume_from=3)
+        await asyncio.sleep(0.01)
+        assert changes == [
+            StateChange(3, frozenset({"test/1/state", "test/2/state"})),
+            StateChange(3, None),
+            StateChange(3, frozenset()),
+        ]
+        await manager.remove_listener(listener)
+
+    asyncio.run(run())
+
+
+def test_coalesce_changes() -> None:
+    """Test that changes within the coalescing window are notified together, except for opted-out types."""
+
+    async def run() -> None:
+        manager = StateManager(coalesce_window=0.05, coalesce_windows={"block_detector": 0})
+        changes = []
+
+        async def listener(state: dict, change: StateChange) -> None:  # noqa: ARG001
+            changes.append(change.topics)
+
+        await manager.add_state(TrainRecord(topic="test/train1/state", model={"id": 1, "entity": 1}), notify=False)
+        await manager.add_state(TrainRecord(topic="test/train2/state", model={"id": 2, "entity": 2}), notify=False)
+        await manager.add_state(BlockDetectorRecord(topic="test/block/state", model={"id": 1, "entity_id": 3}))
+        await manager.add_listener(listener)
+        await asyncio.sleep(0.01)
+        for speed in range(10):
+            await manager.update_state("test/train1/state", {"speed": speed})
+        await manager.update_state("test/train2/state", {"speed": 5})
+        await manager.update_state("test/block/state", {"state": "ON"})
+        await asyncio.sleep(0.01)
+        assert changes == [None, {"test/block/state"}]
+        await asyncio.sleep(0.1)
+        assert changes == [None, {"test/block/state"}, {"test/train1/state", "test/train2/state"}]
+        assert manager.state["test/train1/state"].speed == 9
+        await manager.remove_listener(listener)
+
+    asyncio.run(run())
+
+
+def test_field_level_diffs() -> None:
+    """Test that listeners receive only the changed fields and no notification for unchanged state."""
+
+    async def run() -> None:
+        manager = StateManager()
+        changes = []
+
+        async def listener(state: dict, change: StateChange) -> None:  # noqa: ARG001
+            changes.append(change)
+
+        await manager.add_state(TrainRecord(topic="test/train/state", model={"id": 1, "entity": 1}), notify=False)
+        await manager.add_listener(listener)
+        await asyncio.sleep(0.01)
+        await manager.update_state("test/train/state", {"state": "ON", "speed": 10, "direction": "forward"})
+        await asyncio.sleep(0.01)
+        await manager.update_state("test/train/state", {"state": "ON", "speed": 10, "direction": "forward"})
+        await asyncio.sleep(0.01)
+        assert changes == [
+            StateChange(0, None),
+            StateChange(1, frozenset({"test/train/state"}), {"test/train/state": {"speed": 10}}),
+        ]
+        await manager.remove_listener(listener)
+
+    asyncio.run(run())
+
+
+def test_subscription_routing() -> None:
+    """Test that listeners are only notified of changes they are subscribed to."""
+
+    async def run() -> None:
+        manager = StateManager()
+        by_type = []
+        by_model = []
+
+        async def type_listener(state: dict, change: StateChange) -> None:  # noqa: ARG001
+            by_type.append(change.topics)
+
+        async def model_listener(state: dict, change: StateChange) -> None:  # noqa: ARG001
+            by_model.append(change.topics)
+
+        await manager.add_state(TrainRecord(topic="test/train1/state", model={"id": 1, "entity": 1}), notify=False)
+        await manager.add_state(TrainRecord(topic="test/train2/state", model={"id": 2, "entity": 2}), notify=False)
+        await manager.add_state(BlockDetectorRecord(topic="test/block/state", model={"id": 1, "entity_id": 3}))
+        await manager.add_listener(type_listener, subscription=Subscription(types=frozenset(["block_detector"])))
+        await manager.add_listener(model_listener, subscription=Subscription(models=frozenset([("train", 2)])))
+        await asyncio.sleep(0.01)
+        await manager.update_state("test/train1/state", {"speed": 10})
+        await manager.update_state("test/train2/state", {"speed": 10})
+        await manager.update_state("test/block/state", {"state": "ON"})
+        await asyncio.sleep(0.01)
+        assert by_type == [None, {"test/block/state"}]
+        assert by_model == [None, {"test/train2/state"}]
+        await manager.remove_listener(type_listener)
+        await manager.remove_listener(model_listener)
+
+    asyncio.run(run())
+
+
+def test_journal_restores_stale_state(tmp_path: Path) -> None:
+    """Test that the journal restores the last known state, marked as stale until confirmed."""
+
+    async def run() -> None:
+        manager = StateManager()
+        journal = StateJournal(tmp_path / "state.json")
+        await journal.start(manager)
+        await manager.add_state(BlockDetectorRecord(topic="test/block/state", model={"id": 1, "entity_id": 1}))
+        await manager.update_state("test/block/state", {"state": "ON"})
+        await asyncio.sleep(0.01)
+        await journal.stop()
+
+        manager = StateManager()
+        journal = StateJournal(tmp_path / "state.json")
+        await journal.start(manager)
+        await manager.add_state(BlockDetectorRecord(topic="test/block/state", model={"id": 1, "entity_id": 1}))
+        assert manager.state["test/block/state"].state == "on"
+        assert manager.state["test/block/state"].stale
+        await manager.update_state("test/block/state", {"state": "ON"})
+        assert not manager.state["test/block/state"].stale
+        await journal.stop()
+
+    asyncio.run(run())
+
+
+def test_journal_buffers_and_compacts(tmp_path: Path) -> None:
+    """Test that changes are only written when flushed and that a large log is compacted into the snapshot."""
+
+    async def run() -> None:
+        manager = StateManager()
+        journal = StateJournal(tmp_path / "state.json", flush_interval=60, compact_threshold=2)
+        await journal.start(manager)
+        await manager.add_state(BlockDetectorRecord(topic="test/block/state", model={"id": 1, "entity_id": 1}))
+        await manager.update_state("test/block/state", {"state": "ON"})
+        await manager.update_state("test/block/state", {"state": "OFF"})
+        await asyncio.sleep(0.01)
+        assert not journal.log_path.exists()
+        await journal.flush()
+        assert journal.log_path.read_bytes().count(b"\n") == 1
+        await manager.add_state(BlockDetectorRecord(topic="test/block2/state", model={"id": 2, "entity_id": 2}))
+        await manager.add_state(BlockDetectorRecord(topic="test/block3/state", model={"id": 3, "entity_id": 3}))
+        await asyncio.sleep(0.01)
+        await journal.flush()
+        assert journal.log_path.read_bytes() == b""
+        assert set(journal.load()) == {"test/block/state", "test/block2/state", "test/block3/state"}
+        await journal.stop()
+
+    asyncio.run(run())
+
+
+def test_journal_drops_topics_removed_by_a_full_rebuild(tmp_path: Path) -> None:
+    """Test that topics silently removed or never added during a full rebuild are dropped from the journal."""
+
+    async def run() -> None:
+        manager = StateManager()
+        journal = StateJournal(tmp_path / "state.json", flush_interval=60)
+        await journal.start(manager)
+        for idx in range(1, 4):
+            await manager.add_state(
+                BlockDetectorRecord(topic=f"test/block{idx}/state", model={"id": idx, "entity_id": idx})
+            )
+        await journal.stop()
+
+        manager = StateManager()
+        journal = StateJournal(tmp_path / "state.json", flush_interval=60)
+        await journal.start(manager)
+        for idx in range(1, 3):
+            await manager.add_state(
+                BlockDetectorRecord(topic=f"test/block{idx}/state", model={"id": idx, "entity_id": idx}), notify=False
+            )
+        await manager.remove_state("test/block2/state", notify=False)
+        manager.discard_restored()
+        await manager._notify(None)
+        await asyncio.sleep(0.01)
+        await journal.flush()
+        assert set(journal.load()) == {"test/block1/state"}
+        await journal.stop()
+
+    asyncio.run(run())
+
+
+def test_history_ring_buffer() -> None:
+    """Test that the history is bounded, can be queried as a window and downsampled, and is cleared with the state."""
+    buffer = RingBuffer(4)
+    for idx in range(6):
+        buffer.append(float(idx), float(idx * 10))
+    times, values = buffer.ordered()
+    assert list(times) == [2.0, 3.0, 4.0, 5.0]
+    assert list(values) == [20.0, 30.0, 40.0, 50.0]
+    assert list(buffer.window(3, 4)[1]) == [30.0, 40.0]
+    assert buffer.downsample(2, 6, 2, "mean") == ([2.0, 4.0], [25.0, 45.0])
+    assert buffer.downsample(0, 8, 4, "last")[1][3] == 50.0
+
+    async def run() -> None:
+        manager = StateManager(history_size=10)
+        await manager.add_state(BlockDetectorRecord(topic="test/block/state", model={"id": 1, "entity_id": 1}))
+        await manager.update_state("test/block/state", {"state": "ON"})
+        await manager.update_state("test/block/state", {"state": "ON"})
+        await manager.update_state("test/block/state", {"state": "OFF"})
+        times, values = manager.history.buffers["test/block/state"].ordered()
+        assert list(values)[1:] == [1.0, 0.0]
+        assert times[-1] <= monotonic()
+        await manager.clear_state()
+        assert manager.history.buffers == {}
+
+    asyncio.run(run())
+
+
+def test_encoded_cache() -> None:
+    """Test that the encoded state is shared until the state changes."""
+
+    async def run() -> None:
+        manager = StateManager()
+        await manager.add_state(BlockDetectorRecord(topic="test/block/state", model={"id": 1, "entity_id": 1}))
+        snapshot = manager.encoded()
+        assert manager.encoded() is snapshot
+        assert json.loads(snapshot) == manager.serialize()
+        await manager.update_state("test/block/state", {"state": "ON"})
+        assert manager.encoded() is not snapshot
+        assert json.loads(manager.encoded()) == manager.serialize()
+        assert json.loads(manager.encoded_topics(["test/block/state"])) == manager.serialize("test/block/state")
+
+    asyncio.run(run())
+
+
+def test_remove_state() -> None:
+    """Test that removing a record notifies the listeners subscribed to its type."""
+
+    async def run() -> None:
+        manager = StateManager()
+        changes = []
+
+        async def listener(state: dict, change: StateChange) -> None:
+            changes.append((change.topics, "test/block/state" in state))
+
+        await manager.add_state(BlockDetectorRecord(topic="test/block/state", model={"id": 1, "entity_id": 1}))
+        await manager.add_listener(listener, subscription=Subscription(types=frozenset(["block_detector"])))
+        await asyncio.sleep(0.01)
+        await manager.remove_state("test/block/state")
+        await asyncio.sleep(0.01)
+        assert changes[-1] == (frozenset(["test/block/state"]), False)
+        assert manager.find("block_detector", 1) is None
+        assert manager.find_by_entity(1) is None
+        assert manager.serialize() == {}
+
+    asyncio.run(run())
@@ -0,0 +1,91 @@
+# SPDX-FileCopyrightText: 2023-present Mark Hall <mark.hall@work.room3b.eu>
+#
+# SPDX-License-Identifier: MIT
+"""MQTT traffic recording and replay tests."""
+
+import asyncio
+from pathlib import Path
+from time import monotonic
+from types import SimpleNamespace
+
+from mr_fat_controller.mqtt import mqtt_ingestion
+from mr_fat_controller.traffic import TrafficWriter, read_traffic, record_traffic, replay, replay_traffic
+
+
+def test_record_and_replay(tmp_path: Path) -> None:
+    """Test that recorded messages are read back in order and replayed with scaled timing."""
+    path = tmp_path / "traffic.rec"
+    with TrafficWriter(path) as writer:
+        writer.write(0, "mrfatcontroller/binary_sensor/bd1/state", b'{"state": "ON"}')
+        writer.write(0.2, "mrfatcontroller/binary_sensor/bd1/state", b'{"state": "OFF"}')
+    messages = list(read_traffic(path))
+    assert messages == [
+        (0, "mrfatcontroller/binary_sensor/bd1/state", b'{"state": "ON"}'),
+        (0.2, "mrfatcontroller/binary_sensor/bd1/state", b'{"state": "OFF"}'),
+    ]
+
+    async def run(speed: float) -> tuple[int, float, list]:
+        received = []
+
+        async def submit(topic: str, payload: bytes) -> None:
+            received.append((topic, payload))
+
+        start = monotonic()
+        count = await replay(messages, submit, speed)
+        return count, monotonic() - start, received
+
+    count, elapsed, received = asyncio.run(run(2))
+    assert count == 2
+    assert 0.09 < elapsed < 0.2
+    assert received == [(topic, payload) for _, topic, payload in messages]
+    count, elapsed, _ = asyncio.run(run(0))
+    assert count == 2
+    assert elapsed < 0.05
+
+
+def test_record_stops_and_returns_count(tmp_path: Path, monkeypatch) -> None:
+    """Test that recording stops when the stop event is set and returns the number of recorded messages."""
+
+    class FakeClient:
+        async def __aenter__(self) -> "FakeClient":
+            return self
+
+        async def __aexit__(self, *args) -> None:
+            pass
+
+        async def subscribe(self, topic: str) -> None:
+            pass
+
+        @property
+        async def messages(self):
+            for idx in range(2):
+                yield SimpleNamespace(topic=SimpleNamespace(value="mrfatcontroller/bd/1/state"), payload=str(idx))
+            stop.set()
+            await asyncio.Event().wait()
+
+    async def run() -> int:
+        return await record_traffic(tmp_path / "traffic.rec", stop=stop)
+
+    monkeypatch.setattr("mr_fat_controller.traffic.mqtt_client", FakeClient)
+    stop = asyncio.Event()
+    assert asyncio.run(run()) == 2
+    assert [payload for _, _, payload in read_traffic(tmp_path / "traffic.rec")] == [b"0", b"1"]
+
+
+def test_direct_replay_skips_discovery(tmp_path: Path, monkeypatch) -> None:
+    """Test that a direct replay without discovery only passes the state messages into the pipeline."""
+    path = tmp_path / "traffic.rec"
+    with TrafficWriter(path) as writer:
+        writer.write(0, "mrfatcontroller/binary_sensor/bd1/config", b'{"unique_id": "bd1"}')
+        writer.write(0, "mrfatcontroller/binary_sensor/bd1/state", b'{"state": "ON"}')
+
+    async def recalculate_state() -> None:
+        pass
+
+    monkeypatch.setattr("mr_fat_controller.traffic.recalculate_state", recalculate_state)
+    received = mqtt_ingestion.received
+    stats = asyncio.run(replay_traffic(path, 0, direct=True, discovery=False))
+    assert stats["messages"] == 1
+    assert stats["ingestion"]["received"] == received + 1
+    assert stats["discovery"]["received"] == 0
+    assert stats["processed_per_second"] > 0